@@ -1,3 +1,4 @@
+import asyncio
 import os
 import re
 import logging
@@ -286,6 +287,23 @@ async def startup_event():
     # Все модели автоматически импортируются в init_db()
     init_db()
     
+    # Общие HTTP-клиенты (пулы соединений к Pollinations, Gemini, Telegram)
+    from .services.http_clients import open_http_clients
+    await open_http_clients()
+    
+    # Прогрев моделей InsightFace в фоне (в пуле CPU-потоков), чтобы первый face swap не ждал загрузку
+    from .services.face_models import FACE_MODELS_WARMUP, warmup_face_models
+    if FACE_MODELS_WARMUP:
+        from .services.cpu_pool import get_cpu_executor
+        asyncio.get_running_loop().run_in_executor(get_cpu_executor(), warmup_face_models)
+    
+    # Задачи, брошенные предыдущим процессом (перезапуск/падение), помечаем как interrupted
+    from .services.tasks import reclaim_expired_tasks
+    try:
+        reclaim_expired_tasks()
+    except Exception as e:
+        logger.error(f"✗ Не удалось проверить брошенные задачи: {e}", exc_info=True)
+    
     # Инициализация завершена - используем локальную аутентификацию
     logger.info("✓ Локальная аутентификация готова")
     
@@ -309,6 +327,8 @@ async def startup_event():
         scheduler.add_job(cleanup_old_drafts, "cron", hour=4, minute=0)
         # Каждый день в 04:10 деактивируем истёкшие подписки
         scheduler.add_job(check_expired_subscriptions, "cron", hour=4, minute=10)
+        # Каждую минуту помечаем задачи с истёкшим lease как interrupted
+        scheduler.add_job(reclaim_expired_tasks, "interval", minutes=1)
         scheduler.start()
         logger.info("✓ Планировщик очистки черновиков запущен (ежедневно в 04:00)")
     except Exception as e:
@@ -383,6 +403,17 @@ async def startup_event():
     print("="*70 + "\n")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Закрываем общие HTTP-клиенты и пул потоков для CPU-операций
+    from .services.http_clients import close_http_clients
+    from .services.cpu_pool import shutdown_cpu_executor
+    await close_http_clients()
+    shutdown_cpu_executor()
+    if scheduler:
+        scheduler.shutdown(wait=False)
+
+
 @app.get("/")
 def root():
     return {"status": "ok", "message": "StoryHero backend running!"}
@@ -397,6 +428,62 @@ def health_db(db: Session = Depends(get_db)):
         return {"db": "error", "detail": str(e)}
 
 
+@app.get("/health/rate_limits")
+def health_rate_limits():
+    # Метрики адаптивных ограничителей запросов к сервисам генерации (окно, очередь, ожидание)
+    from .services.rate_limiter import get_rate_limiter, get_rate_limiter_stats
+    from .services.request_hedging import get_hedging_stats
+    get_rate_limiter("pollinations")
+    return {"rate_limits": get_rate_limiter_stats(), "hedging": get_hedging_stats()}
+
+
+@app.get("/health/image_providers")
+def health_image_providers():
+    # Состояние circuit breaker'ов и статистика провайдеров генерации изображений
+    from .services.image_providers import get_provider_stats
+    return {"image_providers": get_provider_stats()}
+
+
+@app.get("/health/cpu_pool")
+def health_cpu_pool():
+    # Очередь пула потоков для face swap, верификации лиц и обработки изображений
+    from .services.cpu_pool import get_cpu_pool_stats
+    return {"cpu_pool": get_cpu_pool_stats()}
+
+
+@app.get("/health/face_models")
+def health_face_models():
+    # Загруженные модели InsightFace, их объём и настройки потоков ONNX Runtime
+    from .services.face_models import get_face_model_stats
+    from .services.face_detection_cache import get_face_detection_cache_stats
+    from .services.source_face_cache import get_source_face_cache_stats
+    from .services.face_inference_batcher import get_face_batcher_stats
+    return {
+        "face_models": get_face_model_stats(),
+        "face_detection_cache": get_face_detection_cache_stats(),
+        "source_face_cache": get_source_face_cache_stats(),
+        "embedding_batcher": get_face_batcher_stats(),
+    }
+
+
+@app.get("/health/image_cache")
+def health_image_cache():
+    # Метрики кэша сгенерированных изображений (попадания/промахи, размер)
+    from .services.image_cache import get_image_cache_stats
+    return {"image_cache": get_image_cache_stats()}
+
+
+@app.get("/health/print_assets")
+def health_print_assets():
+    # Метрики кэша подготовленных для печати изображений страниц PDF (диск и память процесса)
+    from .services.print_asset_cache import get_print_asset_cache_stats
+    from .services.pdf_service import get_pdf_page_cache_stats
+    return {
+        "print_asset_cache": get_print_asset_cache_stats(),
+        "pdf_page_cache": get_pdf_page_cache_stats(),
+    }
+
+
 # =============================================================================
 # CORS Test Endpoint
 # =============================================================================
@@ -1,7 +1,7 @@
 """
 Модель задачи генерации книги
 """
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.sql import func
 from ..db import Base
@@ -15,7 +15,7 @@ class Task(Base):
     book_id = Column(UUID(as_uuid=True), ForeignKey("books.id", ondelete="SET NULL"), nullable=True)  # ID книги, если создана
     
     # Статус задачи
-    status = Column(String, nullable=False, default="pending")  # pending, running, success, error
+    status = Column(String, nullable=False, default="pending", index=True)  # pending, running, success, error, interrupted
     
     # Метаданные задачи
     meta = Column(JSONB, nullable=True)  # Метаданные для проверки дубликатов
@@ -27,6 +27,17 @@ class Task(Base):
     result = Column(JSONB, nullable=True)  # Результат выполнения
     error = Column(Text, nullable=True)  # Сообщение об ошибке
     
+    # Очередь задач для отдельного воркера (python -m app.worker)
+    task_name = Column(String, nullable=True)  # Имя зарегистрированной функции задачи
+    payload = Column(JSONB, nullable=True)  # Сериализованные аргументы задачи (args/kwargs)
+    
+    # Аренда (lease) задачи воркером: пока воркер жив, он продлевает heartbeat_at и lease_expires_at.
+    # Задача в статусе running с истёкшим lease считается брошенной и может быть переподхвачена.
+    worker_id = Column(String, nullable=True)  # hostname:pid процесса, выполняющего задачу
+    attempts = Column(Integer, nullable=False, default=0)  # Сколько раз задача запускалась
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    
     # Временные метки
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     started_at = Column(DateTime(timezone=True), nullable=True)
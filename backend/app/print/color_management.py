@@ -0,0 +1,148 @@
+"""
+Управление цветом для печати: RGB → CMYK через ICC профиль ISO Coated v2 (ECI).
+
+Профили и трансформация ImageCms создаются один раз на процесс и переиспользуются всеми
+страницами (раньше color_pipeline строил их заново для каждого изображения, а skin_tone_service
+каждый раз заново читал ICC-файл). ImageCmsTransform потокобезопасна для apply, поэтому
+страницы можно конвертировать параллельно.
+
+Опционально (PRINT_COLOR_LUT=true) конвертация выполняется по предвычисленной 3D LUT
+(PRINT_COLOR_LUT_SIZE узлов на канал, трилинейная интерполяция в ImageFilter.Color3DLUT).
+LUT строится один раз из той же ICC-трансформации; расхождение с точной конвертацией
+и пропускную способность показывает app/scripts/benchmark_color_pipeline.py.
+"""
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+try:
+    from PIL import ImageCms
+    IMAGE_CMS_AVAILABLE = True
+except ImportError:
+    IMAGE_CMS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+_ICC_FILENAME = "ISOcoated_v2_300_eci.icc"
+# backend/assets/icc (color_pipeline) и app/assets/icc (skin_tone_service)
+_ICC_CANDIDATES = (
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "assets", "icc", _ICC_FILENAME),
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "icc", _ICC_FILENAME),
+)
+PRINT_ICC_PROFILE_PATH = os.getenv("PRINT_ICC_PROFILE_PATH", "")
+PRINT_COLOR_LUT = os.getenv("PRINT_COLOR_LUT", "false").lower() == "true"
+PRINT_COLOR_LUT_SIZE = int(os.getenv("PRINT_COLOR_LUT_SIZE", "33"))
+
+_lock = threading.Lock()
+# path -> трансформация (None — не удалось создать, повторно не пытаемся)
+_transforms: Dict[str, Optional["ImageCms.ImageCmsTransform"]] = {}
+_luts: Dict[Tuple[str, int], object] = {}
+
+
+def find_icc_profile_path() -> Optional[str]:
+    """Путь к ICC профилю ISO Coated v2 или None, если профиль не найден."""
+    for path in ((PRINT_ICC_PROFILE_PATH,) if PRINT_ICC_PROFILE_PATH else _ICC_CANDIDATES):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def get_rgb_to_cmyk_transform(profile_path: Optional[str] = None):
+    """Общая трансформация sRGB → CMYK (ICC) или None, если ICC недоступен."""
+    profile_path = profile_path or find_icc_profile_path()
+    if not profile_path or not IMAGE_CMS_AVAILABLE:
+        return None
+    if profile_path in _transforms:
+        return _transforms[profile_path]
+    with _lock:
+        if profile_path not in _transforms:
+            try:
+                transform = ImageCms.ImageCmsTransform(
+                    ImageCms.createProfile("sRGB"),
+                    ImageCms.ImageCmsProfile(profile_path),
+                    "RGB",
+                    "CMYK"
+                )
+                logger.info(f"✓ ICC трансформация RGB->CMYK создана: {profile_path}")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось создать ICC трансформацию ({profile_path}): {e}. Используется стандартная конвертация.")
+                transform = None
+            _transforms[profile_path] = transform
+    return _transforms[profile_path]
+
+
+def _build_lut(transform, size: int):
+    import numpy as np
+    from PIL import ImageFilter
+
+    # Узлы сетки в порядке Color3DLUT: R меняется быстрее всего, затем G, затем B
+    axis = np.round(np.linspace(0, 255, size)).astype(np.uint8)
+    b, g, r = np.meshgrid(axis, axis, axis, indexing="ij")
+    grid = np.stack([r, g, b], axis=-1).reshape(1, size ** 3, 3)
+    cmyk = np.asarray(transform.apply(Image.fromarray(grid)), dtype=np.float32) / 255.0
+    return ImageFilter.Color3DLUT(size, cmyk.reshape(-1), channels=4, target_mode="CMYK")
+
+
+def get_rgb_to_cmyk_lut(profile_path: Optional[str] = None, size: Optional[int] = None):
+    """Предвычисленная 3D LUT для ICC-трансформации (None, если ICC недоступен)."""
+    profile_path = profile_path or find_icc_profile_path()
+    size = size or PRINT_COLOR_LUT_SIZE
+    transform = get_rgb_to_cmyk_transform(profile_path)
+    if transform is None:
+        return None
+    key = (profile_path, size)
+    if key not in _luts:
+        with _lock:
+            if key not in _luts:
+                try:
+                    _luts[key] = _build_lut(transform, size)
+                    logger.info(f"✓ 3D LUT RGB->CMYK построена: {size}³ узлов")
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось построить 3D LUT: {e}. Используется ICC трансформация.")
+                    _luts[key] = None
+    return _luts[key]
+
+
+def convert_rgb_to_cmyk(image: Image.Image, use_icc: bool = True, use_lut: Optional[bool] = None) -> Tuple[Image.Image, str]:
+    """
+    Конвертировать изображение в CMYK.
+
+    Returns:
+        Tuple[cmyk_image, method]: method — "lut", "icc" или "standard" (без ICC профиля)
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if use_icc:
+        if use_lut if use_lut is not None else PRINT_COLOR_LUT:
+            lut = get_rgb_to_cmyk_lut()
+            if lut is not None:
+                return image.filter(lut), "lut"
+        transform = get_rgb_to_cmyk_transform()
+        if transform is not None:
+            try:
+                return transform.apply(image), "icc"
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка при использовании ICC профиля: {e}. Используется стандартная конвертация.")
+    return image.convert("CMYK"), "standard"
+
+
+def get_color_conversion_id(use_icc: bool = True) -> str:
+    """
+    Идентификатор способа конвертации RGB → CMYK для ключей кэшей обработанных изображений.
+
+    Меняется при замене ICC профиля (путь, размер, mtime) и при переключении LUT.
+    """
+    profile_path = find_icc_profile_path() if use_icc else None
+    if not profile_path or get_rgb_to_cmyk_transform(profile_path) is None:
+        return "standard"
+    try:
+        st = os.stat(profile_path)
+        profile_id = f"{os.path.basename(profile_path)}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        profile_id = os.path.basename(profile_path)
+    if PRINT_COLOR_LUT and get_rgb_to_cmyk_lut(profile_path) is not None:
+        return f"icc:{profile_id}:lut{PRINT_COLOR_LUT_SIZE}"
+    return f"icc:{profile_id}"
@@ -5,25 +5,50 @@
 import logging
 from io import BytesIO
 from PIL import Image
-try:
-    from PIL import ImageCms
-    IMAGE_CMS_AVAILABLE = True
-except ImportError:
-    IMAGE_CMS_AVAILABLE = False
-import os
 
-logger = logging.getLogger(__name__)
+from .color_management import IMAGE_CMS_AVAILABLE, convert_rgb_to_cmyk, find_icc_profile_path
 
-# Путь к ICC профилю
-ICC_PROFILE_PATH = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
-    "assets", "icc", "ISOcoated_v2_300_eci.icc"
-)
+logger = logging.getLogger(__name__)
 
 
 def get_icc_profile_path() -> str:
-    """Возвращает путь к ICC профилю."""
-    return ICC_PROFILE_PATH
+    """Возвращает путь к ICC профилю (пустая строка, если профиль не найден)."""
+    return find_icc_profile_path() or ""
+
+
+def rgb_image_to_print_safe(img: Image.Image, use_icc: bool = True) -> Image.Image:
+    """
+    Приводит изображение к печатному охвату: RGB -> CMYK (ISO Coated v2) -> RGB.
+    
+    Работает с уже декодированным изображением, без кодирования в JPEG — используется
+    в pdf_service, где изображение декодируется один раз на страницу.
+    
+    Args:
+        img: PIL изображение (любой режим, приводится к RGB)
+        use_icc: Использовать ICC профиль (ISO Coated v2) если доступен
+    
+    Returns:
+        Image.Image: RGB изображение после конвертации через CMYK
+    """
+    # Убеждаемся, что это RGB
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    
+    # Конвертация в CMYK (ICC трансформация создаётся один раз на процесс, см. color_management)
+    cmyk_img, method = convert_rgb_to_cmyk(img, use_icc=use_icc)
+    if method == "lut":
+        logger.debug("🎨 RGB->CMYK конвертация выполнена по 3D LUT профиля ISO Coated v2")
+    elif method == "icc":
+        logger.debug("🎨 RGB->CMYK конвертация выполнена через ICC профиль ISO Coated v2")
+    elif not use_icc:
+        logger.info("🎨 RGB->CMYK конвертация без ICC профиля")
+    elif not IMAGE_CMS_AVAILABLE:
+        logger.warning("⚠️ PIL.ImageCms не доступен. Используется стандартная конвертация.")
+    else:
+        logger.warning("⚠️ ICC профиль не найден. Используется стандартная конвертация.")
+    
+    # Конвертируем CMYK обратно в RGB (ReportLab работает лучше с RGB)
+    return cmyk_img.convert("RGB")
 
 
 def rgb_to_cmyk_print_safe(image_bytes: bytes, use_icc: bool = True) -> bytes:
@@ -35,51 +60,13 @@ def rgb_to_cmyk_print_safe(image_bytes: bytes, use_icc: bool = True) -> bytes:
         use_icc: Использовать ICC профиль (ISO Coated v2) если доступен
     
     Returns:
-        bytes: Байты CMYK изображения в формате TIFF
+        bytes: Байты изображения после CMYK конвертации (RGB JPEG, quality=98)
     """
     try:
-        # Открываем изображение
-        img = Image.open(BytesIO(image_bytes))
-        
-        # Убеждаемся, что это RGB
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-        
-        # Конвертация в CMYK
-        if use_icc and IMAGE_CMS_AVAILABLE and os.path.exists(get_icc_profile_path()):
-            try:
-                # Используем ICC профиль для точной конвертации
-                icc_profile = ImageCms.ImageCmsProfile(get_icc_profile_path())
-                srgb_profile = ImageCms.createProfile("sRGB")
-                
-                # Создаём трансформацию RGB -> CMYK
-                transform = ImageCms.ImageCmsTransform(
-                    srgb_profile,
-                    icc_profile,
-                    "RGB",
-                    "CMYK"
-                )
-                
-                cmyk_img = transform.apply(img)
-                logger.info("🎨 RGB->CMYK конвертация выполнена через ICC профиль ISO Coated v2")
-            except Exception as e:
-                logger.warning(f"⚠️ Ошибка при использовании ICC профиля: {e}. Используется стандартная конвертация.")
-                cmyk_img = img.convert("CMYK")
-        else:
-            # Стандартная конвертация без ICC профиля
-            if not use_icc:
-                logger.info("🎨 RGB->CMYK конвертация без ICC профиля")
-            elif not IMAGE_CMS_AVAILABLE:
-                logger.warning("⚠️ PIL.ImageCms не доступен. Используется стандартная конвертация.")
-            else:
-                logger.warning(f"⚠️ ICC профиль не найден: {get_icc_profile_path()}. Используется стандартная конвертация.")
-            cmyk_img = img.convert("CMYK")
+        rgb_img = rgb_image_to_print_safe(Image.open(BytesIO(image_bytes)), use_icc=use_icc)
         
         # Сохраняем в JPEG с высоким качеством для ReportLab (более эффективно чем TIFF)
-        # Для финального PDF можно использовать JPEG, так как ReportLab конвертирует в CMYK при сохранении
         out = BytesIO()
-        # Конвертируем CMYK обратно в RGB для JPEG (ReportLab работает лучше с RGB)
-        rgb_img = cmyk_img.convert("RGB")
         rgb_img.save(out, format="JPEG", quality=98, optimize=True)
         result = out.getvalue()
         
@@ -90,4 +77,3 @@ def rgb_to_cmyk_print_safe(image_bytes: bytes, use_icc: bool = True) -> bytes:
         logger.error(f"❌ Ошибка при конвертации RGB->CMYK: {e}", exc_info=True)
         # Fallback: возвращаем оригинал
         return image_bytes
-
@@ -0,0 +1,74 @@
+"""
+Векторизованный skin-tone clamp для зоны лица.
+
+Общая реализация для print/skin_tone_safe.apply_skin_tone_clamp_to_image и
+services/skin_tone_service.apply_skin_tone_safe_cmyk: вместо обхода bbox попиксельно в Python
+ограничение CMYK и смешивание с оригиналом по маске выполняются одной операцией NumPy.
+Результат совпадает с попиксельной версией бит в бит (тот же dtype и порядок операций);
+проверка и замер — app/scripts/benchmark_skin_tone_clamp.py.
+"""
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+CHANNELS = ("C", "M", "Y", "K")
+
+
+def preset_bounds(preset: Dict[str, Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Нижние и верхние границы (C, M, Y, K) preset'а из cmyk_presets."""
+    lower = np.array([preset[channel][0] for channel in CHANNELS], dtype=np.float64)
+    upper = np.array([preset[channel][1] for channel in CHANNELS], dtype=np.float64)
+    return lower, upper
+
+
+def clamp_and_blend(
+    cmyk: np.ndarray,
+    mask: np.ndarray,
+    lower: Sequence[float],
+    upper: Sequence[float],
+    region: Tuple[int, int, int, int],
+    threshold: float = 0.0,
+    normalize_percent: bool = False
+) -> int:
+    """
+    Ограничить CMYK пикселей зоны и смешать с оригиналом по весу маски (на месте).
+
+    Args:
+        cmyk: Массив (H, W, 4) float; изменяется на месте
+        mask: Веса маски (H, W) того же типа с плавающей точкой
+        lower, upper: Границы каналов C, M, Y, K в единицах cmyk
+        region: (x1, y1, x2, y2) — обрабатываемая зона
+        threshold: Обрабатываются пиксели с весом маски больше порога
+        normalize_percent: Для пикселей, где хотя бы один канал > 1.0, границы применяются к значениям,
+            делённым на 100 (как clamp_skin_tones); смешивание и подсчёт изменённых пикселей,
+            как и в попиксельной версии, используют исходные значения
+
+    Returns:
+        int: Количество пикселей, у которых clamp изменил значения
+    """
+    height, width = cmyk.shape[:2]
+    x1, y1, x2, y2 = (int(v) for v in region)
+    x1, x2 = max(0, x1), max(0, min(width, x2))
+    y1, y2 = max(0, y1), max(0, min(height, y2))
+    if x1 >= x2 or y1 >= y2:
+        return 0
+
+    view = cmyk[y1:y2, x1:x2]
+    weights = mask[y1:y2, x1:x2]
+    active = weights > threshold
+    if not active.any():
+        return 0
+
+    pixels = view[active]
+    source = pixels
+    if normalize_percent:
+        percent = (pixels > 1.0).any(axis=1)
+        if percent.any():
+            source = pixels.copy()
+            source[percent] = pixels[percent] / 100.0
+
+    dtype = pixels.dtype
+    clamped = np.clip(source, np.asarray(lower, dtype=dtype), np.asarray(upper, dtype=dtype))
+    alpha = weights[active][:, None]
+    view[active] = pixels * (1 - alpha) + clamped * alpha
+    return int((pixels != clamped).any(axis=1).sum())
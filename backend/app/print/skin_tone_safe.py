@@ -7,6 +7,9 @@ from typing import Tuple
 
 logger = logging.getLogger(__name__)
 
+# Безопасные диапазоны clamp_skin_tones (C, M, Y, K) в долях 0-1.0: нижние и верхние границы
+SKIN_TONE_CLAMP_BOUNDS = ((0.0, 0.25, 0.25, 0.0), (0.35, 0.55, 0.65, 0.15))
+
 
 def clamp_skin_tones(c: float, m: float, y: float, k: float) -> Tuple[float, float, float, float]:
     """
@@ -50,6 +53,7 @@ def apply_skin_tone_clamp_to_image(image_cmyk, face_bbox=None):
     """
     import numpy as np
     from PIL import ImageFilter
+    from .skin_tone_clamp import clamp_and_blend
     
     if image_cmyk.mode != "CMYK":
         raise ValueError("Изображение должно быть в режиме CMYK")
@@ -81,23 +85,10 @@ def apply_skin_tone_clamp_to_image(image_cmyk, face_bbox=None):
     mask = mask.filter(ImageFilter.GaussianBlur(radius=16))
     mask_array = np.array(mask) / 255.0
     
-    # Применяем clamp только в зоне лица
-    clamped_count = 0
-    for y in range(y1, y2):
-        for x in range(x1, x2):
-            alpha = mask_array[y, x]
-            if alpha > 0:
-                c, m, y_val, k = img_array[y, x]
-                c_clamped, m_clamped, y_clamped, k_clamped = clamp_skin_tones(c, m, y_val, k)
-                
-                # Смешиваем с оригиналом через маску
-                img_array[y, x, 0] = c * (1 - alpha) + c_clamped * alpha
-                img_array[y, x, 1] = m * (1 - alpha) + m_clamped * alpha
-                img_array[y, x, 2] = y_val * (1 - alpha) + y_clamped * alpha
-                img_array[y, x, 3] = k * (1 - alpha) + k_clamped * alpha
-                
-                if c != c_clamped or m != m_clamped or y_val != y_clamped or k != k_clamped:
-                    clamped_count += 1
+    # Применяем clamp только в зоне лица (векторизованно, см. skin_tone_clamp)
+    clamped_count = clamp_and_blend(
+        img_array, mask_array, *SKIN_TONE_CLAMP_BOUNDS, (x1, y1, x2, y2), normalize_percent=True
+    )
     
     # Конвертируем обратно в PIL Image
     img_array_uint8 = np.clip(img_array * 255, 0, 255).astype(np.uint8)
@@ -24,7 +24,7 @@ from ..services.watermark_service import create_preview_image
 from ..services.storage import upload_image as upload_image_bytes
 from ..services.storage import BASE_UPLOAD_DIR, get_server_base_url
 from ..services.pdf_service import PdfPage, render_book_pdf
-from ..services.tasks import create_task, update_task_progress
+from ..services.tasks import create_task, update_task_progress, register_task
 from ..core.deps import get_current_user
 
 logger = logging.getLogger(__name__)
@@ -482,7 +482,7 @@ async def generate_image_variant(
 Создай новое изображение на основе оригинального, но с учетом инструкций по редактированию."""
         
         # Генерируем новое изображение
-        new_image_url = await generate_draft_image(prompt, style=book.genre or "storybook")
+        new_image_url = await generate_draft_image(prompt, style=book.genre or "storybook", use_cache=False)
         
     except Exception as e:
         logger.error(f"❌ Ошибка при генерации изображения: {str(e)}", exc_info=True)
@@ -791,8 +791,90 @@ def select_final_variants(
 # ФИНАЛЬНЫЙ РЕНДЕРИНГ
 # ============================================
 
+@register_task("render_pdf")
+async def render_pdf_task(book_id: str, db: Session, task_id: Optional[str] = None):
+    """
+    Асинхронный рендеринг PDF (скачивает выбранные картинки, собирает PDF, сохраняет в /static).
+    """
+    book_id = UUID(str(book_id))
+    book = db.query(Book).filter(Book.id == book_id).first()
+    if not book:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    scenes = db.query(Scene).filter(Scene.book_id == book_id).order_by(Scene.order).all()
+
+    if task_id:
+        update_task_progress(task_id, {
+            "stage": "rendering_pdf",
+            "current_step": 1,
+            "total_steps": 1,
+            "message": "Сборка PDF...",
+            "pages_rendered": 0,
+            "total_pages": len([s for s in scenes if s.order > 0]),  # Исключаем обложку (order=0)
+            "book_id": str(book_id)
+        })
+
+    # Получаем ребёнка для возраста
+    from ..models import Child
+    child = db.query(Child).filter(Child.id == book.child_id).first()
+    child_age = child.age if child else None
+    
+    # Собираем страницы (сортируем по order, чтобы обложка order=0 была первой)
+    pages: list[PdfPage] = []
+    # Сортируем сцены по order, чтобы обложка (order=0) была первой
+    sorted_scenes = sorted(scenes, key=lambda s: s.order)
+    for idx, scene in enumerate(sorted_scenes, 1):
+        image = _get_image_by_scene_id(book_id, scene.id, db)
+        image_url = None
+        if image:
+            image_url = image.final_url or image.draft_url
+        pages.append(PdfPage(
+            order=scene.order,
+            text=scene.text or "",
+            image_url=image_url,
+            age=child_age
+        ))
+
+        if task_id:
+            update_task_progress(task_id, {
+                "pages_rendered": idx - 1,
+                "message": f"Подготовка страницы {idx}/{len(sorted_scenes)}..."
+            })
+
+    # Путь на диске
+    out_path = Path(BASE_UPLOAD_DIR) / "books" / str(book_id) / "final.pdf"
+
+    # Получаем стиль книги
+    from ..models import ThemeStyle
+    theme_style = db.query(ThemeStyle).filter(ThemeStyle.book_id == book_id).first()
+    book_style = theme_style.final_style if theme_style else (book.style or "storybook")
+
+    # Генерация PDF (CPU/IO) — в отдельном потоке
+    import asyncio
+    await asyncio.to_thread(render_book_pdf, out_path, book.title or "StoryHero", pages, book_style, child_age)
+
+    # Публичный URL
+    base = get_server_base_url()
+    pdf_url = f"{base}/static/books/{book_id}/final.pdf"
+
+    # Сохраняем в БД
+    book.final_pdf_url = pdf_url
+    book.status = "finalized"
+    db.commit()
+
+    if task_id:
+        update_task_progress(task_id, {
+            "stage": "pdf_ready",
+            "message": "PDF готов ✓",
+            "pages_rendered": len(scenes),
+            "total_pages": len([s for s in scenes if s.order > 0]),  # Исключаем обложку (order=0)
+            "pdf_url": pdf_url
+        })
+
+    return {"pdf_url": pdf_url}
+
+
 @router.post("/{book_id}/finalize/render")
-def finalize_render(
+async def finalize_render(
     book_id: UUID,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
@@ -807,7 +889,7 @@ def finalize_render(
         raise HTTPException(status_code=401, detail="Не авторизован")
     
     # Проверяем доступ к книге
-    book = _check_book_access(book_id, user_id, db)
+    _check_book_access(book_id, user_id, db)
     
     # Получаем все сцены
     scenes = db.query(Scene).filter(Scene.book_id == book_id).order_by(Scene.order).all()
@@ -852,83 +934,11 @@ def finalize_render(
                     detail=f"Для сцены {scene.id} не выбрано изображение"
                 )
     
-    async def _render_pdf_task(task_id: Optional[str] = None):
-        """
-        Асинхронный рендеринг PDF (скачивает выбранные картинки, собирает PDF, сохраняет в /static).
-        """
-        if task_id:
-            update_task_progress(task_id, {
-                "stage": "rendering_pdf",
-                "current_step": 1,
-                "total_steps": 1,
-                "message": "Сборка PDF...",
-                "pages_rendered": 0,
-                "total_pages": len([s for s in scenes if s.order > 0]),  # Исключаем обложку (order=0)
-                "book_id": str(book_id)
-            })
-
-        # Получаем ребёнка для возраста
-        from ..models import Child
-        child = db.query(Child).filter(Child.id == book.child_id).first()
-        child_age = child.age if child else None
-        
-        # Собираем страницы (сортируем по order, чтобы обложка order=0 была первой)
-        pages: list[PdfPage] = []
-        # Сортируем сцены по order, чтобы обложка (order=0) была первой
-        sorted_scenes = sorted(scenes, key=lambda s: s.order)
-        for idx, scene in enumerate(sorted_scenes, 1):
-            image = _get_image_by_scene_id(book_id, scene.id, db)
-            image_url = None
-            if image:
-                image_url = image.final_url or image.draft_url
-            pages.append(PdfPage(
-                order=scene.order,
-                text=scene.text or "",
-                image_url=image_url,
-                age=child_age
-            ))
-
-            if task_id:
-                update_task_progress(task_id, {
-                    "pages_rendered": idx - 1,
-                    "message": f"Подготовка страницы {idx}/{len(sorted_scenes)}..."
-                })
-
-        # Путь на диске
-        out_path = Path(BASE_UPLOAD_DIR) / "books" / str(book_id) / "final.pdf"
-
-        # Получаем стиль книги
-        from ..models import ThemeStyle
-        theme_style = db.query(ThemeStyle).filter(ThemeStyle.book_id == book_id).first()
-        book_style = theme_style.final_style if theme_style else (book.style or "storybook")
-
-        # Генерация PDF (CPU/IO) — в отдельном потоке
-        import asyncio
-        await asyncio.to_thread(render_book_pdf, out_path, book.title or "StoryHero", pages, book_style, child_age)
-
-        # Публичный URL
-        base = get_server_base_url()
-        pdf_url = f"{base}/static/books/{book_id}/final.pdf"
-
-        # Сохраняем в БД
-        book.final_pdf_url = pdf_url
-        book.status = "finalized"
-        db.commit()
-
-        if task_id:
-            update_task_progress(task_id, {
-                "stage": "pdf_ready",
-                "message": "PDF готов ✓",
-                "pages_rendered": len(scenes),
-                "total_pages": len([s for s in scenes if s.order > 0]),  # Исключаем обложку (order=0)
-                "pdf_url": pdf_url
-            })
-
-        return {"pdf_url": pdf_url}
-
     # Создаем задачу рендеринга PDF
     task_id = create_task(
-        _render_pdf_task,
+        render_pdf_task,
+        str(book_id),
+        db,
         meta={"type": "render_pdf", "user_id": str(user_id), "book_id": str(book_id)}
     )
 
@@ -2,7 +2,9 @@
 Роутер для генерации полной книги через асинхронные задачи.
 """
 import logging
-from typing import Optional, List
+import os
+import uuid
+from typing import Dict, Optional, List
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
@@ -10,7 +12,7 @@ from pydantic import BaseModel
 from ..db import get_db
 from ..models import Child, Book
 from ..core.deps import get_current_user
-from ..services.tasks import create_task, update_task_progress, get_task_status
+from ..services.tasks import create_task, update_task_progress, get_task_status, register_task
 from ..routers.plot import _create_plot_internal, CreatePlotRequest
 from ..routers.text import _create_text_internal, CreateTextRequest
 from ..routers.image_prompts import _create_image_prompts_internal, CreateImagePromptsRequest
@@ -136,6 +138,56 @@ def get_book(
     }
 
 
+@router.get("/{book_id}/screen_pdf")
+async def get_screen_pdf(
+    book_id: str,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Лёгкий PDF книги для чтения в приложении и отправки (профиль рендера screen).
+    
+    Изображения уменьшены до экранного разрешения, без CMYK/skin-tone обработки и crop marks.
+    Собирается по запросу и переиспользуется, пока не пересобран PRINT-READY final.pdf
+    (он по-прежнему используется для заказов печати); одновременные запросы одной книги
+    ждут один рендер.
+    """
+    user_id = current_user.get("sub") or current_user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid user token: missing user ID")
+    
+    from uuid import UUID
+    try:
+        book_uuid = UUID(book_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Неверный формат book_id: {book_id}")
+    
+    book = db.query(Book).filter(
+        Book.id == book_uuid,
+        Book.user_id == str(user_id)
+    ).first()
+    if not book:
+        raise HTTPException(status_code=404, detail=f"Книга с id={book_id} не найдена")
+    if not book.final_pdf_url:
+        raise HTTPException(status_code=404, detail="PDF книги ещё не готов")
+    
+    pdf_dir = Path(BASE_UPLOAD_DIR) / "books" / str(book_uuid)
+    screen_path = pdf_dir / "screen.pdf"
+    final_path = pdf_dir / "final.pdf"
+    if screen_path.exists() and (not final_path.exists() or screen_path.stat().st_mtime >= final_path.stat().st_mtime):
+        pdf_url = f"{get_server_base_url()}/static/books/{book_uuid}/screen.pdf"
+    else:
+        pdf_url = await _render_screen_pdf_once(book_uuid, book.style)
+        if not pdf_url:
+            raise HTTPException(status_code=404, detail="Нет изображений для создания PDF")
+    
+    return {
+        "book_id": str(book_uuid),
+        "profile": "screen",
+        "pdf_url": pdf_url,
+    }
+
+
 @router.get("/{book_id}/scenes")
 def get_book_scenes(
     book_id: str,
@@ -280,7 +332,8 @@ def get_task_status_endpoint(
     
     task_data = get_task_status(task_id)
     
-    # Если задача не найдена в памяти, проверяем, не была ли она прервана при перезапуске
+    # Если задачи нет в таблице tasks (создана до перехода на персистентное хранилище),
+    # восстанавливаем состояние по книге
     if not task_data:
         # Пытаемся найти книгу по task_id в метаданных других задач или по book_id
         # Ищем книги пользователя со статусом "draft", которые могли быть прерваны
@@ -366,6 +419,10 @@ def get_task_status_endpoint(
     if task_meta.get("user_id") != user_id:
         raise HTTPException(status_code=403, detail="Доступ запрещён")
     
+    progress = task_data.get("progress", {})
+    if task_data.get("status") == "interrupted":
+        progress = {**progress, "interrupted": True}  # Флаг, что задача была прервана
+    
     return {
         "id": task_id,  # Добавляем id задачи в ответ
         "status": task_data.get("status", "unknown"),
@@ -373,7 +430,7 @@ def get_task_status_endpoint(
         "result": task_data.get("result"),
         "error": task_data.get("error"),
         "meta": task_data.get("meta", {}),
-        "progress": task_data.get("progress", {})
+        "progress": progress
     }
 
 
@@ -386,7 +443,8 @@ async def continue_generation(
     """
     Продолжить генерацию прерванной книги.
     
-    Определяет этап генерации на основе состояния книги и продолжает с нужного места.
+    Определяет выполненные этапы пайплайна по состоянию книги и выполняет только
+    незавершённые этапы и недостающие сцены.
     """
     user_id = current_user.get("sub") or current_user.get("id")
     if not user_id:
@@ -407,86 +465,58 @@ async def continue_generation(
     if not book:
         raise HTTPException(status_code=404, detail=f"Книга с id={book_id} не найдена")
     
-    # Проверяем состояние книги
-    from app.models import Scene, Image as ImageModel, ThemeStyle, Child
-    scenes = db.query(Scene).filter(Scene.book_id == book_uuid).all()
-    images = db.query(ImageModel).filter(ImageModel.book_id == book_uuid).all()
+    # Определяем по состоянию книги, какие этапы уже выполнены
+    completed = _get_completed_book_stages(book_uuid, db)
     
-    if not scenes:
+    if "plot" not in completed:
         raise HTTPException(status_code=400, detail="Книга не начала генерацию. Используйте /generate_full_book")
-    
-    # Определяем этап генерации
-    has_draft_images = any(img.draft_url for img in images)
-    has_final_images = any(img.final_url for img in images)
-    has_pdf = book.final_pdf_url is not None
+    if "pdf" in completed and "final_images" in completed:
+        raise HTTPException(status_code=400, detail="Книга уже полностью сгенерирована")
+    if "style" not in completed:
+        raise HTTPException(status_code=400, detail="Стиль не выбран. Сначала выберите стиль.")
     
     # Получаем данные ребёнка
     child = db.query(Child).filter(Child.id == book.child_id).first()
     if not child:
         raise HTTPException(status_code=404, detail="Ребёнок не найден")
     
-    # Получаем стиль
-    theme_style = db.query(ThemeStyle).filter(ThemeStyle.book_id == book_uuid).first()
-    if not theme_style:
-        raise HTTPException(status_code=400, detail="Стиль не выбран. Сначала выберите стиль.")
+    next_stage = next(s for s in BOOK_PIPELINE_STAGES if s not in completed)
+    logger.info(f"🔄 Продолжение генерации книги {book_id} с этапа {next_stage}")
     
-    final_style = theme_style.final_style
+    # Получаем фотографии ребёнка
+    from ..routers.children import get_child_photos
+    try:
+        child_photos_data = get_child_photos(child.id, db, current_user)
+        child_photos = [photo["url"] for photo in child_photos_data.get("photos", [])] if child_photos_data else []
+    except:
+        child_photos = []
     
-    # Определяем, с какого этапа продолжать
-    if has_pdf:
-        raise HTTPException(status_code=400, detail="Книга уже полностью сгенерирована")
-    elif has_final_images:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Финальные изображения готовы. Используйте /books/{book_id}/generate_final_version для создания PDF"
-        )
-    elif has_draft_images:
-        # Продолжаем с генерации финальных изображений
-        logger.info(f"🔄 Продолжение генерации: финальные изображения для книги {book_id}")
-        
-        # Получаем фотографии ребёнка
-        from ..routers.children import get_child_photos
-        try:
-            child_photos_data = get_child_photos(child.id, db, current_user)
-            child_photos = [photo["url"] for photo in child_photos_data.get("photos", [])] if child_photos_data else []
-        except:
-            child_photos = []
-        
-        face_url = child_photos[0] if child_photos else None
-        if not face_url:
-            raise HTTPException(status_code=400, detail="Не найдены фотографии ребёнка")
-        
-        # Создаем задачу для продолжения генерации финальных изображений
-        from ..services.tasks import create_task
-        from ..routers.final_images import _generate_final_images_internal
-        
-        task_id = create_task(
-            _generate_final_images_internal,
-            book_id,
-            db,
-            user_id,
-            final_style=final_style,
-            face_url=face_url,
-            child_photos=child_photos,
-            meta={
-                "type": "continue_generation",
-                "user_id": user_id,
-                "book_id": book_id,
-                "stage": "generating_final_images"
-            }
-        )
-        
-        return {
-            "task_id": task_id,
-            "message": "Продолжение генерации финальных изображений запущено",
-            "book_id": book_id,
-            "stage": "generating_final_images"
+    face_url = child_photos[0] if child_photos else None
+    if not face_url and next_stage in ("draft_images", "final_images"):
+        raise HTTPException(status_code=400, detail="Не найдены фотографии ребёнка")
+    
+    # Создаем задачу для продолжения генерации с первого незавершённого этапа
+    task_id = create_task(
+        resume_book_generation_task,
+        book_id,
+        user_id,
+        db,
+        face_url=face_url,
+        child_photos=child_photos,
+        meta={
+            "type": "continue_generation",
+            "user_id": user_id,
+            "book_id": book_id
         }
-    else:
-        raise HTTPException(
-            status_code=400,
-            detail="Книга находится на начальном этапе. Используйте /generate_full_book для полной генерации"
-        )
+    )
+    
+    return {
+        "task_id": task_id,
+        "message": "Продолжение генерации запущено",
+        "book_id": book_id,
+        "stage": next_stage,
+        "completed_stages": [s for s in BOOK_PIPELINE_STAGES if s in completed]
+    }
 
 
 class GenerateFullBookRequest(BaseModel):
@@ -497,152 +527,308 @@ class GenerateFullBookRequest(BaseModel):
     theme: str  # Тема книги (обязательное поле) - о чём будет книга
 
 
-async def generate_full_book_task(
-    name: str,
-    age: int,
-    interests: List[str],
-    fears: List[str],
-    personality: str,
-    moral: str,
-    face_url: str,
-    style: str,
+# Пайплайн генерации книги — DAG этапов:
+#   plot → style ──────────────────────────┐
+#   plot → text → prompts → draft_images → final_images → pdf
+# Результат каждого этапа сохраняется в БД (ThemeStyle, тексты и промпты сцен,
+# Image.draft_url/final_url по каждой сцене, Book.final_pdf_url), поэтому при возобновлении
+# выполняются только незавершённые этапы, а в этапах изображений — только недостающие сцены.
+BOOK_PIPELINE_STAGES = ("plot", "style", "text", "prompts", "draft_images", "final_images", "pdf")
+
+
+def _get_completed_book_stages(book_uuid, db: Session) -> set:
+    """Определить по состоянию книги в БД, какие этапы пайплайна уже выполнены."""
+    from ..models import ThemeStyle
+
+    book = db.query(Book).filter(Book.id == book_uuid).first()
+    if not book:
+        return set()
+    scenes = db.query(Scene).filter(Scene.book_id == book_uuid).all()
+    if not scenes:
+        return set()
+
+    completed = {"plot"}
+    if db.query(ThemeStyle).filter(ThemeStyle.book_id == book_uuid).first():
+        completed.add("style")
+
+    story_scenes = [s for s in scenes if s.order != 0]  # Обложка (order=0) текста не имеет
+    if story_scenes and all(s.text for s in story_scenes):
+        completed.add("text")
+
+    # Промпты должны быть у всех сцен: если LLM вернул их только для части сцен,
+    # этап повторяется, иначе сцены без промптов пропустились бы навсегда
+    if all(s.image_prompt for s in scenes):
+        completed.add("prompts")
+        images = {
+            img.scene_order: img
+            for img in db.query(ImageModel).filter(ImageModel.book_id == book_uuid).all()
+        }
+        if all(images.get(s.order) and images[s.order].draft_url for s in scenes):
+            completed.add("draft_images")
+        if all(images.get(s.order) and images[s.order].final_url for s in scenes):
+            completed.add("final_images")
+
+    if book.final_pdf_url:
+        completed.add("pdf")
+    return completed
+
+
+def _save_stage_checkpoint(task_id: Optional[str], book_id: str, completed: set, stage: str):
+    """Отметить этап выполненным и сохранить список выполненных этапов в прогрессе задачи."""
+    completed.add(stage)
+    if task_id:
+        update_task_progress(task_id, {
+            "book_id": book_id,
+            "completed_stages": [s for s in BOOK_PIPELINE_STAGES if s in completed]
+        })
+
+
+async def _render_full_book_pdf(book_uuid, db: Session, style: Optional[str], profile: str = "print") -> Optional[str]:
+    """
+    Собрать PDF книги из финальных изображений сцен. Возвращает URL PDF.
+    
+    profile="print" — PRINT-READY final.pdf (сохраняется в book.final_pdf_url);
+    profile="screen" — лёгкий screen.pdf для чтения в приложении, БД не меняется.
+    """
+    # Получаем книгу
+    book = db.query(Book).filter(Book.id == book_uuid).first()
+    if not book:
+        raise HTTPException(status_code=404, detail="Книга не найдена")
+    
+    # Получаем стиль книги
+    from ..models import ThemeStyle
+    theme_style = db.query(ThemeStyle).filter(ThemeStyle.book_id == book_uuid).first()
+    book_style = theme_style.final_style if theme_style else style
+    
+    # Получаем ребёнка для возраста
+    child = db.query(Child).filter(Child.id == book.child_id).first()
+    child_age = child.age if child else None
+    
+    # Получаем все сцены с финальными изображениями
+    scenes = db.query(Scene).filter(Scene.book_id == book_uuid).order_by(Scene.order).all()
+    
+    # Создаем список страниц для PDF
+    pages = []
+    final_images_data = []
+    
+    for scene in scenes:
+        # Получаем финальное изображение для сцены
+        image_record = db.query(ImageModel).filter(
+            ImageModel.book_id == book_uuid,
+            ImageModel.scene_order == scene.order
+        ).first()
+        
+        image_url = None
+        if image_record and image_record.final_url:
+            image_url = image_record.final_url
+            final_images_data.append({
+                "order": scene.order,
+                "image_url": image_url
+            })
+        
+        # Добавляем страницу в PDF (только если есть изображение)
+        if image_url:
+            # КРИТИЧНО: Используем ТОЛЬКО scene.text, НЕ short_summary и НЕ image_prompt
+            # Для обложки (order=0) текст игнорируется - название рисуется программно
+            scene_text = ""
+            if scene.order != 0:  # Не обложка
+                scene_text = scene.text or ""  # ТОЛЬКО scene.text, без fallback на short_summary
+                # Очищаем текст от возможных промптов
+                if scene_text and ("Visual style" in scene_text or "IMPORTANT" in scene_text):
+                    logger.warning(f"⚠️ Сцена {scene.order} содержит промпт в text, используем short_summary")
+                    scene_text = scene.short_summary or ""
+            
+            pages.append(PdfPage(
+                order=scene.order,
+                text=scene_text,
+                image_url=image_url,
+                style=book_style,
+                age=child_age
+            ))
+    
+    if not pages:
+        logger.warning(f"⚠️ Нет изображений для создания PDF")
+        return book.final_pdf_url if profile == "print" else None
+    
+    filename = "final.pdf" if profile == "print" else f"{profile}.pdf"
+    pdf_url = await _write_book_pdf(
+        book_uuid, book.title or "StoryHero", pages, book_style, child_age, filename, profile
+    )
+    if profile == "print":
+        # Сохраняем в БД
+        book.final_pdf_url = pdf_url
+        book.images_final = {"images": final_images_data}
+        db.commit()
+    return pdf_url
+
+
+async def _write_book_pdf(
+    book_uuid,
+    title: str,
+    pages: List[PdfPage],
+    book_style: Optional[str],
+    child_age: Optional[int],
+    filename: str,
+    profile: str = "print"
+) -> str:
+    """Отрендерить PDF в books/<book_id>/<filename> (в отдельном потоке) и вернуть его публичный URL."""
+    pdf_dir = Path(BASE_UPLOAD_DIR) / "books" / str(book_uuid)
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    pdf_path = pdf_dir / filename
+    # Пишем во временный файл: предыдущая версия раздаётся через /static, пока идёт рендер
+    tmp_path = pdf_dir / f"{filename}.{uuid.uuid4().hex}.tmp"
+    try:
+        await asyncio.to_thread(render_book_pdf, str(tmp_path), title, pages, book_style, child_age, profile)
+        os.replace(tmp_path, pdf_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    
+    pdf_url = f"{get_server_base_url()}/static/books/{book_uuid}/{filename}"
+    logger.info(f"✅ PDF ({profile}) создан: {pdf_url}")
+    return pdf_url
+
+
+# book_id -> выполняемый рендер screen.pdf: повторные открытия книги в приложении ждут его, а не запускают свой
+_screen_pdf_renders: Dict[str, "asyncio.Task"] = {}
+
+
+async def _render_screen_pdf_once(book_uuid, style: Optional[str]) -> Optional[str]:
+    """Собрать screen.pdf книги; параллельные запросы одной книги в процессе ждут один рендер."""
+    key = str(book_uuid)
+    task = _screen_pdf_renders.get(key)
+    if task is None:
+        task = asyncio.create_task(_render_screen_pdf(book_uuid, style))
+        _screen_pdf_renders[key] = task
+        task.add_done_callback(lambda _: _screen_pdf_renders.pop(key, None))
+    # shield: отключение одного клиента не отменяет рендер, который ждут остальные
+    return await asyncio.shield(task)
+
+
+async def _render_screen_pdf(book_uuid, style: Optional[str]) -> Optional[str]:
+    # Своя сессия БД: рендер может пережить запрос, который его запустил
+    from ..db import SessionLocal
+    db = SessionLocal()
+    try:
+        return await _render_full_book_pdf(book_uuid, db, style, profile="screen")
+    finally:
+        db.close()
+
+
+async def _run_book_pipeline(
+    book_id: str,
     user_id: str,
     db: Session,
-    child_id: Optional[int] = None,
-    task_id: Optional[str] = None,
-    num_pages: int = 20,
+    style: Optional[str] = None,
+    face_url: Optional[str] = None,
     child_photos: Optional[List[str]] = None,
-    theme: Optional[str] = None  # Тема книги
-):
+    task_id: Optional[str] = None
+) -> dict:
     """
-    Асинхронная задача для генерации полной книги.
+    Выполнить этапы пайплайна после создания сюжета, пропуская уже выполненные.
     
     Args:
-        name: Имя ребёнка
-        age: Возраст ребёнка
-        interests: Список интересов
-        fears: Список страхов
-        personality: Характер
-        moral: Мораль/ценности
-        face_url: URL фото ребёнка
-        style: Стиль иллюстраций
+        book_id: ID книги (UUID как строка)
         user_id: ID пользователя
         db: Сессия БД
-        child_id: ID ребёнка (опционально)
-        task_id: ID задачи для отслеживания прогресса
-        num_pages: Количество страниц (10 или 20)
+        style: Стиль иллюстраций (если None — берётся из ThemeStyle книги)
+        face_url: URL фото ребёнка
         child_photos: Список URL фотографий ребёнка
-        theme: Тема книги (о чём будет книга)
+        task_id: ID задачи для отслеживания прогресса
     """
-    from ..services.subscription_service import check_and_update_user_subscription_status
+    from uuid import UUID as UUIDType
+    from ..models import ThemeStyle
+    book_uuid = UUIDType(str(book_id))
+    book_id = str(book_uuid)
     
-    try:
-        # Проверяем и обновляем статус подписки пользователя
-        check_and_update_user_subscription_status(db, user_id)
-        
-        if task_id:
-            update_task_progress(task_id, {
-                "stage": "starting",
-                "current_step": 1,
-                "total_steps": 7,
-                "message": "Инициализация генерации книги...",
-                "theme": theme or "не указана"
-            })
-        
-        logger.info(f"📖 Шаг 1: Начало генерации книги для child_id={child_id} (theme={theme})")
-        
-        # Шаг 2: Создание сюжета
-        if task_id:
-            update_task_progress(task_id, {
-                "stage": "creating_plot",
-                "current_step": 2,
-                "total_steps": 7,
-                "message": "Создание сюжета книги...",
-            })
-        
-        logger.info(f"📖 Шаг 2: Создание сюжета для child_id={child_id} (num_pages={num_pages}, theme={theme})")
-        plot_request = CreatePlotRequest(child_id=child_id, num_pages=num_pages, theme=theme)
-        # Передаем task_id в _create_plot_internal для обновления progress сразу после создания книги
-        plot_result = await _create_plot_internal(plot_request, db, user_id, task_id=task_id)
-        
-        # Обновляем progress после завершения создания сюжета (book_id уже добавлен в _create_plot_internal)
+    completed = _get_completed_book_stages(book_uuid, db)
+    if "plot" not in completed:
+        raise HTTPException(status_code=400, detail="Книга не начала генерацию. Используйте /generate_full_book")
+    if completed != {"plot"}:
+        logger.info(f"♻️ Возобновление генерации книги {book_id}: уже выполнены этапы {[s for s in BOOK_PIPELINE_STAGES if s in completed]}")
+    _save_stage_checkpoint(task_id, book_id, completed, "plot")
+    
+    # Шаг 3: Выбор стиля (сохраняется сразу после сюжета, чтобы возобновление знало стиль)
+    if "style" not in completed:
+        if not style:
+            raise HTTPException(status_code=400, detail="Стиль не выбран. Сначала выберите стиль.")
         if task_id:
             update_task_progress(task_id, {
-                "stage": "plot_ready",
-                "current_step": 2,
+                "stage": "selecting_style",
+                "current_step": 3,
                 "total_steps": 7,
-                "message": "Сюжет создан!",
-                "book_id": str(plot_result.book_id)  # Сохраняем book_id на всех этапах
+                "message": "Выбор стиля иллюстраций...",
+                "book_id": book_id  # Сохраняем book_id на всех этапах
             })
         
-        logger.info(f"✓ Сюжет создан: book_id={plot_result.book_id}")
-        
-        # Шаг 3: Создание текста
+        logger.info(f"🎨 Шаг 3: Выбор стиля для book_id={book_id}")
+        style_request = SelectStyleRequest(book_id=book_id, mode="manual", style=style)
+        await _select_style_internal(style_request, db, user_id)
+        _save_stage_checkpoint(task_id, book_id, completed, "style")
+    else:
+        theme_style = db.query(ThemeStyle).filter(ThemeStyle.book_id == book_uuid).first()
+        style = theme_style.final_style
+    
+    # Шаг 4: Создание текста
+    if "text" not in completed:
         if task_id:
             update_task_progress(task_id, {
                 "stage": "creating_text",
-                "current_step": 3,
+                "current_step": 4,
                 "total_steps": 7,
                 "message": "Генерация текста для сцен...",
-                "book_id": str(plot_result.book_id)  # Сохраняем book_id на всех этапах
+                "book_id": book_id  # Сохраняем book_id на всех этапах
             })
         
-        logger.info(f"✍️ Шаг 3: Создание текста для book_id={plot_result.book_id}")
-        text_request = CreateTextRequest(book_id=plot_result.book_id)
+        logger.info(f"✍️ Шаг 4: Создание текста для book_id={book_id}")
+        text_request = CreateTextRequest(book_id=book_id)
         await _create_text_internal(text_request, db, user_id)
+        _save_stage_checkpoint(task_id, book_id, completed, "text")
         
         if task_id:
             update_task_progress(task_id, {
                 "stage": "text_ready",
-                "current_step": 3,
+                "current_step": 4,
                 "total_steps": 7,
                 "message": "Текст готов! Вы можете редактировать его пока генерируются изображения.",
-                "book_id": str(plot_result.book_id)  # Преобразуем в строку для JSON
+                "book_id": book_id
             })
-        
-        # Шаг 4: Создание промптов для изображений
+    
+    # Шаг 5: Создание промптов для изображений
+    if "prompts" not in completed:
         if task_id:
             update_task_progress(task_id, {
                 "stage": "creating_prompts",
-                "current_step": 4,
+                "current_step": 5,
                 "total_steps": 7,
                 "message": "Создание промптов для изображений...",
-                "book_id": str(plot_result.book_id)  # Сохраняем book_id на всех этапах
+                "book_id": book_id  # Сохраняем book_id на всех этапах
             })
         
-        logger.info(f"🖼️ Шаг 4: Создание промптов для book_id={plot_result.book_id}")
-        prompts_request = CreateImagePromptsRequest(book_id=plot_result.book_id)
+        logger.info(f"🖼️ Шаг 5: Создание промптов для book_id={book_id}")
+        prompts_request = CreateImagePromptsRequest(book_id=book_id)
         await _create_image_prompts_internal(prompts_request, db, user_id)
-        
-        # Шаг 5: Выбор стиля
-        if task_id:
-            update_task_progress(task_id, {
-                "stage": "selecting_style",
-                "current_step": 5,
-                "total_steps": 7,
-                "message": "Выбор стиля иллюстраций...",
-                "book_id": str(plot_result.book_id)  # Сохраняем book_id на всех этапах
-            })
-        
-        logger.info(f"🎨 Шаг 5: Выбор стиля для book_id={plot_result.book_id}")
-        style_request = SelectStyleRequest(book_id=plot_result.book_id, mode="manual", style=style)
-        await _select_style_internal(style_request, db, user_id)
-        
-        # Шаг 6: Генерация черновых изображений
+        _save_stage_checkpoint(task_id, book_id, completed, "prompts")
+    
+    # Шаг 6: Генерация черновых изображений (только для сцен без черновика)
+    if "draft_images" not in completed:
         if task_id:
             update_task_progress(task_id, {
                 "stage": "generating_draft_images",
                 "current_step": 6,
                 "total_steps": 7,
                 "message": "Генерация черновых изображений...",
-                "book_id": str(plot_result.book_id)  # Сохраняем book_id на всех этапах
+                "book_id": book_id  # Сохраняем book_id на всех этапах
             })
         
-        logger.info(f"🖼️ Шаг 6: Генерация черновых изображений для book_id={plot_result.book_id}")
-        image_request = ImageRequest(book_id=plot_result.book_id, face_url=face_url)
-        await _generate_draft_images_internal(image_request, db, user_id, final_style=style, task_id=task_id)
-        
-        # Шаг 7: Генерация финальных изображений
+        logger.info(f"🖼️ Шаг 6: Генерация черновых изображений для book_id={book_id}")
+        image_request = ImageRequest(book_id=book_id, face_url=face_url or "")
+        await _generate_draft_images_internal(image_request, db, user_id, final_style=style, task_id=task_id, skip_existing=True)
+        _save_stage_checkpoint(task_id, book_id, completed, "draft_images")
+    
+    # Шаг 7: Генерация финальных изображений (только для сцен без финального изображения)
+    final_images_generated = False
+    if "final_images" not in completed:
         if task_id:
             update_task_progress(task_id, {
                 "stage": "generating_final_images",
@@ -651,26 +837,33 @@ async def generate_full_book_task(
                 "message": "Генерация финальных изображений с face swap...",
                 "images_generated": 0,
                 "total_images": 0,
-                "book_id": str(plot_result.book_id)  # Сохраняем book_id на всех этапах
+                "book_id": book_id  # Сохраняем book_id на всех этапах
             })
         
-        logger.info(f"🎨 Шаг 7: Генерация финальных изображений для book_id={plot_result.book_id}")
+        logger.info(f"🎨 Шаг 7: Генерация финальных изображений для book_id={book_id}")
         try:
             final_images_result = await _generate_final_images_internal(
-                book_id=plot_result.book_id,
-            db=db,
-            current_user_id=user_id,
+                book_id=book_id,
+                db=db,
+                current_user_id=user_id,
                 final_style=style,
                 face_url=face_url,
                 task_id=task_id,
-                child_photos=child_photos
-        )
+                child_photos=child_photos,
+                skip_existing=True
+            )
             logger.info(f"✅ Шаг 7 завершен: сгенерировано {len(final_images_result.get('images', []))} изображений")
         except Exception as e:
             logger.error(f"❌ Ошибка в Шаге 7: {str(e)}", exc_info=True)
             raise
-        
-        # Шаг 8: Генерация PDF
+        final_images_generated = True
+        # Сцены, пропущенные по таймауту, останутся незавершёнными до следующего возобновления
+        if "final_images" in _get_completed_book_stages(book_uuid, db):
+            _save_stage_checkpoint(task_id, book_id, completed, "final_images")
+    
+    # Шаг 8: Генерация PDF (пересобираем, если появились новые финальные изображения)
+    pdf_url = None
+    if "pdf" not in completed or final_images_generated:
         if task_id:
             update_task_progress(task_id, {
                 "stage": "generating_pdf",
@@ -679,106 +872,127 @@ async def generate_full_book_task(
                 "message": "Создание PDF файла...",
             })
         
-        logger.info(f"📄 Шаг 8: Генерация PDF для book_id={plot_result.book_id}")
-        
-        # Преобразуем book_id в UUID
-        from uuid import UUID as UUIDType
-        book_uuid = UUIDType(plot_result.book_id)
-        
-        # Получаем книгу
+        logger.info(f"📄 Шаг 8: Генерация PDF для book_id={book_id}")
+        pdf_url = await _render_full_book_pdf(book_uuid, db, style)
+        if pdf_url:
+            _save_stage_checkpoint(task_id, book_id, completed, "pdf")
+    else:
         book = db.query(Book).filter(Book.id == book_uuid).first()
-        if not book:
-            raise HTTPException(status_code=404, detail="Книга не найдена")
-        
-        # Получаем стиль книги
-        from ..models import ThemeStyle
-        theme_style = db.query(ThemeStyle).filter(ThemeStyle.book_id == book_uuid).first()
-        book_style = theme_style.final_style if theme_style else style
-        
-        # Получаем ребёнка для возраста
-        child = db.query(Child).filter(Child.id == book.child_id).first()
-        child_age = child.age if child else None
+        pdf_url = book.final_pdf_url if book else None
+    
+    if task_id:
+        update_task_progress(task_id, {
+            "stage": "completed",
+            "current_step": 8,
+            "total_steps": 8,
+            "message": "Книга успешно создана!",
+            "book_id": book_id,
+            "pdf_url": pdf_url
+        })
+    
+    logger.info(f"✅ Книга успешно создана: book_id={book_id}")
+    
+    return {
+        "book_id": book_id,
+        "status": "success",
+        "completed_stages": [s for s in BOOK_PIPELINE_STAGES if s in completed]
+    }
+
+
+@register_task("generate_full_book")
+async def generate_full_book_task(
+    name: str,
+    age: int,
+    interests: List[str],
+    fears: List[str],
+    personality: str,
+    moral: str,
+    face_url: str,
+    style: str,
+    user_id: str,
+    db: Session,
+    child_id: Optional[int] = None,
+    task_id: Optional[str] = None,
+    num_pages: int = 20,
+    child_photos: Optional[List[str]] = None,
+    theme: Optional[str] = None  # Тема книги
+):
+    """
+    Асинхронная задача для генерации полной книги.
+    
+    Создаёт сюжет, затем выполняет остальные этапы через _run_book_pipeline.
+    Если задача прервётся, её можно продолжить через /books/{book_id}/continue_generation
+    без повторения уже выполненных этапов и сцен.
+    
+    Args:
+        name: Имя ребёнка
+        age: Возраст ребёнка
+        interests: Список интересов
+        fears: Список страхов
+        personality: Характер
+        moral: Мораль/ценности
+        face_url: URL фото ребёнка
+        style: Стиль иллюстраций
+        user_id: ID пользователя
+        db: Сессия БД
+        child_id: ID ребёнка (опционально)
+        task_id: ID задачи для отслеживания прогресса
+        num_pages: Количество страниц (10 или 20)
+        child_photos: Список URL фотографий ребёнка
+        theme: Тема книги (о чём будет книга)
+    """
+    from ..services.subscription_service import check_and_update_user_subscription_status
+    
+    try:
+        # Проверяем и обновляем статус подписки пользователя
+        check_and_update_user_subscription_status(db, user_id)
         
-        # Получаем все сцены с финальными изображениями
-        scenes = db.query(Scene).filter(Scene.book_id == book_uuid).order_by(Scene.order).all()
+        if task_id:
+            update_task_progress(task_id, {
+                "stage": "starting",
+                "current_step": 1,
+                "total_steps": 7,
+                "message": "Инициализация генерации книги...",
+                "theme": theme or "не указана"
+            })
         
-        # Создаем список страниц для PDF
-        pages = []
-        final_images_data = []
+        logger.info(f"📖 Шаг 1: Начало генерации книги для child_id={child_id} (theme={theme})")
         
-        for scene in scenes:
-            # Получаем финальное изображение для сцены
-            image_record = db.query(ImageModel).filter(
-                ImageModel.book_id == book_uuid,
-                ImageModel.scene_order == scene.order
-            ).first()
-            
-            image_url = None
-            if image_record and image_record.final_url:
-                image_url = image_record.final_url
-                final_images_data.append({
-                    "order": scene.order,
-                    "image_url": image_url
-                })
-            
-            # Добавляем страницу в PDF (только если есть изображение)
-            if image_url:
-                # КРИТИЧНО: Используем ТОЛЬКО scene.text, НЕ short_summary и НЕ image_prompt
-                # Для обложки (order=0) текст игнорируется - название рисуется программно
-                scene_text = ""
-                if scene.order != 0:  # Не обложка
-                    scene_text = scene.text or ""  # ТОЛЬКО scene.text, без fallback на short_summary
-                    # Очищаем текст от возможных промптов
-                    if scene_text and ("Visual style" in scene_text or "IMPORTANT" in scene_text):
-                        logger.warning(f"⚠️ Сцена {scene.order} содержит промпт в text, используем short_summary")
-                        scene_text = scene.short_summary or ""
-                
-                pages.append(PdfPage(
-                    order=scene.order,
-                    text=scene_text,
-                    image_url=image_url,
-                    style=book_style,
-                    age=child_age
-                ))
+        # Шаг 2: Создание сюжета
+        if task_id:
+            update_task_progress(task_id, {
+                "stage": "creating_plot",
+                "current_step": 2,
+                "total_steps": 7,
+                "message": "Создание сюжета книги...",
+            })
         
-        # Генерируем PDF
-        if pages:
-            pdf_dir = Path(BASE_UPLOAD_DIR) / "books" / str(book_uuid)
-            pdf_dir.mkdir(parents=True, exist_ok=True)
-            pdf_path = pdf_dir / "final.pdf"
-            
-            # Генерируем PDF в отдельном потоке (синхронная операция)
-            await asyncio.to_thread(render_book_pdf, str(pdf_path), book.title or "StoryHero", pages, book_style, child_age)
-            
-            # Получаем публичный URL
-            base_url = get_server_base_url()
-            pdf_url = f"{base_url}/static/books/{book_uuid}/final.pdf"
-            
-            # Сохраняем в БД
-            book.final_pdf_url = pdf_url
-            book.images_final = {"images": final_images_data}
-            db.commit()
-            
-            logger.info(f"✅ PDF создан: {pdf_url}")
-        else:
-            logger.warning(f"⚠️ Нет изображений для создания PDF")
+        logger.info(f"📖 Шаг 2: Создание сюжета для child_id={child_id} (num_pages={num_pages}, theme={theme})")
+        plot_request = CreatePlotRequest(child_id=child_id, num_pages=num_pages, theme=theme)
+        # Передаем task_id в _create_plot_internal для обновления progress сразу после создания книги
+        plot_result = await _create_plot_internal(plot_request, db, user_id, task_id=task_id)
         
+        # Обновляем progress после завершения создания сюжета (book_id уже добавлен в _create_plot_internal)
         if task_id:
             update_task_progress(task_id, {
-                "stage": "completed",
-                "current_step": 8,
-                "total_steps": 8,
-                "message": "Книга успешно создана!",
-                "book_id": plot_result.book_id,
-                "pdf_url": book.final_pdf_url
+                "stage": "plot_ready",
+                "current_step": 2,
+                "total_steps": 7,
+                "message": "Сюжет создан!",
+                "book_id": str(plot_result.book_id)  # Сохраняем book_id на всех этапах
             })
         
-        logger.info(f"✅ Книга успешно создана: book_id={plot_result.book_id}")
+        logger.info(f"✓ Сюжет создан: book_id={plot_result.book_id}")
         
-        return {
-            "book_id": plot_result.book_id,
-            "status": "success"
-        }
+        return await _run_book_pipeline(
+            str(plot_result.book_id),
+            user_id,
+            db,
+            style=style,
+            face_url=face_url,
+            child_photos=child_photos,
+            task_id=task_id
+        )
         
     except Exception as e:
         logger.error(f"❌ Ошибка в generate_full_book_task: {str(e)}", exc_info=True)
@@ -790,6 +1004,38 @@ async def generate_full_book_task(
         raise
 
 
+@register_task("resume_book_generation")
+async def resume_book_generation_task(
+    book_id: str,
+    user_id: str,
+    db: Session,
+    face_url: Optional[str] = None,
+    child_photos: Optional[List[str]] = None,
+    task_id: Optional[str] = None
+):
+    """
+    Асинхронная задача для продолжения прерванной генерации книги.
+    Выполняет только незавершённые этапы и недостающие сцены.
+    """
+    try:
+        return await _run_book_pipeline(
+            book_id,
+            user_id,
+            db,
+            face_url=face_url,
+            child_photos=child_photos,
+            task_id=task_id
+        )
+    except Exception as e:
+        logger.error(f"❌ Ошибка в resume_book_generation_task: {str(e)}", exc_info=True)
+        if task_id:
+            update_task_progress(task_id, {
+                "stage": "error",
+                "message": f"Ошибка: {str(e)}"
+            })
+        raise
+
+
 @router.post("/generate_full_book")
 async def generate_full_book_endpoint(
     data: GenerateFullBookRequest,
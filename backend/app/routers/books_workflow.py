@@ -14,10 +14,10 @@ from pydantic import BaseModel
 from ..db import get_db
 from ..models import Book, Child, Scene, Image, ThemeStyle
 from ..services.gemini_service import generate_text
-from ..services.image_pipeline import generate_draft_image, generate_final_image
+from ..services.image_pipeline import generate_draft_image, generate_final_image, generate_draft_images_bounded
 from ..services.storage import upload_image as upload_image_bytes
 from ..core.deps import get_current_user
-from ..services.tasks import create_task, update_task_progress
+from ..services.tasks import create_task, update_task_progress, register_task
 from datetime import datetime
 from ..config.styles import (
     normalize_style,
@@ -204,6 +204,8 @@ async def generate_draft(
         pages_data = []
         cover_url = None
         
+        jobs = []
+        scenes_by_order = {}
         for scene in scenes:
             if not scene.image_prompt or not scene.image_prompt.strip():
                 logger.warning(f"⚠️ Пропущена сцена order={scene.order} без промпта для book_id={book_uuid}")
@@ -215,38 +217,51 @@ async def generate_draft(
             # Формируем промпт с выбранным стилем
             # КРИТИЧНО: НЕ используем "Visual style:" - эта фраза попадает в изображение как текст!
             enhanced_prompt = f"{normalized_style} style. {scene.image_prompt}"
+            jobs.append((scene.order, enhanced_prompt))
+            scenes_by_order[scene.order] = scene
+        
+        def save_draft(scene_order: int, image_url: str):
+            """Сохранить готовый черновик сразу: при ошибке другой сцены готовые не теряются."""
+            scene = scenes_by_order[scene_order]
             
-            # Генерируем черновое изображение через image_pipeline
-            image_url = await generate_draft_image(enhanced_prompt, style=normalized_style)
-            
-            # Сохраняем в Image модель
-            image_record = db.query(Image).filter(
-                Image.book_id == book_uuid,
-                Image.scene_order == scene.order
-            ).first()
-            
-            if image_record:
-                image_record.draft_url = image_url
-            else:
-                image_record = Image(
-                    book_id=book_uuid,
-                    scene_order=scene.order,
-                    draft_url=image_url
-                )
-                db.add(image_record)
-            
-            # Сохраняем обложку (первая сцена)
-            if scene.order == 1 and not cover_url:
-                cover_url = image_url
+            try:
+                # Сохраняем в Image модель
+                image_record = db.query(Image).filter(
+                    Image.book_id == book_uuid,
+                    Image.scene_order == scene_order
+                ).first()
+                
+                if image_record:
+                    image_record.draft_url = image_url
+                else:
+                    image_record = Image(
+                        book_id=book_uuid,
+                        scene_order=scene_order,
+                        draft_url=image_url
+                    )
+                    db.add(image_record)
+                
+                db.commit()
+            except Exception as db_error:
+                logger.error(f"❌ Ошибка при сохранении черновика в БД для сцены order={scene_order}: {str(db_error)}", exc_info=True)
+                db.rollback()
+                return
             
             # Формируем данные страницы
             pages_data.append({
-                "order": scene.order,
+                "order": scene_order,
                 "text": scene.text or "",
                 "image_url": image_url,
                 "image_prompt": scene.image_prompt or ""
             })
         
+        # Генерируем черновые изображения параллельно через image_pipeline
+        await generate_draft_images_bounded(jobs, normalized_style, on_result=save_draft)
+        pages_data.sort(key=lambda p: p["order"])
+        
+        # Сохраняем обложку (первая сцена)
+        cover_url = next((p["image_url"] for p in pages_data if p["order"] == 1), None)
+        
         # 7. Сохраняем всё в pages JSON и обновляем книгу
         book.pages = {"pages": pages_data}
         book.content = "\n\n".join([p.get("text", "") for p in pages_data])
@@ -383,7 +398,8 @@ async def regenerate_scene(
     
     # Генерируем новое изображение через image_pipeline
     try:
-        new_image_url = await generate_draft_image(enhanced_prompt, style=style)
+        # Пользователь просит новый вариант — в обход кэша изображений
+        new_image_url = await generate_draft_image(enhanced_prompt, style=style, use_cache=False)
         
         # Обновляем Image запись
         image_record = db.query(Image).filter(
@@ -818,6 +834,7 @@ class GenerateFinalVersionResponse(BaseModel):
     child_id: Optional[str] = None  # Добавлено для совместимости с фронтендом
 
 
+@register_task("generate_final_version")
 async def generate_final_version_task(
     book_id: str,
     user_id: str,
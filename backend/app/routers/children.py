@@ -14,6 +14,7 @@ from ..models import Child
 from ..core.deps import get_current_user
 from ..services.local_file_service import BASE_UPLOAD_DIR
 from ..services.storage import get_server_base_url
+from ..services.source_face_cache import invalidate_child as invalidate_source_face
 
 logger = logging.getLogger(__name__)
 
@@ -287,6 +288,8 @@ def update_child(
 
         db.commit()
         db.refresh(child)
+        if "face_url" in updated_fields:
+            invalidate_source_face(child.id)
 
         photos_urls = _get_child_photos_urls(child.id)
         logger.info(f"✓ update_child: Успешно обновлён ребёнок id={child.id}, получено {len(photos_urls)} фотографий")
@@ -346,6 +349,7 @@ async def upload_child_photo(
     with open(file_path, "wb") as f:
         content = await file.read()
         f.write(content)
+    invalidate_source_face(child_id)
     
     # Формируем URL
     base_url = get_server_base_url()
@@ -488,6 +492,7 @@ def delete_child_photo(
     except Exception as e:
         logger.error(f"Ошибка удаления файла {file_path}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Не удалось удалить файл")
+    invalidate_source_face(child_id)
 
     # Если это был avatar, сбрасываем face_url
     if child.face_url == photo_url:
@@ -544,6 +549,7 @@ def set_child_avatar(
     # Просто обновляем face_url
     child.face_url = photo_url
     db.commit()
+    invalidate_source_face(child_id)
 
     return {"status": "ok", "face_url": photo_url}
 
@@ -557,12 +563,98 @@ from ..schemas.face_profile import (
     CreateFaceProfileRequest,
     FaceProfileResponse,
     FaceProfileStatusResponse,
+    FaceProfileTaskResponse,
 )
-from ..services.face_service import build_face_profile
+from ..services.face_service import build_face_profile_async
+from ..services.tasks import create_task, register_task, update_task_progress
 import numpy as np
 
 
-@router.post("/{child_id}/face-profile", response_model=FaceProfileResponse)
+@register_task("build_face_profile")
+async def build_face_profile_task(child_id: int, photo_paths: List[str], db: Session, task_id: Optional[str] = None):
+    """
+    Фоновое создание face profile: фото декодируются и анализируются параллельно в пуле потоков,
+    затем embedding сохраняется в БД. Результат задачи — FaceProfileResponse.
+    """
+    child = db.query(Child).filter(Child.id == child_id).first()
+    if not child:
+        raise HTTPException(status_code=404, detail="Ребёнок не найден")
+
+    if task_id:
+        update_task_progress(task_id, {
+            "stage": "analyzing_photos",
+            "current_step": 0,
+            "total_steps": len(photo_paths),
+            "message": "Анализ фотографий...",
+            "child_id": child_id
+        })
+
+    def on_progress(done: int, total: int):
+        if task_id:
+            update_task_progress(task_id, {
+                "current_step": done,
+                "message": f"Обработано фотографий: {done}/{total}"
+            })
+
+    try:
+        # Создаём face profile
+        profile_data = await build_face_profile_async(photo_paths, child_id, on_progress=on_progress)
+        # reference.png пересоздан — исходное лицо для face swap нужно подготовить заново
+        invalidate_source_face(child_id)
+        
+        # Сохраняем или обновляем запись в БД
+        profile = db.query(ChildFaceProfile).filter(
+            ChildFaceProfile.child_id == child_id
+        ).first()
+        
+        if profile:
+            # Обновляем существующий профиль
+            profile.embedding = profile_data["mean_embedding_bytes"]
+            profile.reference_image_path = profile_data["reference_rel_path"]
+            db.commit()
+            db.refresh(profile)
+            logger.info(f"✓ Face profile обновлён для child_id={child_id}")
+        else:
+            # Создаём новый профиль
+            profile = ChildFaceProfile(
+                child_id=child_id,
+                embedding=profile_data["mean_embedding_bytes"],
+                reference_image_path=profile_data["reference_rel_path"]
+            )
+            db.add(profile)
+            db.commit()
+            db.refresh(profile)
+            logger.info(f"✓ Face profile создан для child_id={child_id}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка при создании face profile: {e}", exc_info=True)
+        db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ошибка при создании face profile: {str(e)}"
+        )
+
+    if task_id:
+        update_task_progress(task_id, {
+            "stage": "completed",
+            "message": "Face profile готов ✓",
+            "reference_image_url": profile_data["reference_public_url"]
+        })
+
+    return FaceProfileResponse(
+        child_id=child_id,
+        reference_image_url=profile_data["reference_public_url"],
+        embedding_saved=True,
+        valid_faces=profile_data["valid_faces"],
+        used_faces=profile_data["used_faces"],
+        threshold=0.60,
+        created_at=profile.created_at,
+        updated_at=profile.updated_at
+    ).model_dump()
+
+
+@router.post("/{child_id}/face-profile", response_model=FaceProfileTaskResponse)
 async def create_face_profile(
     child_id: int,
     data: CreateFaceProfileRequest,
@@ -570,11 +662,14 @@ async def create_face_profile(
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Создать face profile для ребёнка из фотографий.
+    Запустить создание face profile для ребёнка из фотографий.
     
     Требования:
     - Минимум 3 валидных лица из предоставленных фотографий
     - Создаёт reference.png и сохраняет embedding в БД
+    
+    Профиль создаётся фоновой задачей: статус, прогресс и результат (FaceProfileResponse) —
+    GET /books/task_status/{task_id}; готовый профиль — GET /children/{child_id}/face-profile.
     """
     user_id = current_user.get("sub") or current_user.get("id")
     if not user_id:
@@ -596,67 +691,16 @@ async def create_face_profile(
             detail="Требуется минимум 3 фотографии для создания face profile"
         )
     
-    try:
-        # Создаём face profile
-        profile_data = build_face_profile(data.photo_paths, child_id)
-        
-        # Сохраняем или обновляем запись в БД
-        existing_profile = db.query(ChildFaceProfile).filter(
-            ChildFaceProfile.child_id == child_id
-        ).first()
-        
-        if existing_profile:
-            # Обновляем существующий профиль
-            existing_profile.embedding = profile_data["mean_embedding_bytes"]
-            existing_profile.reference_image_path = profile_data["reference_rel_path"]
-            db.commit()
-            db.refresh(existing_profile)
-            
-            logger.info(f"✓ Face profile обновлён для child_id={child_id}")
-            
-            return FaceProfileResponse(
-                child_id=child_id,
-                reference_image_url=profile_data["reference_public_url"],
-                embedding_saved=True,
-                valid_faces=profile_data["valid_faces"],
-                used_faces=profile_data["used_faces"],
-                threshold=0.60,
-                created_at=existing_profile.created_at,
-                updated_at=existing_profile.updated_at
-            )
-        else:
-            # Создаём новый профиль
-            new_profile = ChildFaceProfile(
-                child_id=child_id,
-                embedding=profile_data["mean_embedding_bytes"],
-                reference_image_path=profile_data["reference_rel_path"]
-            )
-            db.add(new_profile)
-            db.commit()
-            db.refresh(new_profile)
-            
-            logger.info(f"✓ Face profile создан для child_id={child_id}")
-            
-            return FaceProfileResponse(
-                child_id=child_id,
-                reference_image_url=profile_data["reference_public_url"],
-                embedding_saved=True,
-                valid_faces=profile_data["valid_faces"],
-                used_faces=profile_data["used_faces"],
-                threshold=0.60,
-                created_at=new_profile.created_at,
-                updated_at=new_profile.updated_at
-            )
+    task_id = create_task(
+        build_face_profile_task,
+        child_id,
+        list(data.photo_paths),
+        db,
+        meta={"type": "face_profile", "user_id": str(user_id), "child_id": child_id}
+    )
+    logger.info(f"✅ Создание face profile для child_id={child_id} запущено: task_id={task_id}")
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Ошибка при создании face profile: {e}", exc_info=True)
-        db.rollback()
-        raise HTTPException(
-            status_code=500,
-            detail=f"Ошибка при создании face profile: {str(e)}"
-        )
+    return FaceProfileTaskResponse(task_id=task_id, status="processing", child_id=child_id)
 
 
 @router.get("/{child_id}/face-profile", response_model=FaceProfileStatusResponse)
@@ -5,15 +5,23 @@ from typing import List, Optional
 import requests
 import uuid
 import os
+import asyncio
 import logging
 
 from ..db import get_db
 from ..models import Scene, Image, ThemeStyle, Book, Child
 from ..services.image_pipeline import generate_final_image
+from ..services.print_asset_cache import schedule_prewarm
 from ..core.deps import get_current_user
+from ..services.tasks import register_task
 
 logger = logging.getLogger(__name__)
 
+# Сколько сцен книги генерируется одновременно (img2img + верификация + face swap)
+FINAL_IMAGE_CONCURRENCY = int(os.getenv("FINAL_IMAGE_CONCURRENCY", "3"))
+# Таймаут генерации одной сцены (секунды)
+FINAL_IMAGE_TIMEOUT = float(os.getenv("FINAL_IMAGE_TIMEOUT", "1800"))
+
 router = APIRouter(prefix="", tags=["final_images"])
 
 
@@ -30,6 +38,7 @@ class RegenerateSceneRequest(BaseModel):
     style: str
 
 
+@register_task("generate_final_images")
 async def _generate_final_images_internal(
     book_id: str,  # UUID как строка
     db: Session,
@@ -37,11 +46,15 @@ async def _generate_final_images_internal(
     final_style: str = None,
     face_url: Optional[str] = None,
     task_id: Optional[str] = None,
-    child_photos: Optional[list[str]] = None
+    child_photos: Optional[list[str]] = None,
+    skip_existing: bool = False
 ) -> dict:
     """
     Внутренняя функция для генерации финальных изображений.
     Может быть вызвана напрямую из других модулей.
+    
+    skip_existing=True — не перегенерировать сцены, у которых финальное изображение уже сохранено
+    (используется при возобновлении пайплайна генерации книги).
     """
     # Преобразуем строку book_id в UUID
     from uuid import UUID as UUIDType
@@ -82,6 +95,15 @@ async def _generate_final_images_internal(
     # Обложка должна быть первой, поэтому сортируем по order
     scenes_with_prompts = sorted([s for s in scenes if s.image_prompt], key=lambda x: x.order)
     
+    # Уже сохранённые финальные изображения (чекпоинты по сценам)
+    existing_finals = {}
+    if skip_existing:
+        existing_finals = {
+            img.scene_order: img.final_url
+            for img in db.query(Image).filter(Image.book_id == book_uuid).all()
+            if img.final_url
+        }
+    
     # Обновляем прогресс с общим количеством изображений
     if task_id:
         from ..services.tasks import update_task_progress
@@ -90,28 +112,55 @@ async def _generate_final_images_internal(
             "images_generated": 0
         })
     
-    for idx, scene in enumerate(scenes_with_prompts, 1):
-        # Проверяем, что книга все еще существует (может быть удалена во время генерации)
-        book_check = db.query(Book).filter(Book.id == book_uuid).first()
-        if not book_check:
-            logger.warning(f"⚠️ Книга {book_id} была удалена во время генерации. Прерываем генерацию финальных изображений.")
-            raise HTTPException(
-                status_code=410,
-                detail="Книга была удалена во время генерации. Генерация прервана."
-            )
+    # Данные ребёнка и фотографии одинаковы для всех сцен — получаем один раз
+    # Усиливаем указание возраста и пола ребенка в промпте
+    from ..models import Child
+    child = db.query(Child).filter(Child.id == book.child_id).first() if book.child_id else None
+    gender_text = "boy" if child and child.gender == "male" else "girl"
+    age_emphasis = f"IMPORTANT: The child character must look exactly {child.age} years old {gender_text} with child proportions: large head relative to body, short legs, small hands, chubby cheeks, big eyes. The character must be a {gender_text}, not the opposite gender! " if child and child.age else ""
+    child_id_for_face = child.id if child and child.id else None
+    
+    # КРИТИЧЕСКИ ВАЖНО: Используем ВСЕ фотографии ребёнка для лучшего сходства!
+    child_photo_path = None
+    child_photo_paths_list = []
+    
+    # Получаем путь к фото ребёнка из face_url (для обратной совместимости)
+    if face_url:
+        # Извлекаем путь из URL (формат: http://host:port/static/children/{child_id}/filename.jpg)
+        if "/static/" in face_url:
+            relative_path = face_url.split("/static/", 1)[1]
+            from ..services.storage import BASE_UPLOAD_DIR
+            child_photo_path = os.path.join(BASE_UPLOAD_DIR, relative_path)
+    
+    # Конвертируем все URL фотографий в пути к файлам
+    if child_photos:
+        from ..services.storage import BASE_UPLOAD_DIR
+        for photo_url in child_photos:
+            if isinstance(photo_url, str) and "/static/" in photo_url:
+                relative_path = photo_url.split("/static/", 1)[1]
+                photo_path = os.path.join(BASE_UPLOAD_DIR, relative_path)
+                if os.path.exists(photo_path):
+                    child_photo_paths_list.append(photo_path)
+                    logger.info(f"✓ Добавлена фотография для face swap: {photo_path}")
+                else:
+                    logger.warning(f"⚠️ Файл фотографии не найден: {photo_path}")
+    
+    # Используем sanitizer для обложки
+    from ..services.scene_utils import is_cover_scene
+    from ..services.prompt_sanitizer import build_cover_prompt
+    
+    jobs = []
+    for scene in scenes_with_prompts:
+        if scene.order in existing_finals:
+            logger.info(f"⏭️ Финальное изображение для сцены order={scene.order} уже есть, пропускаем")
+            results.append({
+                "order": scene.order,
+                "image_url": existing_finals[scene.order],
+                "style": final_style
+            })
+            continue
         
         # Формируем промпт с финальным стилем
-        # Для обложки (order=0) добавляем название книги в промпт, чтобы оно было частью изображения
-        # Усиливаем указание возраста и пола ребенка в промпте
-        from ..models import Child
-        child = db.query(Child).filter(Child.id == book_check.child_id).first() if book_check.child_id else None
-        gender_text = "boy" if child and child.gender == "male" else "girl"
-        age_emphasis = f"IMPORTANT: The child character must look exactly {child.age} years old {gender_text} with child proportions: large head relative to body, short legs, small hands, chubby cheeks, big eyes. The character must be a {gender_text}, not the opposite gender! " if child and child.age else ""
-        
-        # Используем sanitizer для обложки
-        from ..services.scene_utils import is_cover_scene
-        from ..services.prompt_sanitizer import build_cover_prompt
-        
         if is_cover_scene(scene):
             # Для обложки используем специальную функцию build_cover_prompt
             # которая полностью очищает промпт от инструкций о тексте
@@ -121,68 +170,89 @@ async def _generate_final_images_internal(
                 age_emphasis=age_emphasis
             )
             logger.info(f"🧼 Cover prompt built using sanitizer (order={scene.order})")
-        else:
+        elif final_style in ['marvel', 'dc', 'anime']:
             # Для новых премиум стилей (marvel, dc, anime) используем специальные промпты
-            if final_style in ['marvel', 'dc', 'anime']:
-                from ..services.style_prompts import get_style_prompt
-                enhanced_prompt = get_style_prompt(final_style, scene.image_prompt or "", is_cover=False)
-                if age_emphasis:
-                    enhanced_prompt = f"{age_emphasis}{enhanced_prompt}"
-            else:
-                # Для новых премиум стилей (marvel, dc, anime) используем специальные промпты
-                if final_style in ['marvel', 'dc', 'anime']:
-                    from ..services.style_prompts import get_style_prompt
-                    enhanced_prompt = get_style_prompt(final_style, scene.image_prompt or "", is_cover=False)
-                    if age_emphasis:
-                        enhanced_prompt = f"{age_emphasis}{enhanced_prompt}"
-                else:
-                    # Для остальных стилей используем стандартный формат
-                    enhanced_prompt = f"Visual style: {final_style}. {age_emphasis}{scene.image_prompt}"
-        
-        # Генерируем финальное изображение через image_pipeline с face swap
-        # КРИТИЧЕСКИ ВАЖНО: Используем ВСЕ фотографии ребёнка для лучшего сходства!
-        child_photo_path = None
-        child_photo_paths_list = []
-        
-        # Получаем путь к фото ребёнка из face_url (для обратной совместимости)
-        if face_url:
-            # Извлекаем путь из URL (формат: http://host:port/static/children/{child_id}/filename.jpg)
-            if "/static/" in face_url:
-                relative_path = face_url.split("/static/", 1)[1]
-                from ..services.storage import BASE_UPLOAD_DIR
-                child_photo_path = os.path.join(BASE_UPLOAD_DIR, relative_path)
-        
-        # Конвертируем все URL фотографий в пути к файлам
-        if child_photos:
-            from ..services.storage import BASE_UPLOAD_DIR
-            for photo_url in child_photos:
-                if isinstance(photo_url, str) and "/static/" in photo_url:
-                    relative_path = photo_url.split("/static/", 1)[1]
-                    photo_path = os.path.join(BASE_UPLOAD_DIR, relative_path)
-                    if os.path.exists(photo_path):
-                        child_photo_paths_list.append(photo_path)
-                        logger.info(f"✓ Добавлена фотография для face swap: {photo_path}")
-                    else:
-                        logger.warning(f"⚠️ Файл фотографии не найден: {photo_path}")
+            from ..services.style_prompts import get_style_prompt
+            enhanced_prompt = get_style_prompt(final_style, scene.image_prompt or "", is_cover=False)
+            if age_emphasis:
+                enhanced_prompt = f"{age_emphasis}{enhanced_prompt}"
+        else:
+            # Для остальных стилей используем стандартный формат
+            enhanced_prompt = f"Visual style: {final_style}. {age_emphasis}{scene.image_prompt}"
         
-        logger.info(f"🎭 Использование {len(child_photo_paths_list)} фотографий ребёнка для face swap на изображении сцены order={scene.order}")
+        # Для обложки передаем название книги отдельно
+        book_title_for_cover = book.title if scene.order == 0 else None
+        jobs.append((scene.order, enhanced_prompt, book_title_for_cover))
+    
+    total_images = len(scenes_with_prompts)
+    images_done = len(results)
+    scene_errors = []
+    book_deleted = False
+    semaphore = asyncio.Semaphore(max(1, FINAL_IMAGE_CONCURRENCY))
+    
+    logger.info(
+        f"🎭 Генерация {len(jobs)} финальных изображений (параллельно, до {FINAL_IMAGE_CONCURRENCY} одновременно), "
+        f"{len(child_photo_paths_list)} фотографий ребёнка для face swap"
+    )
+    
+    def save_final(scene_order: int, final_url: str):
+        """Сохранить финальное изображение сцены сразу после генерации."""
+        nonlocal images_done, book_deleted
+        # Проверяем существование книги перед сохранением (может быть удалена во время генерации)
+        if not db.query(Book).filter(Book.id == book_uuid).first():
+            logger.warning(f"⚠️ Книга {book_id} была удалена после генерации изображения для сцены order={scene_order}. Пропускаем сохранение.")
+            book_deleted = True
+            return
         
         try:
-            logger.info(f"🖼️ Генерация финального изображения для сцены order={scene.order} (сцена {idx}/{len(scenes_with_prompts)})")
+            image_record = db.query(Image).filter(
+                Image.book_id == book_uuid,
+                Image.scene_order == scene_order
+            ).first()
+            
+            if image_record:
+                image_record.final_url = final_url
+                image_record.style = final_style
+            else:
+                image_record = Image(
+                    book_id=book_uuid,
+                    scene_order=scene_order,
+                    final_url=final_url,
+                    style=final_style
+                )
+                db.add(image_record)
             
-            # Генерируем с таймаутом (максимум 5 минут на изображение)
-            import asyncio
+            db.commit()
+        except Exception as db_error:
+            logger.error(f"❌ Ошибка при сохранении изображения в БД для сцены order={scene_order}: {str(db_error)}", exc_info=True)
+            db.rollback()
+            # Продолжаем генерацию остальных изображений
+            return
+        
+        results.append({
+            "order": scene_order,
+            "image_url": final_url,
+            "style": final_style
+        })
+        images_done += 1
+        # Готовим печатный ассет (CMYK/skin-tone) в фоне, чтобы рендер PDF был в основном сборкой
+        schedule_prewarm(final_url, scene_order)
+        
+        # Обновляем прогресс после успешной генерации
+        if task_id:
+            from ..services.tasks import update_task_progress
+            update_task_progress(task_id, {
+                "images_generated": images_done,
+                "message": f"Финальное изображение {images_done}/{total_images} готово ✓"
+            })
+    
+    async def generate_scene(scene_order: int, enhanced_prompt: str, book_title_for_cover: Optional[str]):
+        """Сгенерировать одну сцену. Ошибка или таймаут сцены не останавливает остальные."""
+        async with semaphore:
+            if book_deleted:
+                return
+            logger.info(f"🖼️ Генерация финального изображения для сцены order={scene_order}")
             try:
-                # Для обложки передаем название книги отдельно
-                book_title_for_cover = None
-                if scene.order == 0:
-                    book_title_for_cover = book_check.title
-                
-                # Определяем child_id для использования face profile
-                child_id_for_face = None
-                if child and child.id:
-                    child_id_for_face = child.id
-                
                 final_url = await asyncio.wait_for(
                     generate_final_image(
                         enhanced_prompt, 
@@ -194,80 +264,49 @@ async def _generate_final_images_internal(
                         child_id=child_id_for_face,  # Передаем child_id для face profile
                         use_child_face=True  # Использовать face profile если доступен
                     ),
-                    timeout=1800.0  # 30 минут
+                    timeout=FINAL_IMAGE_TIMEOUT
                 )
-                logger.info(f"✓ Финальное изображение сгенерировано для сцены order={scene.order}: {final_url}")
             except asyncio.TimeoutError:
-                error_message = f"Таймаут при генерации финального изображения для сцены order={scene.order} (превышено 5 минут)"
+                error_message = f"Таймаут при генерации финального изображения для сцены order={scene_order} (превышено {FINAL_IMAGE_TIMEOUT / 60:.0f} минут)"
                 logger.error(f"❌ {error_message}")
-                # Пропускаем это изображение и продолжаем
+                # Пропускаем это изображение, остальные сцены продолжают генерироваться
                 if task_id:
                     from ..services.tasks import update_task_progress
                     update_task_progress(task_id, {
-                        "images_generated": idx - 1,
-                        "message": f"⚠ Пропущено изображение {idx}/{len(scenes_with_prompts)} из-за таймаута"
+                        "message": f"⚠ Пропущено изображение для сцены {scene_order} из-за таймаута"
                     })
-                continue  # Пропускаем это изображение
-            logger.info(f"✓ Финальное изображение сгенерировано для сцены order={scene.order}: {final_url}")
-        except HTTPException as e:
-            # HTTPException имеет атрибут detail, извлекаем его
-            error_message = f"Ошибка при генерации финального изображения для сцены order={scene.order}: {e.status_code}: {e.detail}"
-            logger.error(f"❌ {error_message}", exc_info=True)
-            raise
-        except Exception as e:
-            error_message = f"Ошибка при генерации финального изображения для сцены order={scene.order}: {str(e)}"
-            logger.error(f"❌ {error_message}", exc_info=True)
-            raise HTTPException(
-                status_code=500,
-                detail=error_message
-            )
-        
-        # Проверяем существование книги перед сохранением
-        book_check = db.query(Book).filter(Book.id == book_uuid).first()
-        if not book_check:
-            logger.warning(f"⚠️ Книга {book_id} была удалена после генерации изображения для сцены order={scene.order}. Пропускаем сохранение.")
-            continue  # Пропускаем сохранение, но продолжаем генерацию остальных
-        
-        # Сохраняем или обновляем запись в БД
-        try:
-            image_record = db.query(Image).filter(
-                Image.book_id == book_uuid,
-                Image.scene_order == scene.order
-            ).first()
+                return
+            except HTTPException as e:
+                # HTTPException имеет атрибут detail, извлекаем его
+                error_message = f"Ошибка при генерации финального изображения для сцены order={scene_order}: {e.status_code}: {e.detail}"
+                logger.error(f"❌ {error_message}", exc_info=True)
+                scene_errors.append(error_message)
+                return
+            except Exception as e:
+                error_message = f"Ошибка при генерации финального изображения для сцены order={scene_order}: {str(e)}"
+                logger.error(f"❌ {error_message}", exc_info=True)
+                scene_errors.append(error_message)
+                return
             
-            if image_record:
-                image_record.final_url = final_url
-                image_record.style = final_style
-            else:
-                image_record = Image(
-                    book_id=book_uuid,
-                    scene_order=scene.order,
-                    final_url=final_url,
-                    style=final_style
-                )
-                db.add(image_record)
-            
-            db.commit()
-            
-            results.append({
-                "order": scene.order,
-                "image_url": final_url,
-                "style": final_style
-            })
-            
-            # Обновляем прогресс после успешной генерации
-            if task_id:
-                from ..services.tasks import update_task_progress
-                update_task_progress(task_id, {
-                    "images_generated": idx,
-                    "message": f"Финальное изображение {idx}/{len(scenes_with_prompts)} готово ✓"
-                })
-        except Exception as db_error:
-            logger.error(f"❌ Ошибка при сохранении изображения в БД для сцены order={scene.order}: {str(db_error)}", exc_info=True)
-            db.rollback()
-            # Продолжаем генерацию остальных изображений
-            continue
+            logger.info(f"✓ Финальное изображение сгенерировано для сцены order={scene_order}: {final_url}")
+            save_final(scene_order, final_url)
+    
+    await asyncio.gather(*(generate_scene(*job) for job in jobs))
+    
+    if book_deleted:
+        raise HTTPException(
+            status_code=410,
+            detail="Книга была удалена во время генерации. Генерация прервана."
+        )
+    
+    # Успешные сцены уже сохранены — при возобновлении будут сгенерированы только упавшие
+    if scene_errors:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Не удалось сгенерировать {len(scene_errors)} из {len(jobs)} изображений. {scene_errors[0]}"
+        )
     
+    results.sort(key=lambda r: r["order"])
     return {"images": results}
 
 
@@ -372,7 +411,8 @@ async def regenerate_scene_endpoint(
             enhanced_prompt, 
             face_url=data.face_url,
             child_photo_path=child_photo_path, 
-            style=final_style
+            style=final_style,
+            use_cache=False  # Перегенерация — новый вариант, а не изображение из кэша
         )
         
         # Обновляем запись в БД
@@ -394,6 +434,7 @@ async def regenerate_scene_endpoint(
             db.add(image_record)
         
         db.commit()
+        schedule_prewarm(final_url, data.scene_order)
         
         return {
             "order": data.scene_order,
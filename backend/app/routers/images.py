@@ -6,7 +6,7 @@ import requests
 
 from ..db import get_db
 from ..models import Scene, Image, ThemeStyle, Book
-from ..services.image_pipeline import generate_draft_image
+from ..services.image_pipeline import generate_draft_images_bounded, IMAGE_BOOK_CONCURRENCY
 from ..services.storage import upload_image as upload_image_bytes
 from ..core.deps import get_current_user
 
@@ -23,11 +23,15 @@ async def _generate_draft_images_internal(
     db: Session,
     user_id: str,
     final_style: str = None,
-    task_id: Optional[str] = None
+    task_id: Optional[str] = None,
+    skip_existing: bool = False
 ):
     """
     Внутренняя функция для генерации черновых изображений.
     Принимает user_id напрямую, без Depends().
+    
+    skip_existing=True — не перегенерировать сцены, у которых черновик уже сохранён
+    (используется при возобновлении пайплайна генерации книги).
     """
     import logging
     logger = logging.getLogger(__name__)
@@ -66,6 +70,15 @@ async def _generate_draft_images_internal(
     scenes_with_prompts = [s for s in scenes if s.image_prompt]
     logger.info(f"🖼️ _generate_draft_images_internal: Сцен с промптами: {len(scenes_with_prompts)}")
     
+    # Уже сохранённые черновики (чекпоинты по сценам)
+    existing_drafts = {}
+    if skip_existing:
+        existing_drafts = {
+            img.scene_order: img.draft_url
+            for img in db.query(Image).filter(Image.book_id == book_uuid).all()
+            if img.draft_url
+        }
+    
     # Обновляем прогресс с общим количеством изображений в начале генерации
     if task_id:
         from ..services.tasks import update_task_progress
@@ -78,33 +91,24 @@ async def _generate_draft_images_internal(
         })
         logger.info(f"✅ Progress инициализирован: total_images={len(scenes_with_prompts)}")
 
-    for idx, scene in enumerate(scenes_with_prompts, 1):
-        logger.info(f"🖼️ Генерация изображения {idx}/{len(scenes_with_prompts)} для сцены order={scene.order}")
-        
-        # Обновляем прогресс ПЕРЕД генерацией (показываем, что начинаем генерацию)
-        if task_id:
-            from ..services.tasks import update_task_progress
-            update_task_progress(task_id, {
-                "stage": "generating_draft_images",  # Сохраняем stage
-                "images_generated": idx - 1,  # Количество уже созданных (idx - 1)
-                "total_images": len(scenes_with_prompts),  # Сохраняем total_images
-                "message": f"Генерация изображения {idx}/{len(scenes_with_prompts)}...",
-                "book_id": str(data.book_id)  # Сохраняем book_id
-            })
-        
-        # Формируем промпт с финальным стилем (если есть)
-        # КРИТИЧНО: Для обложки используем sanitizer, чтобы убрать все инструкции о тексте
-        # Усиливаем указание возраста ребенка в промпте
-        # ВАЖНО: НЕ используем слово "IMPORTANT:" - оно попадает в изображение как текст!
-        from ..models import Child
-        child = db.query(Child).filter(Child.id == book.child_id).first() if book.child_id else None
-        age_emphasis = f"The child character must look exactly {child.age} years old with child proportions: large head relative to body, short legs, small hands, chubby cheeks, big eyes. " if child and child.age else ""
-        
-        # КРИТИЧНО: Для ВСЕХ сцен используем sanitizer, чтобы убрать метаданные,
-        # которые Pollinations.ai рендерит как текст на изображении!
-        # Убираем: "Visual style:", "IMPORTANT:", имена, возраст, инструкции о пропорциях
-        from ..services.scene_utils import is_cover_scene
-        from ..services.prompt_sanitizer import build_cover_prompt, sanitize_scene_prompt
+    # Усиливаем указание возраста ребенка в промпте
+    # ВАЖНО: НЕ используем слово "IMPORTANT:" - оно попадает в изображение как текст!
+    from ..models import Child
+    child = db.query(Child).filter(Child.id == book.child_id).first() if book.child_id else None
+    age_emphasis = f"The child character must look exactly {child.age} years old with child proportions: large head relative to body, short legs, small hands, chubby cheeks, big eyes. " if child and child.age else ""
+    
+    # КРИТИЧНО: Для ВСЕХ сцен используем sanitizer, чтобы убрать метаданные,
+    # которые Pollinations.ai рендерит как текст на изображении!
+    # Убираем: "Visual style:", "IMPORTANT:", имена, возраст, инструкции о пропорциях
+    from ..services.scene_utils import is_cover_scene
+    from ..services.prompt_sanitizer import build_cover_prompt, sanitize_scene_prompt
+    
+    jobs = []
+    for scene in scenes_with_prompts:
+        if scene.order in existing_drafts:
+            logger.info(f"⏭️ Черновик для сцены order={scene.order} уже есть, пропускаем")
+            results.append({"order": scene.order, "image_url": existing_drafts[scene.order]})
+            continue
         
         if is_cover_scene(scene):
             # Для обложки используем специальный sanitizer - убирает ВСЕ инструкции о тексте
@@ -117,48 +121,34 @@ async def _generate_draft_images_internal(
         else:
             # КРИТИЧНО: Для обычных сцен тоже используем sanitizer!
             # Pollinations.ai рендерит "Visual style:", "IMPORTANT:", имена как текст на изображении!
-            if final_style:
-                # Для новых премиум стилей (marvel, dc, anime) используем специальные промпты
-                if final_style in ['marvel', 'dc', 'anime']:
-                    from ..services.style_prompts import get_style_prompt
-                    base_prompt = get_style_prompt(final_style, scene.image_prompt or "", is_cover=False)
-                    # Санитизируем результат - убираем метаданные
-                    enhanced_prompt = sanitize_scene_prompt(base_prompt, style=None)  # стиль уже в промпте
-                else:
-                    # Санитизируем промпт и добавляем стиль в конец (не в начало!)
-                    enhanced_prompt = sanitize_scene_prompt(
-                        scene.image_prompt or "",
-                        style=final_style
-                    )
+            # Для новых премиум стилей (marvel, dc, anime) используем специальные промпты
+            if final_style in ['marvel', 'dc', 'anime']:
+                from ..services.style_prompts import get_style_prompt
+                base_prompt = get_style_prompt(final_style, scene.image_prompt or "", is_cover=False)
+                # Санитизируем результат - убираем метаданные
+                enhanced_prompt = sanitize_scene_prompt(base_prompt, style=None)  # стиль уже в промпте
             else:
-                enhanced_prompt = sanitize_scene_prompt(scene.image_prompt or "", style="storybook")
-                final_style = "storybook"  # дефолтный стиль
+                # Санитизируем промпт и добавляем стиль в конец (не в начало!)
+                enhanced_prompt = sanitize_scene_prompt(
+                    scene.image_prompt or "",
+                    style=final_style
+                )
             
             logger.info(f"🧼 Scene prompt sanitized (order={scene.order}): {enhanced_prompt[:100]}...")
         
-        # Генерируем черновое изображение через image_pipeline
-        try:
-            logger.info(f"🖼️ Вызов generate_draft_image для сцены order={scene.order}")
-            image_url = await generate_draft_image(enhanced_prompt, style=final_style)
-            logger.info(f"✓ Изображение сгенерировано для сцены order={scene.order}: {image_url}")
-        except HTTPException as e:
-            # HTTPException имеет атрибут detail, извлекаем его
-            error_message = f"Ошибка при генерации изображения для сцены order={scene.order}: {e.status_code}: {e.detail}"
-            logger.error(f"❌ {error_message}", exc_info=True)
-            raise
-        except Exception as e:
-            error_message = f"Ошибка при генерации изображения для сцены order={scene.order}: {str(e)}"
-            logger.error(f"❌ {error_message}", exc_info=True)
-            raise HTTPException(
-                status_code=500,
-                detail=error_message
-            )
-        
-        # Сохраняем или обновляем запись в БД
+        jobs.append((scene.order, enhanced_prompt))
+    
+    total_images = len(scenes_with_prompts)
+    images_done = len(results)
+    
+    def save_draft(scene_order: int, image_url: str):
+        """Сохранить готовый черновик сразу, чтобы не потерять прогресс."""
+        nonlocal images_done
+        logger.info(f"✓ Изображение сгенерировано для сцены order={scene_order}: {image_url}")
         try:
             image_record = db.query(Image).filter(
                 Image.book_id == book_uuid,
-                Image.scene_order == scene.order
+                Image.scene_order == scene_order
             ).first()
             
             if image_record:
@@ -166,33 +156,52 @@ async def _generate_draft_images_internal(
             else:
                 image_record = Image(
                     book_id=book_uuid,
-                    scene_order=scene.order,
+                    scene_order=scene_order,
                     draft_url=image_url
                 )
                 db.add(image_record)
             
             # КРИТИЧЕСКИ ВАЖНО: Сохраняем каждое изображение сразу, чтобы не потерять прогресс
             db.commit()
-            logger.info(f"✓ Изображение сохранено в БД для сцены order={scene.order}")
+            logger.info(f"✓ Изображение сохранено в БД для сцены order={scene_order}")
         except Exception as db_error:
-            logger.error(f"❌ Ошибка при сохранении изображения в БД для сцены order={scene.order}: {str(db_error)}", exc_info=True)
+            logger.error(f"❌ Ошибка при сохранении изображения в БД для сцены order={scene_order}: {str(db_error)}", exc_info=True)
             db.rollback()
             # Продолжаем генерацию остальных изображений
-            continue
+            return
         
-        results.append({"order": scene.order, "image_url": image_url})
+        results.append({"order": scene_order, "image_url": image_url})
+        images_done += 1
         
         # Обновляем прогресс ПОСЛЕ сохранения изображения
         if task_id:
             from ..services.tasks import update_task_progress
             update_task_progress(task_id, {
                 "stage": "generating_draft_images",  # Сохраняем stage
-                "images_generated": idx,  # Количество созданных изображений (idx, так как уже сохранено)
-                "total_images": len(scenes_with_prompts),  # Сохраняем total_images
-                "message": f"Изображение {idx}/{len(scenes_with_prompts)} создано",
+                "images_generated": images_done,  # Количество уже созданных изображений
+                "total_images": total_images,  # Сохраняем total_images
+                "message": f"Изображение {images_done}/{total_images} создано",
                 "book_id": str(data.book_id)  # Сохраняем book_id
             })
     
+    # Генерируем черновые изображения параллельно (с лимитом на книгу и на процесс)
+    logger.info(f"🖼️ Генерация {len(jobs)} черновых изображений (параллельно, до {IMAGE_BOOK_CONCURRENCY} одновременно)")
+    try:
+        await generate_draft_images_bounded(jobs, final_style, on_result=save_draft)
+    except HTTPException as e:
+        # HTTPException имеет атрибут detail, извлекаем его
+        logger.error(f"❌ Ошибка при генерации черновых изображений: {e.status_code}: {e.detail}", exc_info=True)
+        raise
+    except Exception as e:
+        error_message = f"Ошибка при генерации черновых изображений: {str(e)}"
+        logger.error(f"❌ {error_message}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=error_message
+        )
+    
+    results.sort(key=lambda r: r["order"])
+    
     logger.info(f"✅ _generate_draft_images_internal: Успешно завершено для book_id={data.book_id}, сгенерировано изображений: {len(results)}")
     
     # Финальное обновление progress после завершения всех изображений
@@ -7,7 +7,7 @@ from pydantic import BaseModel
 from typing import Optional
 from uuid import UUID
 from datetime import datetime
-import httpx
+from ..services.http_clients import http_client
 import os
 import logging
 import base64
@@ -119,7 +119,7 @@ async def send_telegram(text: str, pdf_path: Optional[str] = None, message_threa
             # Убираем @ если есть, Telegram API принимает username без @
             chat_id = chat_id.lstrip('@')
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
+        async with http_client("telegram") as client:
             # Сначала отправляем полное текстовое сообщение
             message_params = {
                 "chat_id": chat_id,
@@ -270,7 +270,7 @@ async def send_order_notifications(order: PrintOrderCreate, order_id: str, user_
                         # Если не удалось конвертировать, скачиваем файл временно
                         try:
                             import tempfile
-                            async with httpx.AsyncClient() as client:
+                            async with http_client("default") as client:
                                 response = await client.get(pdf_url, timeout=30.0)
                                 if response.status_code == 200:
                                     with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
@@ -8,7 +8,7 @@ from typing import Optional
 from uuid import UUID
 import logging
 import os
-import httpx
+from ..services.http_clients import http_client
 from datetime import datetime
 
 from ..db import get_db
@@ -148,7 +148,7 @@ async def send_telegram(text: str, message_thread_id: Optional[int] = None):
             params["message_thread_id"] = message_thread_id
             logger.info(f"[Payments][Telegram] Отправка в тему Telegram (thread_id: {message_thread_id})")
         
-        async with httpx.AsyncClient() as client:
+        async with http_client("telegram") as client:
             response = await client.post(
                 f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
                 json=params,
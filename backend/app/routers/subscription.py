@@ -8,7 +8,7 @@ from datetime import datetime, timedelta, timezone
 from uuid import UUID
 from typing import Optional
 
-import httpx
+from ..services.http_clients import http_client
 
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from pydantic import BaseModel
@@ -101,7 +101,7 @@ async def _send_telegram(text: str, message_thread_id: Optional[int] = None) ->
             params["message_thread_id"] = message_thread_id
             logger.info(f"[Subscription][Telegram] Отправка в тему Telegram (thread_id: {message_thread_id})")
         
-        async with httpx.AsyncClient() as client:
+        async with http_client("telegram") as client:
             response = await client.post(
                 f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
                 json=params,
@@ -10,7 +10,7 @@ from datetime import datetime
 from uuid import UUID
 import os
 import logging
-import httpx
+from ..services.http_clients import http_client
 
 from ..db import get_db
 from ..core.deps import get_current_user
@@ -150,7 +150,7 @@ async def send_telegram(
         if inline_keyboard:
             params["reply_markup"] = inline_keyboard
         
-        async with httpx.AsyncClient() as client:
+        async with http_client("telegram") as client:
             response = await client.post(url, json=params, timeout=10.0)
             
             if response.status_code == 200:
@@ -1011,7 +1011,7 @@ async def answer_callback_query(callback_query_id: str, text: str, show_alert: b
             "show_alert": show_alert
         }
         
-        async with httpx.AsyncClient() as client:
+        async with http_client("telegram") as client:
             response = await client.post(url, json=params, timeout=5.0)
             if response.status_code == 200:
                 logger.info(f"[Support] ✓ Callback query ответ отправлен: {callback_query_id}")
@@ -1154,7 +1154,7 @@ async def get_telegram_webhook_info():
     
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getWebhookInfo"
-        async with httpx.AsyncClient() as client:
+        async with http_client("telegram") as client:
             response = await client.get(url, timeout=10.0)
             
             if response.status_code == 200:
@@ -1205,7 +1205,7 @@ async def setup_telegram_webhook(
         if secret_token:
             params["secret_token"] = secret_token
         
-        async with httpx.AsyncClient() as client:
+        async with http_client("telegram") as client:
             response = await client.post(url, json=params, timeout=10.0)
             
             if response.status_code == 200:
@@ -1243,7 +1243,7 @@ async def delete_telegram_webhook():
     
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/deleteWebhook"
-        async with httpx.AsyncClient() as client:
+        async with http_client("telegram") as client:
             response = await client.post(url, timeout=10.0)
             
             if response.status_code == 200:
@@ -23,6 +23,13 @@ class FaceProfileResponse(BaseModel):
     updated_at: Optional[datetime] = None
 
 
+class FaceProfileTaskResponse(BaseModel):
+    """Ответ на запуск создания face profile (фоновая задача)."""
+    task_id: str
+    status: str
+    child_id: int
+
+
 class FaceProfileStatusResponse(BaseModel):
     """Статус face profile."""
     exists: bool
@@ -0,0 +1,115 @@
+"""
+Бенчмарк конвертации RGB → CMYK для печати (print/color_management.py).
+
+Сравнивает пропускную способность:
+- per_image — прежний вариант: профили и ImageCmsTransform создаются для каждого изображения;
+- cached — общая трансформация на процесс;
+- lut — предвычисленная 3D LUT (Color3DLUT) из той же трансформации;
+и расхождение LUT с точной ICC-конвертацией (среднее и максимальное отклонение по каналам CMYK, 0-255).
+
+Пример:
+    python app/scripts/benchmark_color_pipeline.py --icc /path/ISOcoated_v2_300_eci.icc --pages 10
+"""
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Добавляем путь к app
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import numpy as np
+from PIL import Image, ImageCms
+
+from app.print.color_management import find_icc_profile_path, get_rgb_to_cmyk_lut, get_rgb_to_cmyk_transform
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _test_pages(count: int, size: int, seed: int):
+    """Случайный шум и плавные градиенты (градиенты показывают ошибку интерполяции LUT)."""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 255, size, dtype=np.float32)
+    pages = []
+    for i in range(count):
+        if i % 2 == 0:
+            pages.append(Image.fromarray(rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)))
+        else:
+            r = np.tile(ramp, (size, 1))
+            g = r.T
+            b = np.full((size, size), rng.uniform(0, 255), dtype=np.float32)
+            pages.append(Image.fromarray(np.stack([r, g, b], axis=-1).astype(np.uint8)))
+    return pages
+
+
+def _per_image(icc_path: str, image: Image.Image) -> Image.Image:
+    transform = ImageCms.ImageCmsTransform(
+        ImageCms.createProfile("sRGB"),
+        ImageCms.ImageCmsProfile(icc_path),
+        "RGB",
+        "CMYK"
+    )
+    return transform.apply(image)
+
+
+def _measure(name: str, fn, pages, size: int):
+    started = time.perf_counter()
+    results = [fn(page) for page in pages]
+    elapsed = time.perf_counter() - started
+    megapixels = len(pages) * size * size / 1e6
+    logger.info(
+        f"   {name:10s} {elapsed / len(pages) * 1000:8.1f}мс/стр  {len(pages) / elapsed:6.1f} стр/с  "
+        f"{megapixels / elapsed:7.1f} Мпикс/с"
+    )
+    return results
+
+
+def run(icc_path: str, pages_count: int, size: int, lut_size: int, seed: int) -> bool:
+    transform = get_rgb_to_cmyk_transform(icc_path)
+    if transform is None:
+        logger.error(f"❌ Не удалось создать ICC трансформацию для {icc_path}")
+        return False
+
+    started = time.perf_counter()
+    lut = get_rgb_to_cmyk_lut(icc_path, lut_size)
+    logger.info(f"✓ LUT {lut_size}³ построена за {(time.perf_counter() - started) * 1000:.0f}мс")
+
+    pages = _test_pages(pages_count, size, seed)
+    logger.info(f"📊 {pages_count} страниц {size}x{size}:")
+    _measure("per_image", lambda page: _per_image(icc_path, page), pages, size)
+    exact = _measure("cached", transform.apply, pages, size)
+    if lut is None:
+        logger.warning("⚠️ LUT недоступна, пропускаем")
+        return True
+    approx = _measure("lut", lambda page: page.filter(lut), pages, size)
+
+    diffs = np.concatenate([
+        np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).reshape(-1, 4)
+        for a, b in zip(exact, approx)
+    ])
+    mean = ", ".join(f"{channel}={value:.2f}" for channel, value in zip("CMYK", diffs.mean(axis=0)))
+    peak = ", ".join(f"{channel}={value}" for channel, value in zip("CMYK", diffs.max(axis=0)))
+    logger.info(f"🎯 Отклонение LUT от ICC: среднее {mean}; максимум {peak}")
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Бенчмарк RGB->CMYK: ICC на каждое изображение, общая трансформация, 3D LUT")
+    parser.add_argument("--icc", default=None, help="Путь к ICC профилю (по умолчанию — как в color_management)")
+    parser.add_argument("--pages", type=int, default=10, help="Количество тестовых страниц")
+    parser.add_argument("--size", type=int, default=1024, help="Сторона тестового изображения")
+    parser.add_argument("--lut-size", type=int, default=33, help="Узлов LUT на канал")
+    parser.add_argument("--seed", type=int, default=0, help="Seed генератора")
+
+    args = parser.parse_args()
+
+    icc_path = args.icc or find_icc_profile_path()
+    if not icc_path:
+        logger.error("❌ ICC профиль не найден: укажите --icc или PRINT_ICC_PROFILE_PATH")
+        sys.exit(1)
+
+    success = run(icc_path, max(args.pages, 1), args.size, args.lut_size, args.seed)
+    sys.exit(0 if success else 1)
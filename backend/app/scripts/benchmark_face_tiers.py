@@ -0,0 +1,154 @@
+"""
+Бенчмарк уровней производительности моделей лиц (FACE_MODEL_TIER).
+
+Для каждого уровня измеряет задержку анализа лица (детекция + embedding) на наборе изображений
+и расхождение с уровнем quality (текущая конфигурация):
+- cosine similarity embeddings лучшего лица (1.0 — полное совпадение);
+- IoU bbox лучшего лица;
+- изображения, где лицо найдено только на одном из уровней.
+
+Пример:
+    python app/scripts/benchmark_face_tiers.py /var/www/storyhero/uploads/children/1 --runs 3
+"""
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Добавляем путь к app
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import cv2
+import numpy as np
+
+from app.services.face_models import FACE_MODEL_TIERS, analyze_faces, build_face_analyzer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def collect_images(paths: List[str]) -> List[str]:
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        else:
+            images.append(path)
+    return images
+
+
+def _best_face(faces: list):
+    if not faces:
+        return None
+    return max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-8))
+
+
+def run_tier(name: str, images: Dict[str, np.ndarray], runs: int) -> Dict[str, object]:
+    config = FACE_MODEL_TIERS[name]
+    logger.info(f"🔧 Уровень {name}: {config}")
+    analyzer = build_face_analyzer(config)
+    # Прогрев: первая сессия ONNX Runtime заметно медленнее
+    analyze_faces(next(iter(images.values())), analyzer=analyzer, detect_max_side=config["detect_max_side"])
+
+    latencies = []
+    best_faces = {}
+    for path, img in images.items():
+        for _ in range(runs):
+            started = time.perf_counter()
+            faces = analyze_faces(img, analyzer=analyzer, detect_max_side=config["detect_max_side"])
+            latencies.append(time.perf_counter() - started)
+        best_faces[path] = _best_face(faces)
+    latencies.sort()
+    return {
+        "latency_avg_ms": 1000 * sum(latencies) / len(latencies),
+        "latency_p95_ms": 1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "faces": best_faces,
+    }
+
+
+def compare(reference: Dict[str, object], result: Dict[str, object]) -> Dict[str, Optional[float]]:
+    similarities, ious = [], []
+    mismatched = 0
+    for path, ref_face in reference["faces"].items():
+        face = result["faces"].get(path)
+        if (ref_face is None) != (face is None):
+            mismatched += 1
+            continue
+        if ref_face is None:
+            continue
+        similarities.append(_cosine(ref_face.embedding, face.embedding))
+        ious.append(_iou(ref_face.bbox, face.bbox))
+    return {
+        "similarity_min": min(similarities) if similarities else None,
+        "similarity_avg": sum(similarities) / len(similarities) if similarities else None,
+        "bbox_iou_avg": sum(ious) / len(ious) if ious else None,
+        "detection_mismatches": mismatched,
+    }
+
+
+def benchmark(paths: List[str], tiers: List[str], runs: int) -> bool:
+    image_paths = collect_images(paths)
+    images = {}
+    for path in image_paths:
+        img = cv2.imread(path)
+        if img is None:
+            logger.warning(f"⚠️ Не удалось загрузить изображение: {path}")
+            continue
+        images[path] = img
+    if not images:
+        logger.error("❌ Нет изображений для бенчмарка")
+        return False
+    logger.info(f"🧪 Бенчмарк на {len(images)} изображениях, {runs} прогона(ов) на изображение")
+
+    if "quality" not in tiers:
+        tiers = ["quality"] + tiers
+    results = {name: run_tier(name, images, runs) for name in tiers}
+    reference = results["quality"]
+
+    logger.info("📊 Результаты (расхождение относительно quality):")
+    for name, result in results.items():
+        drift = compare(reference, result)
+        speedup = reference["latency_avg_ms"] / result["latency_avg_ms"] if result["latency_avg_ms"] else 0.0
+        similarity = f"{drift['similarity_avg']:.4f} (min {drift['similarity_min']:.4f})" if drift["similarity_avg"] is not None else "—"
+        iou = f"{drift['bbox_iou_avg']:.3f}" if drift["bbox_iou_avg"] is not None else "—"
+        logger.info(
+            f"   {name:9s} avg={result['latency_avg_ms']:7.1f}мс p95={result['latency_p95_ms']:7.1f}мс "
+            f"x{speedup:.2f} | similarity={similarity} bbox_iou={iou} "
+            f"несовпадений детекции={drift['detection_mismatches']}"
+        )
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Бенчмарк уровней моделей лиц: задержка и расхождение embeddings")
+    parser.add_argument("paths", nargs="+", help="Изображения или каталоги с изображениями")
+    parser.add_argument("--tiers", default=",".join(FACE_MODEL_TIERS),
+                        help="Уровни через запятую (quality всегда включается как эталон)")
+    parser.add_argument("--runs", type=int, default=3, help="Прогонов на изображение")
+
+    args = parser.parse_args()
+
+    tiers = [t.strip() for t in args.tiers.split(",") if t.strip() in FACE_MODEL_TIERS]
+    success = benchmark(args.paths, tiers, max(args.runs, 1))
+    sys.exit(0 if success else 1)
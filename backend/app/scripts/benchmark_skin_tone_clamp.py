@@ -0,0 +1,176 @@
+"""
+Проверка эквивалентности и микробенчмарк векторизованного skin-tone clamp (print/skin_tone_clamp.py).
+
+Сравнивает clamp_and_blend с прежними попиксельными циклами из skin_tone_safe и skin_tone_service
+на случайных CMYK-изображениях с мягкой маской лица: результат должен совпадать бит в бит
+для clamp_skin_tones (в том числе для значений в процентах, > 1.0) и для всех preset'ов
+из cmyk_presets. Затем замеряет время обеих версий.
+
+Пример:
+    python app/scripts/benchmark_skin_tone_clamp.py --size 1024 --runs 3
+"""
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Добавляем путь к app
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.print.skin_tone_clamp import clamp_and_blend, preset_bounds
+from app.print.skin_tone_safe import SKIN_TONE_CLAMP_BOUNDS, clamp_skin_tones
+from app.services.cmyk_presets import SKIN_TONE_PRESETS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def legacy_clamp_normalized(img_array, mask_array, region):
+    """Прежний цикл apply_skin_tone_clamp_to_image (значения 0-1.0, маска-эллипс)."""
+    x1, y1, x2, y2 = region
+    clamped_count = 0
+    for y in range(y1, y2):
+        for x in range(x1, x2):
+            alpha = mask_array[y, x]
+            if alpha > 0:
+                c, m, y_val, k = img_array[y, x]
+                c_clamped, m_clamped, y_clamped, k_clamped = clamp_skin_tones(c, m, y_val, k)
+                img_array[y, x, 0] = c * (1 - alpha) + c_clamped * alpha
+                img_array[y, x, 1] = m * (1 - alpha) + m_clamped * alpha
+                img_array[y, x, 2] = y_val * (1 - alpha) + y_clamped * alpha
+                img_array[y, x, 3] = k * (1 - alpha) + k_clamped * alpha
+                if c != c_clamped or m != m_clamped or y_val != y_clamped or k != k_clamped:
+                    clamped_count += 1
+    return clamped_count
+
+
+def legacy_clamp_preset(cmyk_array, mask, region, preset):
+    """Прежний цикл apply_skin_tone_safe_cmyk (значения 0-255 float32, порог маски 0.01)."""
+    x1, y1, x2, y2 = region
+    height, width = cmyk_array.shape[:2]
+    clamped_count = 0
+    for y in range(y1, min(y2, height)):
+        for x in range(x1, min(x2, width)):
+            mask_weight = mask[y, x]
+            if mask_weight > 0.01:
+                c, m, y_val, k = cmyk_array[y, x]
+                c_clamped = np.clip(c, *preset["C"])
+                m_clamped = np.clip(m, *preset["M"])
+                y_clamped = np.clip(y_val, *preset["Y"])
+                k_clamped = np.clip(k, *preset["K"])
+                if mask_weight < 1.0:
+                    cmyk_array[y, x, 0] = c * (1 - mask_weight) + c_clamped * mask_weight
+                    cmyk_array[y, x, 1] = m * (1 - mask_weight) + m_clamped * mask_weight
+                    cmyk_array[y, x, 2] = y_val * (1 - mask_weight) + y_clamped * mask_weight
+                    cmyk_array[y, x, 3] = k * (1 - mask_weight) + k_clamped * mask_weight
+                else:
+                    cmyk_array[y, x, 0] = c_clamped
+                    cmyk_array[y, x, 1] = m_clamped
+                    cmyk_array[y, x, 2] = y_clamped
+                    cmyk_array[y, x, 3] = k_clamped
+                if c != c_clamped or m != m_clamped or y_val != y_clamped or k != k_clamped:
+                    clamped_count += 1
+    return clamped_count
+
+
+def _ellipse_mask(size, region):
+    mask = Image.new("L", (size, size), 0)
+    ImageDraw.Draw(mask).ellipse(list(region), fill=255)
+    return np.array(mask.filter(ImageFilter.GaussianBlur(radius=16))) / 255.0
+
+
+def _rect_mask(size, region):
+    x1, y1, x2, y2 = region
+    mask = np.zeros((size, size), dtype=np.float32)
+    mask[y1:y2, x1:x2] = 1.0
+    blurred = Image.fromarray((mask * 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(radius=16))
+    return np.array(blurred, dtype=np.float32) / 255.0
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def run(size: int, runs: int, seed: int) -> bool:
+    rng = np.random.default_rng(seed)
+    ok = True
+    timings = {}
+
+    for run_index in range(runs):
+        cmyk_uint8 = rng.integers(0, 256, size=(size, size, 4), dtype=np.uint8)
+        face = int(size * rng.uniform(0.25, 0.5))
+        x1, y1 = (int(v) for v in rng.integers(0, size - face, size=2))
+        region = (x1, y1, x1 + face, y1 + face)
+
+        # skin_tone_safe: значения 0-1.0, границы clamp_skin_tones
+        mask = _ellipse_mask(size, region)
+        expected = cmyk_uint8.astype(float) / 255.0
+        actual = expected.copy()
+        expected_count, legacy_time = _timed(legacy_clamp_normalized, expected, mask, region)
+        actual_count, vector_time = _timed(
+            clamp_and_blend, actual, mask, *SKIN_TONE_CLAMP_BOUNDS, region, 0.0, True
+        )
+        same = np.array_equal(expected, actual) and expected_count == actual_count
+        ok &= same
+        timings.setdefault("skin_tone_safe", []).append((legacy_time, vector_time))
+        if not same:
+            logger.error(f"❌ skin_tone_safe: расхождение (прогон {run_index + 1})")
+
+        # skin_tone_safe: значения в процентах (0-100) вперемешку с 0-1.0 — ветка нормализации
+        expected = cmyk_uint8.astype(float) / 255.0
+        percent_rows = rng.random(size) < 0.5
+        expected[percent_rows] *= 100.0
+        actual = expected.copy()
+        expected_count, legacy_time = _timed(legacy_clamp_normalized, expected, mask, region)
+        actual_count, vector_time = _timed(
+            clamp_and_blend, actual, mask, *SKIN_TONE_CLAMP_BOUNDS, region, 0.0, True
+        )
+        same = np.array_equal(expected, actual) and expected_count == actual_count
+        ok &= same
+        timings.setdefault("skin_tone_pct", []).append((legacy_time, vector_time))
+        if not same:
+            logger.error(f"❌ skin_tone_safe (проценты): расхождение (прогон {run_index + 1})")
+
+        # skin_tone_service: значения 0-255, все preset'ы
+        mask = _rect_mask(size, region)
+        for name, preset in SKIN_TONE_PRESETS.items():
+            expected = cmyk_uint8.astype(np.float32)
+            actual = expected.copy()
+            expected_count, legacy_time = _timed(legacy_clamp_preset, expected, mask, region, preset)
+            actual_count, vector_time = _timed(
+                clamp_and_blend, actual, mask, *preset_bounds(preset), region, 0.01
+            )
+            same = np.array_equal(expected, actual) and expected_count == actual_count
+            ok &= same
+            timings.setdefault(name, []).append((legacy_time, vector_time))
+            if not same:
+                logger.error(f"❌ {name}: расхождение (прогон {run_index + 1})")
+
+    logger.info(f"📊 Изображение {size}x{size}, {runs} прогона(ов):")
+    for name, values in timings.items():
+        legacy = sum(t for t, _ in values) / len(values)
+        vector = sum(t for _, t in values) / len(values)
+        logger.info(f"   {name:15s} циклы={legacy * 1000:9.1f}мс numpy={vector * 1000:7.1f}мс x{legacy / vector:.0f}")
+
+    if ok:
+        logger.info("✅ Результаты совпадают бит в бит для всех preset'ов")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Эквивалентность и бенчмарк векторизованного skin-tone clamp")
+    parser.add_argument("--size", type=int, default=1024, help="Сторона тестового изображения")
+    parser.add_argument("--runs", type=int, default=3, help="Количество случайных изображений")
+    parser.add_argument("--seed", type=int, default=0, help="Seed генератора")
+
+    args = parser.parse_args()
+
+    success = run(args.size, max(args.runs, 1), args.seed)
+    sys.exit(0 if success else 1)
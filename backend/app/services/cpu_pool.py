@@ -0,0 +1,104 @@
+"""
+Ограниченный пул потоков для CPU-тяжёлых операций (InsightFace: face swap и верификация лица,
+обработка изображений: название на обложке, заглушки).
+
+ONNX Runtime, OpenCV и Pillow отпускают GIL, поэтому такие операции в потоках пула выполняются
+параллельно и не блокируют event loop. Используются потоки, а не процессы: модели InsightFace
+загружаются один раз на процесс и разделяются потоками. Размер пула ограничивает нагрузку на CPU,
+когда несколько сцен генерируются одновременно и одновременно доходят до face swap.
+Метрики очереди (ожидающие/выполняемые задачи, время ожидания) — get_cpu_pool_stats().
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Количество потоков для CPU-работы (по умолчанию половина ядер, от 1 до 4)
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+_stats_lock = threading.Lock()
+_stats = {
+    "submitted": 0,
+    "queued": 0,
+    "running": 0,
+    "completed": 0,
+    "failed": 0,
+    "queue_wait_total": 0.0,
+    "queue_wait_max": 0.0,
+    "run_time_total": 0.0,
+}
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """Получить общий пул потоков для CPU-тяжёлых операций (ленивое создание)."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=CPU_POOL_WORKERS, thread_name_prefix="cpu-pool")
+        logger.info(f"✓ Пул потоков для CPU-операций создан: workers={CPU_POOL_WORKERS}")
+    return _executor
+
+
+def _run_measured(fn: Callable, submitted_at: float) -> Any:
+    started = time.monotonic()
+    waited = started - submitted_at
+    with _stats_lock:
+        _stats["queued"] -= 1
+        _stats["running"] += 1
+        _stats["queue_wait_total"] += waited
+        _stats["queue_wait_max"] = max(_stats["queue_wait_max"], waited)
+    ok = False
+    try:
+        result = fn()
+        ok = True
+        return result
+    finally:
+        with _stats_lock:
+            _stats["running"] -= 1
+            _stats["completed" if ok else "failed"] += 1
+            _stats["run_time_total"] += time.monotonic() - started
+
+
+async def run_cpu_bound(fn: Callable, *args, **kwargs) -> Any:
+    """Выполнить синхронную CPU-тяжёлую функцию в общем пуле, не блокируя event loop."""
+    loop = asyncio.get_running_loop()
+    with _stats_lock:
+        _stats["submitted"] += 1
+        _stats["queued"] += 1
+    future = loop.run_in_executor(
+        get_cpu_executor(), _run_measured, functools.partial(fn, *args, **kwargs), time.monotonic()
+    )
+    return await future
+
+
+def get_cpu_pool_stats() -> Dict[str, Any]:
+    """Метрики пула: глубина очереди, выполняемые задачи, время ожидания и выполнения."""
+    with _stats_lock:
+        finished = _stats["completed"] + _stats["failed"]
+        started = finished + _stats["running"]
+        return {
+            "workers": CPU_POOL_WORKERS,
+            "queued": _stats["queued"],
+            "running": _stats["running"],
+            "submitted": _stats["submitted"],
+            "completed": _stats["completed"],
+            "failed": _stats["failed"],
+            "queue_wait_avg_ms": round(_stats["queue_wait_total"] / started * 1000, 1) if started else 0.0,
+            "queue_wait_max_ms": round(_stats["queue_wait_max"] * 1000, 1),
+            "run_time_avg_ms": round(_stats["run_time_total"] / finished * 1000, 1) if finished else 0.0,
+        }
+
+
+def shutdown_cpu_executor():
+    """Остановить пул потоков (при завершении приложения)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,283 @@
+"""
+Кэш результатов детекции лиц InsightFace по содержимому изображения.
+
+Одно и то же сгенерированное изображение проходит через детекцию несколько раз: face swap ищет
+лица на нём, verify_face — на результате face swap, skin-tone коррекция — при сборке PDF.
+Результаты детекции (bbox, landmarks, det_score, embedding) сохраняются по SHA-256 байтов
+изображения: в памяти (LRU на FACE_DETECTION_CACHE_SIZE изображений) и на диске (JSON),
+чтобы рендер PDF в другом процессе мог взять bbox, найденные при генерации. Дисковые записи
+лежат в подкаталоге конфигурации моделей (face_model_config_id), поэтому смена FACE_MODEL_TIER
+или размера детекции не подмешивает результаты другой модели.
+
+Общий объём JSON-файлов в FACE_DETECTION_CACHE_DIR (вместе с исходными лицами source_face_cache)
+ограничен FACE_DETECTION_CACHE_MAX_MB: при превышении удаляются давно не использованные файлы.
+
+После face swap детектор не запускается повторно: положение лиц не меняется, поэтому для
+результата переносятся bbox/landmarks, а embedding считается по ним при верификации.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .image_cache import IMAGE_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+FACE_DETECTION_CACHE_SIZE = int(os.getenv("FACE_DETECTION_CACHE_SIZE", "256"))
+FACE_DETECTION_CACHE_DIR = os.getenv(
+    "FACE_DETECTION_CACHE_DIR",
+    os.path.join(os.path.dirname(IMAGE_CACHE_DIR.rstrip("/")), "faces")
+)
+FACE_DETECTION_CACHE_MAX_MB = int(os.getenv("FACE_DETECTION_CACHE_MAX_MB", "256"))
+
+_lock = threading.Lock()
+_memory: "OrderedDict[str, list]" = OrderedDict()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_config_dir_path: Optional[str] = None
+# путь к JSON-файлу -> размер; порядок — от давно использованных к недавно использованным
+_disk_index: Optional["OrderedDict[str, int]"] = None
+_disk_bytes = 0
+
+
+def image_key(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _array_key(img: np.ndarray) -> str:
+    digest = hashlib.sha256(str(img.shape).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    return "px-" + digest.hexdigest()
+
+
+def _config_dir() -> str:
+    global _config_dir_path
+    if _config_dir_path is None:
+        from .face_models import face_model_config_id
+        _config_dir_path = os.path.join(FACE_DETECTION_CACHE_DIR, face_model_config_id())
+    return _config_dir_path
+
+
+def _path_for(key: str) -> str:
+    return os.path.join(_config_dir(), key[:2], f"{key}.json")
+
+
+def _ensure_disk_index():
+    """Построить индекс по файлам на диске (один раз на процесс), порядок — по mtime."""
+    global _disk_index, _disk_bytes
+    if _disk_index is not None:
+        return
+    entries = []
+    if os.path.isdir(FACE_DETECTION_CACHE_DIR):
+        for root, _, files in os.walk(FACE_DETECTION_CACHE_DIR):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+    entries.sort()
+    with _lock:
+        if _disk_index is None:
+            _disk_index = OrderedDict((path, size) for _, path, size in entries)
+            _disk_bytes = sum(_disk_index.values())
+
+
+def touch_cache_file(path: str):
+    """Отметить использование файла кэша лиц (для LRU-вытеснения)."""
+    _ensure_disk_index()
+    with _lock:
+        if path in _disk_index:
+            _disk_index.move_to_end(path)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def write_cache_file(path: str, payload: Any) -> bool:
+    """
+    Записать JSON-файл кэша лиц (атомарно) и учесть его в общем лимите FACE_DETECTION_CACHE_MAX_MB.
+    Ошибки записи не прерывают обработку — возвращается False.
+    """
+    global _disk_bytes
+    _ensure_disk_index()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось сохранить кэш лиц на диск: {e}")
+        return False
+
+    limit = FACE_DETECTION_CACHE_MAX_MB * 1024 * 1024
+    evicted = []
+    with _lock:
+        _disk_bytes -= _disk_index.pop(path, 0)
+        _disk_index[path] = size
+        _disk_bytes += size
+        while _disk_bytes > limit and len(_disk_index) > 1:
+            old_path, old_size = _disk_index.popitem(last=False)
+            _disk_bytes -= old_size
+            _stats["evictions"] += 1
+            evicted.append(old_path)
+    for old_path in evicted:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+    return True
+
+
+def forget_cache_dir(directory: str):
+    """Убрать из индекса файлы каталога, удалённого целиком (сброс кэша исходных лиц ребёнка)."""
+    global _disk_bytes
+    prefix = os.path.join(directory, "")
+    with _lock:
+        if _disk_index is None:
+            return
+        for path in [path for path in _disk_index if path.startswith(prefix)]:
+            _disk_bytes -= _disk_index.pop(path)
+
+
+def face_to_record(face) -> Dict[str, Any]:
+    """Лицо InsightFace в JSON-совместимую запись (bbox, det_score, kps, embedding)."""
+    record = {
+        "bbox": np.asarray(face.bbox, dtype=np.float32).tolist(),
+        "det_score": float(face.det_score) if face.get("det_score") is not None else None,
+    }
+    if face.get("kps") is not None:
+        record["kps"] = np.asarray(face.kps, dtype=np.float32).tolist()
+    if face.get("embedding") is not None:
+        record["embedding"] = np.asarray(face.embedding, dtype=np.float32).tolist()
+    return record
+
+
+def face_from_record(record: Dict[str, Any]):
+    """Восстановить лицо InsightFace из записи face_to_record."""
+    from insightface.app.common import Face
+    face = Face(
+        bbox=np.array(record["bbox"], dtype=np.float32),
+        det_score=record.get("det_score"),
+    )
+    if record.get("kps") is not None:
+        face.kps = np.array(record["kps"], dtype=np.float32)
+    if record.get("embedding") is not None:
+        face.embedding = np.array(record["embedding"], dtype=np.float32)
+    return face
+
+
+def _remember(key: str, faces: list):
+    with _lock:
+        _memory[key] = faces
+        _memory.move_to_end(key)
+        while len(_memory) > FACE_DETECTION_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def get_cached_faces(key: str) -> Optional[list]:
+    """Лица из кэша (память, затем диск) или None, если изображение ещё не анализировалось."""
+    with _lock:
+        faces = _memory.get(key)
+        if faces is not None:
+            _memory.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return faces
+    path = _path_for(key)
+    try:
+        with open(path) as f:
+            faces = [face_from_record(record) for record in json.load(f)]
+    except (OSError, ValueError, KeyError):
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    touch_cache_file(path)
+    _remember(key, faces)
+    with _lock:
+        _stats["disk_hits"] += 1
+    return faces
+
+
+def store_faces(key: str, faces: list, persist: bool = True):
+    """Сохранить результат детекции (пустой список — «лиц нет» — тоже результат)."""
+    _remember(key, faces)
+    with _lock:
+        _stats["stores"] += 1
+    if not persist:
+        return
+    write_cache_file(_path_for(key), [face_to_record(face) for face in faces])
+
+
+def detect_faces(img_bgr: np.ndarray, image_bytes: Optional[bytes] = None, persist: bool = True) -> list:
+    """
+    Лица на изображении с использованием кэша.
+
+    image_bytes — исходные байты изображения (ключ кэша, общий для всех этапов); если не переданы,
+    ключом служат пиксели, и результат не сохраняется на диск.
+    """
+    key = image_key(image_bytes) if image_bytes is not None else _array_key(img_bgr)
+    faces = get_cached_faces(key)
+    if faces is not None:
+        return faces
+
+    from .face_models import analyze_faces
+    faces = analyze_faces(img_bgr)
+    store_faces(key, faces, persist=persist and image_bytes is not None)
+    return faces
+
+
+def carry_over_faces(faces: list) -> list:
+    """
+    Лица для изображения после face swap: положение (bbox, landmarks) то же, а embedding
+    изменился и пересчитывается по требованию (ensure_embedding) без повторного запуска детектора.
+    """
+    from insightface.app.common import Face
+    return [
+        Face(bbox=face.bbox, kps=face.kps, det_score=face.get("det_score"))
+        for face in faces
+        if face.get("kps") is not None
+    ]
+
+
+def ensure_embedding(img_bgr: np.ndarray, face) -> np.ndarray:
+    """
+    Embedding лица; если его нет (лицо перенесено после face swap), считается моделью распознавания
+    батчем вместе с параллельными запросами (face_inference_batcher).
+    """
+    if face.get("embedding") is None:
+        from .face_inference_batcher import embed_face
+        embed_face(img_bgr, face)
+    return face.embedding
+
+
+def alias_faces(source_bytes: bytes, target_bytes: bytes):
+    """
+    Перенести результат детекции на изображение, полученное преобразованием, которое не двигает лица
+    (например, название на обложке), чтобы последующие этапы не запускали детекцию заново.
+    """
+    faces = get_cached_faces(image_key(source_bytes))
+    if faces is not None:
+        store_faces(image_key(target_bytes), carry_over_faces(faces))
+
+
+def get_face_detection_cache_stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "memory_entries": len(_memory),
+            "max_entries": FACE_DETECTION_CACHE_SIZE,
+            "disk_files": len(_disk_index) if _disk_index is not None else None,
+            "disk_mb": round(_disk_bytes / 1024 / 1024, 1),
+            "max_mb": FACE_DETECTION_CACHE_MAX_MB,
+            **_stats,
+        }
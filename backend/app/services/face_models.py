@@ -0,0 +1,295 @@
+"""
+Общий реестр моделей InsightFace: один FaceAnalysis (детекция + embeddings) и модель inswapper
+на процесс для всех вызывающих (face_service, face_swap_service, skin_tone_service).
+
+Раньше в одном процессе могли быть загружены два анализатора (buffalo_l для face profile
+и buffalo_s для face swap). Теперь анализатор один — FACE_ANALYZER_MODEL (по умолчанию buffalo_l:
+embeddings профилей посчитаны этой моделью, и inswapper обучен на её embeddings).
+
+Модели можно прогреть при старте (warmup_face_models), чтобы первый запрос не ждал загрузку.
+
+Уровни производительности (FACE_MODEL_TIER) задают набор моделей, размер детекции, INT8-квантизацию
+ONNX и детекцию на уменьшенном изображении; отдельные параметры можно переопределить переменными
+окружения. Задержку и расхождение embeddings относительно quality измеряет
+app/scripts/benchmark_face_tiers.py.
+Потоки ONNX Runtime настраиваются через ONNX_INTRA_OP_THREADS / ONNX_INTER_OP_THREADS:
+по умолчанию ядра делятся между потоками cpu_pool, чтобы параллельные face swap
+не конкурировали за одни и те же ядра.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# quality — исходная конфигурация; balanced/fast экономят CPU ценой небольшого расхождения embeddings
+FACE_MODEL_TIERS: Dict[str, Dict[str, Any]] = {
+    "quality": {"model": "buffalo_l", "det_size": 640, "quantized": False, "detect_max_side": 0},
+    "balanced": {"model": "buffalo_l", "det_size": 480, "quantized": False, "detect_max_side": 1024},
+    "fast": {"model": "buffalo_l", "det_size": 320, "quantized": True, "detect_max_side": 640},
+}
+FACE_MODEL_TIER = os.getenv("FACE_MODEL_TIER", "quality").lower()
+if FACE_MODEL_TIER not in FACE_MODEL_TIERS:
+    logger.warning(f"⚠️ Неизвестный FACE_MODEL_TIER '{FACE_MODEL_TIER}', используем quality")
+    FACE_MODEL_TIER = "quality"
+_tier = FACE_MODEL_TIERS[FACE_MODEL_TIER]
+
+FACE_ANALYZER_MODEL = os.getenv("FACE_ANALYZER_MODEL", _tier["model"])
+FACE_DET_SIZE = int(os.getenv("FACE_DET_SIZE", str(_tier["det_size"])))
+FACE_MODEL_QUANTIZED = os.getenv("FACE_MODEL_QUANTIZED", str(_tier["quantized"])).lower() == "true"
+# Детекция на изображении, уменьшенном до этой стороны (bbox/landmarks масштабируются обратно); 0 — без уменьшения
+FACE_DETECT_MAX_SIDE = int(os.getenv("FACE_DETECT_MAX_SIDE", str(_tier["detect_max_side"])))
+FACE_MODELS_WARMUP = os.getenv("FACE_MODELS_WARMUP", "true").lower() == "true"
+
+
+def face_model_config_id() -> str:
+    """
+    Идентификатор конфигурации анализатора для дисковых кэшей лиц: bbox, landmarks и embeddings
+    зависят от модели, размера детекции, квантизации и уменьшения изображения перед детекцией.
+    """
+    quantized = "int8" if FACE_MODEL_QUANTIZED else "fp32"
+    return f"{FACE_ANALYZER_MODEL}-det{FACE_DET_SIZE}-{quantized}-max{FACE_DETECT_MAX_SIDE}"
+
+
+def _default_intra_op_threads() -> int:
+    from .cpu_pool import CPU_POOL_WORKERS
+    return max(1, (os.cpu_count() or 2) // max(CPU_POOL_WORKERS, 1))
+
+
+# 0 — оставить значение ONNX Runtime по умолчанию
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", str(_default_intra_op_threads())))
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS", "1"))
+
+_PROVIDERS = ["CPUExecutionProvider"]
+
+_lock = threading.Lock()
+_face_analyzer = None
+_face_swapper = None
+_swapper_failed = False
+# name -> {"onnx_bytes", "rss_delta_bytes", "load_seconds"}
+_model_info: Dict[str, Dict[str, Any]] = {}
+
+
+def _rss_bytes() -> Optional[int]:
+    """Resident memory процесса (Linux), None если недоступно."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _session_options():
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    if ONNX_INTRA_OP_THREADS > 0:
+        options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+    if ONNX_INTER_OP_THREADS > 0:
+        options.inter_op_num_threads = ONNX_INTER_OP_THREADS
+    return options
+
+
+def _quantized_model_file(model_file: str) -> str:
+    """
+    INT8-вариант ONNX-модели (динамическая квантизация весов), создаётся один раз. Лежит в подкаталоге
+    int8/: FaceAnalysis загружает все *.onnx из каталога набора моделей и подхватил бы его вместо FP32.
+    """
+    quantized_file = os.path.join(os.path.dirname(model_file), "int8", os.path.basename(model_file))
+    if not os.path.exists(quantized_file):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        os.makedirs(os.path.dirname(quantized_file), exist_ok=True)
+        tmp_file = f"{quantized_file}.{os.getpid()}.tmp.onnx"
+        logger.info(f"📦 Квантизация модели в INT8: {os.path.basename(model_file)}")
+        quantize_dynamic(model_file, tmp_file, weight_type=QuantType.QUInt8)
+        os.replace(tmp_file, quantized_file)
+    return quantized_file
+
+
+def _apply_session_options(model, quantized: bool = False) -> int:
+    """
+    insightface не передаёт SessionOptions в onnxruntime, поэтому сессии пересоздаются
+    с настроенным числом потоков (и из INT8-файлов, если quantized). Возвращает суммарный размер
+    ONNX-файлов модели.
+    """
+    import onnxruntime
+    options = _session_options() if (ONNX_INTRA_OP_THREADS > 0 or ONNX_INTER_OP_THREADS > 0) else None
+    onnx_bytes = 0
+    submodels = getattr(model, "models", None)
+    for taskname, submodel in (submodels.items() if submodels else [("model", model)]):
+        model_file = getattr(submodel, "model_file", None)
+        if not model_file or getattr(submodel, "session", None) is None:
+            continue
+        if quantized and taskname in ("detection", "recognition"):
+            try:
+                model_file = _quantized_model_file(model_file)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось квантизовать {os.path.basename(model_file)}, используем FP32: {e}")
+        try:
+            onnx_bytes += os.path.getsize(model_file)
+        except OSError:
+            pass
+        if options is not None or model_file != submodel.model_file:
+            submodel.session = onnxruntime.InferenceSession(model_file, sess_options=options, providers=_PROVIDERS)
+    return onnx_bytes
+
+
+def _record_load(name: str, model, rss_before: Optional[int], started: float, quantized: bool = False):
+    onnx_bytes = _apply_session_options(model, quantized=quantized)
+    rss_after = _rss_bytes()
+    _model_info[name] = {
+        "onnx_bytes": onnx_bytes,
+        "rss_delta_bytes": (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+        "load_seconds": round(time.monotonic() - started, 2),
+    }
+    onnx_mb = _model_info[name]["onnx_bytes"] / 1024 / 1024
+    logger.info(f"✓ Модель InsightFace {name} загружена ({onnx_mb:.0f} МБ ONNX, {_model_info[name]['load_seconds']}с)")
+
+
+def build_face_analyzer(config: Dict[str, Any]):
+    """Создать FaceAnalysis по конфигурации уровня (без регистрации в реестре — для бенчмарка)."""
+    import insightface
+    model = insightface.app.FaceAnalysis(name=config["model"], providers=_PROVIDERS)
+    model.prepare(ctx_id=0, det_size=(config["det_size"], config["det_size"]))
+    _apply_session_options(model, quantized=config["quantized"])
+    return model
+
+
+def get_face_analyzer():
+    """Общий FaceAnalysis (ленивая потокобезопасная загрузка)."""
+    global _face_analyzer
+    if _face_analyzer is not None:
+        return _face_analyzer
+    with _lock:
+        if _face_analyzer is None:
+            try:
+                import insightface
+                if FACE_ANALYZER_MODEL != "buffalo_l":
+                    logger.warning(
+                        f"⚠️ Анализатор {FACE_ANALYZER_MODEL}: embeddings несовместимы с face profile, "
+                        f"созданными на buffalo_l — профили нужно пересоздать"
+                    )
+                rss_before = _rss_bytes()
+                started = time.monotonic()
+                model = insightface.app.FaceAnalysis(name=FACE_ANALYZER_MODEL, providers=_PROVIDERS)
+                model.prepare(ctx_id=0, det_size=(FACE_DET_SIZE, FACE_DET_SIZE))
+                _record_load(FACE_ANALYZER_MODEL, model, rss_before, started, quantized=FACE_MODEL_QUANTIZED)
+                _face_analyzer = model
+            except Exception as e:
+                logger.error(f"❌ Ошибка при загрузке модели InsightFace: {str(e)}")
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Не удалось загрузить модель InsightFace: {str(e)}"
+                )
+    return _face_analyzer
+
+
+def analyze_faces(img_bgr, analyzer=None, detect_max_side: Optional[int] = None) -> list:
+    """
+    Детекция и анализ лиц (аналог FaceAnalysis.get).
+
+    Если сторона изображения больше detect_max_side (по умолчанию FACE_DETECT_MAX_SIDE), детектор
+    работает на уменьшенной копии, bbox и landmarks масштабируются обратно, а embeddings
+    и остальные модели считаются по исходному изображению.
+    """
+    analyzer = analyzer or get_face_analyzer()
+    max_side = FACE_DETECT_MAX_SIDE if detect_max_side is None else detect_max_side
+    h, w = img_bgr.shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return analyzer.get(img_bgr)
+
+    import cv2
+    from insightface.app.common import Face
+    scale = max_side / max(h, w)
+    small = cv2.resize(img_bgr, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    bboxes, kpss = analyzer.det_model.detect(small, max_num=0, metric="default")
+    faces = []
+    for i in range(bboxes.shape[0]):
+        face = Face(
+            bbox=bboxes[i, 0:4] / scale,
+            kps=kpss[i] / scale if kpss is not None else None,
+            det_score=bboxes[i, 4],
+        )
+        for taskname, model in analyzer.models.items():
+            if taskname != "detection":
+                model.get(img_bgr, face)
+        faces.append(face)
+    return faces
+
+
+def get_face_swapper():
+    """Общая модель inswapper_128; None, если загрузить не удалось (face swap пропускается)."""
+    global _face_swapper, _swapper_failed
+    if _face_swapper is not None or _swapper_failed:
+        return _face_swapper
+    with _lock:
+        if _face_swapper is None and not _swapper_failed:
+            try:
+                import insightface
+                rss_before = _rss_bytes()
+                started = time.monotonic()
+                model_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'models')
+                os.makedirs(model_dir, exist_ok=True)
+                model_path = os.path.join(model_dir, 'inswapper_128.onnx')
+
+                # Если модель уже есть, используем её, иначе скачиваем
+                if os.path.exists(model_path):
+                    logger.info(f"✓ Используем существующую модель: {model_path}")
+                    model = insightface.model_zoo.get_model(model_path, providers=_PROVIDERS)
+                else:
+                    logger.info("📥 Загрузка модели FaceSwapper...")
+                    model = insightface.model_zoo.get_model(
+                        'inswapper_128.onnx', download=True, download_zip=True, root=model_dir, providers=_PROVIDERS
+                    )
+                _record_load("inswapper_128", model, rss_before, started)
+                _face_swapper = model
+            except Exception as e:
+                # Не повторяем загрузку на каждом изображении
+                _swapper_failed = True
+                logger.warning(f"⚠️ Не удалось загрузить FaceSwapper, face swap будет пропущен: {type(e).__name__}: {str(e)}")
+    return _face_swapper
+
+
+def warmup_face_models(include_swapper: bool = True):
+    """
+    Загрузить модели и выполнить пробный проход детекции, чтобы первый запрос
+    не тратил время на загрузку и инициализацию сессий ONNX Runtime.
+    """
+    try:
+        import numpy as np
+        started = time.monotonic()
+        analyzer = get_face_analyzer()
+        analyzer.get(np.zeros((FACE_DET_SIZE, FACE_DET_SIZE, 3), dtype=np.uint8))
+        if include_swapper:
+            get_face_swapper()
+        logger.info(f"✓ Модели InsightFace прогреты за {time.monotonic() - started:.1f}с")
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прогреть модели InsightFace: {e}")
+
+
+def get_face_model_stats() -> Dict[str, Any]:
+    """Загруженные модели и их объём (размер ONNX-файлов и прирост RSS при загрузке)."""
+    return {
+        "tier": FACE_MODEL_TIER,
+        "analyzer_model": FACE_ANALYZER_MODEL,
+        "det_size": FACE_DET_SIZE,
+        "quantized": FACE_MODEL_QUANTIZED,
+        "detect_max_side": FACE_DETECT_MAX_SIDE,
+        "config_id": face_model_config_id(),
+        "onnx_intra_op_threads": ONNX_INTRA_OP_THREADS,
+        "onnx_inter_op_threads": ONNX_INTER_OP_THREADS,
+        "analyzer_loaded": _face_analyzer is not None,
+        "swapper_loaded": _face_swapper is not None,
+        "models": {
+            name: {
+                "onnx_mb": round(info["onnx_bytes"] / 1024 / 1024, 1),
+                "rss_delta_mb": round(info["rss_delta_bytes"] / 1024 / 1024, 1) if info["rss_delta_bytes"] is not None else None,
+                "load_seconds": info["load_seconds"],
+            }
+            for name, info in _model_info.items()
+        },
+        "process_rss_mb": round(_rss_bytes() / 1024 / 1024, 1) if _rss_bytes() is not None else None,
+    }
@@ -2,40 +2,55 @@
 Сервис для создания и верификации face profile ребёнка.
 Использует InsightFace для извлечения embeddings и создания reference изображения.
 """
+import asyncio
 import logging
 import os
-from typing import List, Tuple, Optional
+from typing import Callable, List, Tuple, Optional
 import cv2
 import numpy as np
 from PIL import Image
-import insightface
 from fastapi import HTTPException
 
 from .storage import BASE_UPLOAD_DIR, get_server_base_url
 
 logger = logging.getLogger(__name__)
 
-# Глобальная переменная для модели (singleton)
-_face_analyzer = None
-
 
 def _get_face_analyzer():
-    """Получить или создать экземпляр FaceAnalyzer (singleton)."""
-    global _face_analyzer
-    if _face_analyzer is None:
-        try:
-            # Используем buffalo_l для лучшего качества (как указано в требованиях)
-            model = insightface.app.FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-            model.prepare(ctx_id=0, det_size=(640, 640))
-            _face_analyzer = model
-            logger.info("✓ Модель InsightFace FaceAnalysis (buffalo_l) загружена для face profile")
-        except Exception as e:
-            logger.error(f"❌ Ошибка при загрузке модели InsightFace: {str(e)}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Не удалось загрузить модель InsightFace: {str(e)}"
-            )
-    return _face_analyzer
+    """Получить общий экземпляр FaceAnalysis из реестра моделей (face_models)."""
+    from .face_models import get_face_analyzer
+    return get_face_analyzer()
+
+
+def _resolve_upload_path(path: str) -> str:
+    """Локальный путь к файлу по пути или URL (/static/... или /uploads/...)."""
+    if "/static/" in path or "/uploads/" in path:
+        # Формат: /static/children/{child_id}/filename.jpg или /uploads/...
+        relative_path = path.split("/static/", 1)[-1] if "/static/" in path else path.split("/uploads/", 1)[-1]
+        return os.path.join(BASE_UPLOAD_DIR, relative_path)
+    return path
+
+
+def _load_image(path: str) -> Optional[np.ndarray]:
+    """Загрузить одно изображение (BGR) или None, если файл не найден или не читается."""
+    try:
+        local_path = _resolve_upload_path(path)
+        
+        if not os.path.exists(local_path):
+            logger.warning(f"⚠️ Файл не найден: {local_path}")
+            return None
+        
+        # Загружаем изображение
+        img = cv2.imread(local_path)
+        if img is None:
+            logger.warning(f"⚠️ Не удалось загрузить изображение: {local_path}")
+            return None
+        
+        logger.debug(f"✓ Загружено изображение: {local_path}, размер: {img.shape}")
+        return img
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка при загрузке {path}: {e}")
+        return None
 
 
 def load_images_from_uploads(paths: List[str]) -> List[np.ndarray]:
@@ -51,32 +66,7 @@ def load_images_from_uploads(paths: List[str]) -> List[np.ndarray]:
     Raises:
         HTTPException: Если не удалось загрузить изображения
     """
-    images = []
-    for path in paths:
-        try:
-            # Если это URL, извлекаем локальный путь
-            if "/static/" in path or "/uploads/" in path:
-                # Формат: /static/children/{child_id}/filename.jpg или /uploads/...
-                relative_path = path.split("/static/", 1)[-1] if "/static/" in path else path.split("/uploads/", 1)[-1]
-                local_path = os.path.join(BASE_UPLOAD_DIR, relative_path)
-            else:
-                local_path = path
-            
-            if not os.path.exists(local_path):
-                logger.warning(f"⚠️ Файл не найден: {local_path}")
-                continue
-            
-            # Загружаем изображение
-            img = cv2.imread(local_path)
-            if img is None:
-                logger.warning(f"⚠️ Не удалось загрузить изображение: {local_path}")
-                continue
-            
-            images.append(img)
-            logger.debug(f"✓ Загружено изображение: {local_path}, размер: {img.shape}")
-        except Exception as e:
-            logger.warning(f"⚠️ Ошибка при загрузке {path}: {e}")
-            continue
+    images = [img for img in (_load_image(path) for path in paths) if img is not None]
     
     if not images:
         raise HTTPException(
@@ -87,12 +77,13 @@ def load_images_from_uploads(paths: List[str]) -> List[np.ndarray]:
     return images
 
 
-def detect_best_face(img: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
+def detect_best_face(img: np.ndarray, image_bytes: Optional[bytes] = None) -> Tuple[np.ndarray, np.ndarray, float]:
     """
     Обнаружить лучшее лицо на изображении.
     
     Args:
         img: Изображение в формате BGR
+        image_bytes: Исходные байты изображения — ключ кэша детекции (face_detection_cache)
     
     Returns:
         Tuple[embedding, face_crop, det_score]:
@@ -103,10 +94,10 @@ def detect_best_face(img: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
     Raises:
         HTTPException: Если лицо не найдено
     """
-    analyzer = _get_face_analyzer()
+    from .face_detection_cache import detect_faces, ensure_embedding
     
-    # Детекция лиц
-    faces = analyzer.get(img)
+    # Детекция лиц (результат для этих байтов мог быть получен на предыдущем этапе)
+    faces = detect_faces(img, image_bytes=image_bytes)
     
     if not faces or len(faces) == 0:
         raise HTTPException(
@@ -117,7 +108,7 @@ def detect_best_face(img: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
     # Выбираем лицо с максимальной площадью bbox или максимальным det_score
     best_face = max(faces, key=lambda f: f.bbox[2] * f.bbox[3] if len(f.bbox) >= 4 else f.det_score)
     
-    embedding = best_face.embedding.astype(np.float32)
+    embedding = ensure_embedding(img, best_face).astype(np.float32)
     det_score = best_face.det_score
     
     # Обрезаем лицо
@@ -139,55 +130,35 @@ def detect_best_face(img: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
     return embedding, face_crop, det_score
 
 
-def build_face_profile(image_paths: List[str], child_id: int) -> dict:
+def _analyze_image(img: np.ndarray, index: int) -> Optional[Tuple[np.ndarray, np.ndarray, float]]:
+    """Лучшее лицо на фото для face profile или None, если лицо не найдено."""
+    try:
+        embedding, face_crop, det_score = detect_best_face(img)
+        logger.debug(f"✓ Лицо {index + 1}: embedding shape={embedding.shape}, score={det_score:.3f}")
+        return embedding, face_crop, det_score
+    except HTTPException as e:
+        logger.warning(f"⚠️ Пропущено изображение {index + 1}: {e.detail}")
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка при обработке изображения {index + 1}: {e}")
+    return None
+
+
+def _load_and_analyze(path: str, index: int) -> Tuple[int, bool, Optional[Tuple[np.ndarray, np.ndarray, float]]]:
+    """Декодирование и анализ одного фото (для пула потоков): (индекс, загружено ли, результат анализа)."""
+    img = _load_image(path)
+    if img is None:
+        return index, False, None
+    return index, True, _analyze_image(img, index)
+
+
+def _aggregate_faces(results: List[Tuple[np.ndarray, np.ndarray, float]]) -> Tuple[bytes, np.ndarray]:
     """
-    Создать face profile из нескольких фотографий ребёнка.
-    
-    Args:
-        image_paths: Список путей к фотографиям
-        child_id: ID ребёнка
-    
-    Returns:
-        dict с ключами:
-            - mean_embedding_bytes: bytes (сериализованный numpy array)
-            - reference_rel_path: str (относительный путь к reference.png)
-            - reference_public_url: str (публичный URL)
-            - valid_faces: int (количество валидных лиц)
-            - used_faces: int (количество использованных лиц)
+    Усреднить embeddings и выбрать лицо для reference (максимальный det_score).
     
     Raises:
-        HTTPException: Если недостаточно валидных лиц (минимум 3 из 5)
+        HTTPException: Если недостаточно валидных лиц (минимум 3)
     """
-    logger.info(f"🔄 Создание face profile для child_id={child_id} из {len(image_paths)} фотографий")
-    
-    # Загружаем изображения
-    images = load_images_from_uploads(image_paths)
-    logger.info(f"✓ Загружено {len(images)} изображений")
-    
-    # Извлекаем embeddings и выбираем лучшее лицо
-    embeddings = []
-    best_face_crop = None
-    best_score = 0.0
-    
-    valid_faces = 0
-    for i, img in enumerate(images):
-        try:
-            embedding, face_crop, det_score = detect_best_face(img)
-            embeddings.append(embedding)
-            valid_faces += 1
-            
-            # Выбираем лучшее лицо для reference (максимальный det_score)
-            if det_score > best_score:
-                best_score = det_score
-                best_face_crop = face_crop
-            
-            logger.debug(f"✓ Лицо {i+1}: embedding shape={embedding.shape}, score={det_score:.3f}")
-        except HTTPException as e:
-            logger.warning(f"⚠️ Пропущено изображение {i+1}: {e.detail}")
-            continue
-        except Exception as e:
-            logger.warning(f"⚠️ Ошибка при обработке изображения {i+1}: {e}")
-            continue
+    valid_faces = len(results)
     
     # Проверяем минимальное количество валидных лиц
     MIN_VALID_FACES = 3
@@ -197,20 +168,24 @@ def build_face_profile(image_paths: List[str], child_id: int) -> dict:
             detail=f"Недостаточно валидных лиц: найдено {valid_faces}, требуется минимум {MIN_VALID_FACES}"
         )
     
-    # Усредняем embeddings
-    if len(embeddings) == 0:
-        raise HTTPException(status_code=400, detail="Не удалось извлечь ни одного embedding")
-    
+    embeddings = [embedding for embedding, _, _ in results]
     mean_embedding = np.mean(embeddings, axis=0).astype(np.float32)
     logger.info(f"✓ Усреднено {len(embeddings)} embeddings, финальный shape={mean_embedding.shape}")
     
-    # Сохраняем embedding как bytes
-    mean_embedding_bytes = mean_embedding.tobytes()
+    # Первое лицо с максимальным det_score
+    best_face_crop = max(results, key=lambda result: result[2])[1]
     
-    # Создаём reference изображение 512x512
-    if best_face_crop is None:
-        raise HTTPException(status_code=400, detail="Не удалось получить reference изображение")
+    # Сохраняем embedding как bytes
+    return mean_embedding.tobytes(), best_face_crop
+
+
+def _save_reference_image(best_face_crop: np.ndarray, child_id: int) -> Tuple[str, str]:
+    """
+    Создать reference изображение 512x512 и сохранить в faces/{child_id}/reference.png.
     
+    Returns:
+        Tuple[reference_rel_path, reference_public_url]
+    """
     # Конвертируем BGR в RGB для PIL
     face_rgb = cv2.cvtColor(best_face_crop, cv2.COLOR_BGR2RGB)
     face_pil = Image.fromarray(face_rgb)
@@ -237,14 +212,105 @@ def build_face_profile(image_paths: List[str], child_id: int) -> dict:
     base_url = get_server_base_url()
     if ":8000" in base_url:
         base_url = base_url.replace(":8000", "")
-    reference_public_url = f"{base_url}/static/{reference_rel_path}"
+    return reference_rel_path, f"{base_url}/static/{reference_rel_path}"
+
+
+def build_face_profile(image_paths: List[str], child_id: int) -> dict:
+    """
+    Создать face profile из нескольких фотографий ребёнка.
+    
+    Args:
+        image_paths: Список путей к фотографиям
+        child_id: ID ребёнка
+    
+    Returns:
+        dict с ключами:
+            - mean_embedding_bytes: bytes (сериализованный numpy array)
+            - reference_rel_path: str (относительный путь к reference.png)
+            - reference_public_url: str (публичный URL)
+            - valid_faces: int (количество валидных лиц)
+            - used_faces: int (количество использованных лиц)
+    
+    Raises:
+        HTTPException: Если недостаточно валидных лиц (минимум 3 из 5)
+    """
+    logger.info(f"🔄 Создание face profile для child_id={child_id} из {len(image_paths)} фотографий")
+    
+    # Загружаем изображения
+    images = load_images_from_uploads(image_paths)
+    logger.info(f"✓ Загружено {len(images)} изображений")
+    
+    # Извлекаем embeddings и выбираем лучшее лицо
+    results = [result for result in (_analyze_image(img, i) for i, img in enumerate(images)) if result is not None]
+    mean_embedding_bytes, best_face_crop = _aggregate_faces(results)
+    reference_rel_path, reference_public_url = _save_reference_image(best_face_crop, child_id)
+    
+    return {
+        "mean_embedding_bytes": mean_embedding_bytes,
+        "reference_rel_path": reference_rel_path,
+        "reference_public_url": reference_public_url,
+        "valid_faces": len(results),
+        "used_faces": len(results)
+    }
+
+
+async def build_face_profile_async(
+    image_paths: List[str],
+    child_id: int,
+    on_progress: Optional[Callable[[int, int], None]] = None
+) -> dict:
+    """
+    Асинхронная версия build_face_profile: фото декодируются и анализируются параллельно
+    в пуле потоков для CPU-операций, reference.png сохраняется там же, не блокируя event loop.
+    
+    Args:
+        image_paths: Список путей к фотографиям
+        child_id: ID ребёнка
+        on_progress: Вызывается после обработки каждого фото: (обработано, всего)
+    
+    Returns:
+        dict того же формата, что build_face_profile
+    """
+    from .cpu_pool import run_cpu_bound
+    
+    logger.info(f"🔄 Создание face profile для child_id={child_id} из {len(image_paths)} фотографий (параллельно)")
+    
+    pending = [
+        asyncio.ensure_future(run_cpu_bound(_load_and_analyze, path, i))
+        for i, path in enumerate(image_paths)
+    ]
+    loaded = 0
+    results = []
+    try:
+        for done, future in enumerate(asyncio.as_completed(pending), 1):
+            index, is_loaded, result = await future
+            loaded += int(is_loaded)
+            if result is not None:
+                results.append((index, result))
+            if on_progress:
+                on_progress(done, len(image_paths))
+    finally:
+        for future in pending:
+            future.cancel()
+    
+    if not loaded:
+        raise HTTPException(
+            status_code=400,
+            detail="Не удалось загрузить ни одного изображения"
+        )
+    logger.info(f"✓ Загружено {loaded} изображений")
+    
+    # Порядок фото как в запросе — reference выбирается так же, как в build_face_profile
+    results = [result for _, result in sorted(results, key=lambda item: item[0])]
+    mean_embedding_bytes, best_face_crop = _aggregate_faces(results)
+    reference_rel_path, reference_public_url = await run_cpu_bound(_save_reference_image, best_face_crop, child_id)
     
     return {
         "mean_embedding_bytes": mean_embedding_bytes,
         "reference_rel_path": reference_rel_path,
         "reference_public_url": reference_public_url,
-        "valid_faces": valid_faces,
-        "used_faces": len(embeddings)
+        "valid_faces": len(results),
+        "used_faces": len(results)
     }
 
 
@@ -297,7 +363,7 @@ def verify_face(mean_embedding_bytes: bytes, generated_img_bytes: bytes, thresho
         
         # Извлекаем embedding из сгенерированного изображения
         try:
-            generated_embedding, _, _ = detect_best_face(img)
+            generated_embedding, _, _ = detect_best_face(img, image_bytes=generated_img_bytes)
         except HTTPException:
             logger.warning("⚠️ Лицо не обнаружено на сгенерированном изображении")
             return False, 0.0
@@ -14,6 +14,7 @@ import json
 from typing import Optional, Any
 
 import httpx
+from .http_clients import http_client
 from fastapi import HTTPException
 
 
@@ -210,9 +211,9 @@ async def generate_text(
         payload["generationConfig"]["responseMimeType"] = "application/json"
 
     timeout = httpx.Timeout(180.0, connect=10.0, read=180.0, write=10.0, pool=10.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
+    async with http_client("gemini") as client:
         try:
-            resp = await client.post(url, params=params, json=payload)
+            resp = await client.post(url, params=params, json=payload, timeout=timeout)
         except httpx.TimeoutException:
             raise HTTPException(status_code=504, detail="Таймаут при вызове Gemini API")
         except httpx.RequestError as e:
@@ -0,0 +1,108 @@
+"""
+Общие HTTP-клиенты для внешних сервисов (Pollinations.ai, fal.ai, Gemini, Telegram).
+
+Вместо нового httpx.AsyncClient на каждый запрос (новое TCP/TLS-соединение на каждый вызов
+и каждую повторную попытку) используется реестр именованных клиентов с пулом соединений,
+keep-alive и HTTP/2 (если установлен пакет h2). Клиенты создаются при старте приложения
+(или лениво при первом обращении) и закрываются при остановке.
+"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Лимиты пула соединений (на каждый именованный клиент)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+# Настройки клиентов по сервисам; таймаут клиента используется, если запрос не передал свой
+CLIENT_SETTINGS = {
+    "pollinations": {"timeout": httpx.Timeout(300.0, connect=10.0, read=300.0), "follow_redirects": True},
+    "fal": {"timeout": httpx.Timeout(300.0, connect=10.0, read=300.0), "follow_redirects": True},
+    "gemini": {"timeout": httpx.Timeout(180.0, connect=10.0, read=180.0, write=10.0, pool=10.0)},
+    "telegram": {"timeout": httpx.Timeout(30.0, connect=10.0)},
+    "default": {"timeout": httpx.Timeout(30.0, connect=10.0)},
+}
+
+# Клиент привязан к event loop, в котором создан: (клиент, loop)
+_clients: Dict[str, Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]] = {}
+
+
+def _http2_supported() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    settings = CLIENT_SETTINGS.get(name, CLIENT_SETTINGS["default"])
+    http2 = _http2_supported()
+    client = httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        **settings,
+    )
+    logger.info(f"✓ HTTP-клиент '{name}' создан (http2={http2}, max_connections={HTTP_MAX_CONNECTIONS})")
+    return client
+
+
+def get_http_client(name: str = "default") -> httpx.AsyncClient:
+    """
+    Получить общий HTTP-клиент сервиса.
+
+    Клиент нельзя закрывать после запроса — он переиспользуется всеми вызовами в процессе.
+    Если клиент был создан в другом event loop (например, в скрипте с несколькими asyncio.run),
+    создаётся новый.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(name)
+    if entry is not None:
+        client, client_loop = entry
+        if not client.is_closed and client_loop is loop:
+            return client
+    client = _create_client(name)
+    _clients[name] = (client, loop)
+    return client
+
+
+@asynccontextmanager
+async def http_client(name: str = "default"):
+    """
+    Контекстный менеджер для замены `async with httpx.AsyncClient() as client`:
+    отдаёт общий клиент и НЕ закрывает его по выходу из блока.
+    """
+    yield get_http_client(name)
+
+
+async def open_http_clients(names: Optional[Tuple[str, ...]] = None):
+    """Создать клиенты заранее (при старте приложения)."""
+    for name in names or tuple(CLIENT_SETTINGS):
+        get_http_client(name)
+
+
+async def close_http_clients():
+    """Закрыть все клиенты (при остановке приложения)."""
+    entries = list(_clients.items())
+    _clients.clear()
+    for name, (client, _) in entries:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка при закрытии HTTP-клиента '{name}': {e}")
+    if entries:
+        logger.info(f"✓ HTTP-клиенты закрыты: {[name for name, _ in entries]}")
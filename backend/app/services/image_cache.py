@@ -0,0 +1,195 @@
+"""
+Дисковый кэш сгенерированных изображений (prompt → image).
+
+Ключ — SHA-256 от нормализованных параметров запроса к провайдеру (провайдер, модель, размер,
+промпт, seed, reference-изображение, strength). Повторные запросы с теми же параметрами
+(повторы после ошибок, continue_generation, скрипты перегенерации, smoke-тесты) отдаются
+с диска без обращения к Pollinations.ai. Чтобы ключ повторялся, при использовании кэша
+seed вычисляется из параметров запроса (deterministic_seed), а не выбирается случайно.
+
+Размер кэша ограничен IMAGE_CACHE_MAX_MB, при превышении удаляются давно не использованные
+файлы (LRU). Для «нового варианта» (перегенерация сцены пользователем) вызывающий код
+передаёт use_cache=False: кэш не читается и не пополняется, seed остаётся случайным.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .local_file_service import BASE_UPLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+# По умолчанию кэш лежит рядом с uploads, но не внутри (uploads раздаётся как /static)
+IMAGE_CACHE_DIR = os.getenv(
+    "IMAGE_CACHE_DIR",
+    os.path.join(os.path.dirname(BASE_UPLOAD_DIR.rstrip("/")), "cache", "images")
+)
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "2048"))
+
+_lock = threading.Lock()
+# key -> размер файла; порядок — от давно использованных к недавно использованным
+_index: Optional["OrderedDict[str, int]"] = None
+_total_bytes = 0
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Нормализация промпта для ключа: пробелы схлопываются, края обрезаются."""
+    return " ".join((prompt or "").split())
+
+
+def make_cache_key(**params: Any) -> str:
+    """Ключ кэша — SHA-256 от параметров запроса (порядок аргументов не важен)."""
+    raw = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def deterministic_seed(key: str, attempt: int = 0) -> int:
+    """
+    Seed из ключа — в том же диапазоне, что и случайные seed (1..1000000).
+    attempt > 0 даёт другой, но тоже воспроизводимый seed для повторной попытки.
+    """
+    if attempt:
+        key = hashlib.sha256(f"{key}:{attempt}".encode("utf-8")).hexdigest()
+    return int(key[:12], 16) % 1000000 + 1
+
+
+def is_cache_enabled(use_cache: bool = True) -> bool:
+    return IMAGE_CACHE_ENABLED and use_cache
+
+
+def _path_for(key: str) -> str:
+    return os.path.join(IMAGE_CACHE_DIR, key[:2], f"{key}.img")
+
+
+def _load_index() -> "OrderedDict[str, int]":
+    """
+    Построить индекс по файлам на диске (один раз на процесс), порядок — по mtime.
+    Обход каталога выполняется без _lock, под блокировкой индекс только присваивается.
+    """
+    global _index, _total_bytes
+    if _index is not None:
+        return _index
+    entries = []
+    if os.path.isdir(IMAGE_CACHE_DIR):
+        for root, _, files in os.walk(IMAGE_CACHE_DIR):
+            for name in files:
+                if not name.endswith(".img"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name[:-4], st.st_size))
+    entries.sort()
+    with _lock:
+        if _index is None:
+            _index = OrderedDict((key, size) for _, key, size in entries)
+            _total_bytes = sum(_index.values())
+            if _index:
+                logger.info(f"✓ Кэш изображений: {len(_index)} файлов, {_total_bytes / 1024 / 1024:.1f} МБ")
+    return _index
+
+
+def _evict_locked(index: "OrderedDict[str, int]") -> List[str]:
+    """Убрать из индекса давно не использованные ключи сверх лимита; файлы удаляет вызывающий вне _lock."""
+    global _total_bytes
+    limit = IMAGE_CACHE_MAX_MB * 1024 * 1024
+    evicted = []
+    while _total_bytes > limit and index:
+        key, size = index.popitem(last=False)
+        _total_bytes -= size
+        _stats["evictions"] += 1
+        evicted.append(key)
+    return evicted
+
+
+def _get_sync(key: str) -> Optional[bytes]:
+    global _total_bytes
+    path = _path_for(key)
+    index = _load_index()
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+    except OSError:
+        # Файл мог удалить другой процесс, использующий тот же каталог
+        with _lock:
+            size = index.pop(key, None)
+            if size:
+                _total_bytes -= size
+            _stats["misses"] += 1
+        return None
+    with _lock:
+        if key not in index:
+            index[key] = len(data)
+            _total_bytes += len(data)
+        index.move_to_end(key)
+        _stats["hits"] += 1
+    return data
+
+
+def _put_sync(key: str, data: bytes):
+    global _total_bytes
+    path = _path_for(key)
+    index = _load_index()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    with _lock:
+        _total_bytes -= index.pop(key, 0)
+        index[key] = len(data)
+        _total_bytes += len(data)
+        _stats["stores"] += 1
+        evicted = _evict_locked(index)
+    for evicted_key in evicted:
+        try:
+            os.remove(_path_for(evicted_key))
+        except OSError:
+            pass
+
+
+async def get_cached_image(key: str) -> Optional[bytes]:
+    """Вернуть изображение из кэша или None."""
+    try:
+        data = await asyncio.to_thread(_get_sync, key)
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка чтения кэша изображений: {e}")
+        return None
+    if data:
+        logger.info(f"♻️ Изображение взято из кэша (key={key[:12]}, {len(data)} байт)")
+    return data
+
+
+async def store_cached_image(key: str, data: bytes):
+    """Сохранить изображение в кэш (ошибки кэша не прерывают генерацию)."""
+    if not data:
+        return
+    try:
+        await asyncio.to_thread(_put_sync, key, data)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось сохранить изображение в кэш: {e}")
+
+
+def get_image_cache_stats() -> Dict[str, Any]:
+    """Метрики кэша: попадания/промахи, размер и количество файлов."""
+    with _lock:
+        files = len(_index) if _index is not None else None
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "enabled": IMAGE_CACHE_ENABLED,
+            "dir": IMAGE_CACHE_DIR,
+            "max_mb": IMAGE_CACHE_MAX_MB,
+            "size_mb": round(_total_bytes / 1024 / 1024, 1),
+            "files": files,
+            "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+            **_stats,
+        }
@@ -3,28 +3,83 @@
 Обеспечивает единый интерфейс для генерации черновых и финальных изображений.
 Использует Pollinations.ai через pollinations_service.
 """
+import asyncio
 import logging
 import os
 import uuid
 from fastapi import HTTPException
-from typing import Optional, List
+from typing import Optional, List, Tuple, Any, Callable
 
-# ЗАКОММЕНТИРОВАНО - перешли на Pollinations.ai
-# from .fal_service import generate_raw_image
-from .pollinations_service import generate_raw_image
+# Провайдер (Pollinations.ai / fal.ai / заглушка) выбирается по IMAGE_PROVIDERS с автоматическим переключением
+from .image_providers import generate_raw_image
 from .local_file_service import BASE_UPLOAD_DIR
 from .storage import get_server_base_url
 
 logger = logging.getLogger(__name__)
 
+# Лимиты параллельной генерации изображений:
+# IMAGE_BOOK_CONCURRENCY — одновременных сцен одной книги, IMAGE_GLOBAL_CONCURRENCY — всех запросов процесса
+IMAGE_BOOK_CONCURRENCY = int(os.getenv("IMAGE_BOOK_CONCURRENCY", "4"))
+IMAGE_GLOBAL_CONCURRENCY = int(os.getenv("IMAGE_GLOBAL_CONCURRENCY", "8"))
 
-async def generate_draft_image(prompt: str, style: str = "storybook") -> str:
+_global_image_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def get_global_image_semaphore() -> asyncio.Semaphore:
+    """Общий для процесса семафор запросов генерации изображений (создаётся лениво в работающем event loop)."""
+    global _global_image_semaphore
+    if _global_image_semaphore is None:
+        _global_image_semaphore = asyncio.Semaphore(max(1, IMAGE_GLOBAL_CONCURRENCY))
+    return _global_image_semaphore
+
+
+async def generate_draft_images_bounded(
+    jobs: List[Tuple[Any, str]],
+    style: str,
+    on_result: Callable[[Any, str], None],
+    concurrency: Optional[int] = None
+) -> None:
+    """
+    Параллельно генерирует черновые изображения для нескольких сцен.
+    
+    Одновременно выполняется не больше concurrency (по умолчанию IMAGE_BOOK_CONCURRENCY) запросов
+    для этого вызова и не больше IMAGE_GLOBAL_CONCURRENCY для всего процесса.
+    on_result(key, url) вызывается по мере готовности каждого изображения — в нём результат
+    сохраняется в БД, поэтому уже готовые сцены не теряются при ошибке в другой.
+    При ошибке одной сцены остальные запросы отменяются, исключение пробрасывается.
+    
+    Args:
+        jobs: Список (ключ, промпт), ключ передаётся в on_result (например, order сцены)
+        style: Стиль изображения
+        on_result: Синхронный обработчик готового изображения
+        concurrency: Лимит одновременных запросов для этого вызова
+    """
+    book_semaphore = asyncio.Semaphore(max(1, concurrency or IMAGE_BOOK_CONCURRENCY))
+    
+    async def run(key: Any, prompt: str) -> Tuple[Any, str]:
+        async with book_semaphore:
+            return key, await generate_draft_image(prompt, style=style)
+    
+    tasks = [asyncio.create_task(run(key, prompt)) for key, prompt in jobs]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, image_url = await next_done
+            on_result(key, image_url)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def generate_draft_image(prompt: str, style: str = "storybook", use_cache: bool = True) -> str:
     """
     Генерирует черновое изображение через Pollinations.ai API и сохраняет его локально.
     
     Args:
         prompt: Промпт для генерации изображения (уже должен содержать стиль)
         style: Стиль изображения (используется для логирования)
+        use_cache: Брать изображение из кэша при совпадении промпта (False — новый вариант)
     
     Returns:
         str: URL сохраненного изображения
@@ -32,8 +87,9 @@ async def generate_draft_image(prompt: str, style: str = "storybook") -> str:
     try:
         logger.info(f"🎨 Генерация чернового изображения через Pollinations.ai для промпта: {prompt[:100]}...")
         
-        # Генерируем изображение через Pollinations.ai API
-        image_bytes = await generate_raw_image(prompt, max_retries=3, is_cover=False)
+        # Генерируем изображение через Pollinations.ai API (с учётом глобального лимита запросов)
+        async with get_global_image_semaphore():
+            image_bytes = await generate_raw_image(prompt, max_retries=3, is_cover=False, use_cache=use_cache)
         
         if not image_bytes or len(image_bytes) == 0:
             raise HTTPException(
@@ -115,7 +171,8 @@ async def generate_final_image(
     style: str = "storybook",
     book_title: Optional[str] = None,  # Название книги для обложки
     child_id: Optional[int] = None,  # ID ребёнка для использования face profile
-    use_child_face: bool = True  # Использовать face profile если доступен
+    use_child_face: bool = True,  # Использовать face profile если доступен
+    use_cache: bool = True  # False — новый вариант изображения в обход кэша
 ) -> str:
     """
     Генерирует финальное изображение через Pollinations.ai API с возможным face swap.
@@ -188,7 +245,8 @@ async def generate_final_image(
                             max_retries=max_retries,
                             similarity_threshold=threshold,
                             is_cover=is_cover,
-                            reference_image_path=reference_image_path
+                            reference_image_path=reference_image_path,
+                            use_cache=use_cache
                         )
                         
                         face_profile_used = True
@@ -210,7 +268,7 @@ async def generate_final_image(
         if not face_profile_used:
             # Генерируем изображение через Pollinations.ai API
             # Передаем is_cover для правильной обработки промпта
-            image_bytes = await generate_raw_image(prompt, max_retries=3, is_cover=is_cover)
+            image_bytes = await generate_raw_image(prompt, max_retries=3, is_cover=is_cover, use_cache=use_cache)
         
         if not image_bytes or len(image_bytes) == 0:
             raise HTTPException(
@@ -224,7 +282,12 @@ async def generate_final_image(
         if book_title:
             try:
                 from .cover_title_service import add_title_to_cover
-                image_bytes = add_title_to_cover(image_bytes, book_title, style)
+                from .cpu_pool import run_cpu_bound
+                titled_bytes = await run_cpu_bound(add_title_to_cover, image_bytes, book_title, style)
+                # Название не сдвигает лица — переносим результат детекции на новое изображение
+                from .face_detection_cache import alias_faces
+                alias_faces(image_bytes, titled_bytes)
+                image_bytes = titled_bytes
                 logger.info(f"✓ Название книги добавлено на обложку программно: {book_title}")
             except Exception as e:
                 logger.warning(f"⚠️ Не удалось добавить название на обложку: {e}")
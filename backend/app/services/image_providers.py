@@ -0,0 +1,308 @@
+"""
+Провайдеры генерации изображений (Pollinations.ai, fal.ai, локальная заглушка) с circuit breaker
+и автоматическим переключением.
+
+Список и веса задаются в IMAGE_PROVIDERS, например "pollinations:3,fal:1": основной провайдер
+выбирается случайно пропорционально весу, остальные используются как резервные (вес 0 — только
+резерв). У каждого провайдера свой circuit breaker: после PROVIDER_BREAKER_FAILURES ошибок подряд
+провайдер исключается из маршрутизации на PROVIDER_BREAKER_RESET_SECONDS, затем пропускается
+один пробный запрос. Если есть резервный провайдер, основному даётся PROVIDER_FAILOVER_RETRIES
+повторов — запрос сразу уходит к следующему провайдеру, а не ждёт паузы между повторами.
+Если у последнего провайдера маршрута уже идёт пробный запрос, генерация ждёт его итога
+до PROVIDER_TRIAL_WAIT_SECONDS, а не завершается ошибкой сразу.
+
+Text-to-image генерация (generate_raw_image) идёт через этот модуль; img2img с reference-изображением
+поддерживает только Pollinations.ai (pollinations_img2img_service).
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PROVIDERS = os.getenv("IMAGE_PROVIDERS", "pollinations")
+PROVIDER_BREAKER_FAILURES = int(os.getenv("PROVIDER_BREAKER_FAILURES", "3"))
+PROVIDER_BREAKER_RESET_SECONDS = float(os.getenv("PROVIDER_BREAKER_RESET_SECONDS", "120"))
+PROVIDER_FAILOVER_RETRIES = int(os.getenv("PROVIDER_FAILOVER_RETRIES", "0"))
+PROVIDER_TRIAL_WAIT_SECONDS = float(os.getenv("PROVIDER_TRIAL_WAIT_SECONDS", "30"))
+
+_STATS_WINDOW = 100
+
+
+class CircuitBreaker:
+    """closed → open (после N ошибок подряд) → half_open (один пробный запрос) → closed/open."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def is_available(self) -> bool:
+        """Можно ли направить запрос (без занятия пробного слота)."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_seconds
+        return not self._trial_in_flight
+
+    def allow(self) -> bool:
+        """Занять право на запрос; в half_open пропускается только один пробный запрос."""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+        return self.state == self.CLOSED
+
+    def trial_in_flight(self) -> bool:
+        return self.state == self.HALF_OPEN and self._trial_in_flight
+
+    def release_trial(self):
+        """Освободить пробный слот без смены состояния (запрос не показал, исправен ли провайдер)."""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def seconds_until_retry(self) -> float:
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+
+class ImageProvider:
+    """Базовый провайдер: generate() возвращает байты изображения или выбрасывает исключение."""
+
+    name = "base"
+
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.breaker = CircuitBreaker(PROVIDER_BREAKER_FAILURES, PROVIDER_BREAKER_RESET_SECONDS)
+        self._recent: Deque[Tuple[bool, float]] = deque(maxlen=_STATS_WINDOW)
+        self.requests_total = 0
+        self.failures_total = 0
+
+    def is_configured(self) -> bool:
+        return True
+
+    async def generate(self, prompt: str, max_retries: int, is_cover: bool, use_cache: bool) -> bytes:
+        raise NotImplementedError
+
+    def record(self, ok: bool, latency: float):
+        self.requests_total += 1
+        if not ok:
+            self.failures_total += 1
+        self._recent.append((ok, latency))
+
+    def stats(self) -> Dict[str, object]:
+        latencies = sorted(latency for ok, latency in self._recent if ok)
+        errors = sum(1 for ok, _ in self._recent if not ok)
+        return {
+            "weight": self.weight,
+            "configured": self.is_configured(),
+            "breaker_state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "retry_in_s": round(self.breaker.seconds_until_retry(), 1),
+            "requests_total": self.requests_total,
+            "failures_total": self.failures_total,
+            "error_rate": round(errors / len(self._recent), 3) if self._recent else 0.0,
+            "latency_avg_s": round(sum(latencies) / len(latencies), 1) if latencies else None,
+            "latency_p95_s": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 1) if latencies else None,
+        }
+
+
+class PollinationsProvider(ImageProvider):
+    name = "pollinations"
+
+    async def generate(self, prompt: str, max_retries: int, is_cover: bool, use_cache: bool) -> bytes:
+        from .pollinations_service import generate_raw_image
+        return await generate_raw_image(prompt, max_retries=max_retries, is_cover=is_cover, use_cache=use_cache)
+
+
+class FalProvider(ImageProvider):
+    name = "fal"
+
+    def is_configured(self) -> bool:
+        from .fal_service import is_fal_configured
+        return is_fal_configured()
+
+    async def generate(self, prompt: str, max_retries: int, is_cover: bool, use_cache: bool) -> bytes:
+        from .fal_service import generate_raw_image
+        return await generate_raw_image(prompt, max_retries=max_retries, is_cover=is_cover, use_cache=use_cache)
+
+
+class StubProvider(ImageProvider):
+    """Локальная заглушка (PIL) — для разработки и smoke-тестов без внешних API."""
+
+    name = "stub"
+
+    async def generate(self, prompt: str, max_retries: int, is_cover: bool, use_cache: bool) -> bytes:
+        from .pollinations_service import _generate_placeholder_image
+        from .cpu_pool import run_cpu_bound
+        return await run_cpu_bound(_generate_placeholder_image, prompt)
+
+
+PROVIDER_CLASSES = {
+    PollinationsProvider.name: PollinationsProvider,
+    FalProvider.name: FalProvider,
+    StubProvider.name: StubProvider,
+}
+
+_providers: Optional[List[ImageProvider]] = None
+
+
+def _parse_providers(spec: str) -> List[ImageProvider]:
+    providers = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.partition(":")
+        name = name.strip().lower()
+        provider_class = PROVIDER_CLASSES.get(name)
+        if provider_class is None:
+            logger.warning(f"⚠️ Неизвестный провайдер изображений '{name}' в IMAGE_PROVIDERS, пропускаем")
+            continue
+        providers.append(provider_class(float(weight) if weight else 1.0))
+    if not providers:
+        providers.append(PollinationsProvider(1.0))
+    return providers
+
+
+def get_image_providers() -> List[ImageProvider]:
+    """Провайдеры из IMAGE_PROVIDERS (создаются один раз на процесс)."""
+    global _providers
+    if _providers is None:
+        _providers = _parse_providers(IMAGE_PROVIDERS)
+        logger.info(f"✓ Провайдеры изображений: {[(p.name, p.weight) for p in _providers]}")
+    return _providers
+
+
+def _route(providers: List[ImageProvider]) -> List[ImageProvider]:
+    """Порядок попыток: основной — случайно по весу среди доступных, затем остальные по убыванию веса."""
+    available = [p for p in providers if p.is_configured() and p.breaker.is_available()]
+    if not available:
+        # Все breaker'ы открыты — последняя попытка через провайдер, который раньше других откроется
+        configured = [p for p in providers if p.is_configured()]
+        if not configured:
+            return []
+        fallback = min(configured, key=lambda p: p.breaker.seconds_until_retry())
+        logger.warning(f"⚠️ Все провайдеры изображений недоступны, пробуем {fallback.name}")
+        return [fallback]
+
+    weighted = [p for p in available if p.weight > 0]
+    if not weighted:
+        return available
+    primary = random.choices(weighted, weights=[p.weight for p in weighted])[0]
+    rest = sorted((p for p in available if p is not primary), key=lambda p: p.weight, reverse=True)
+    return [primary] + rest
+
+
+def _is_provider_failure(error: Exception) -> bool:
+    """Ошибки запроса (4xx, кроме 429) не говорят о неисправности провайдера."""
+    if isinstance(error, HTTPException):
+        return not (400 <= error.status_code < 500) or error.status_code == 429
+    return True
+
+
+async def _wait_for_trial(provider: ImageProvider) -> bool:
+    """Дождаться итога пробного запроса провайдера; True, если после него можно отправить запрос."""
+    deadline = time.monotonic() + PROVIDER_TRIAL_WAIT_SECONDS
+    while provider.breaker.trial_in_flight() and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+    return provider.breaker.allow()
+
+
+async def generate_raw_image(prompt: str, max_retries: int = 2, is_cover: bool = False, use_cache: bool = True) -> bytes:
+    """
+    Сгенерировать изображение через доступного провайдера с автоматическим переключением.
+
+    Сигнатура совпадает с pollinations_service.generate_raw_image.
+    """
+    route = _route(get_image_providers())
+    if not route:
+        raise HTTPException(status_code=503, detail="Нет настроенных провайдеров генерации изображений")
+
+    last_error: Optional[Exception] = None
+    attempted = False
+    for index, provider in enumerate(route):
+        is_last = index == len(route) - 1
+        forced = len(route) == 1 and not provider.breaker.is_available()
+        if not forced and not provider.breaker.allow():
+            # Пробный запрос последнего провайдера уже идёт — ждём его итога, а не сдаёмся сразу
+            if not (is_last and provider.breaker.trial_in_flight()):
+                continue
+            logger.info(f"⏳ Ждём итога пробного запроса провайдера {provider.name}")
+            if not await _wait_for_trial(provider):
+                continue
+        attempted = True
+
+        started = time.monotonic()
+        try:
+            image_bytes = await provider.generate(
+                prompt,
+                max_retries=max_retries if is_last else min(max_retries, PROVIDER_FAILOVER_RETRIES),
+                is_cover=is_cover,
+                use_cache=use_cache
+            )
+        except Exception as e:
+            last_error = e
+            if not _is_provider_failure(e):
+                # Ошибка запроса (4xx) ничего не говорит об исправности провайдера: только освобождаем пробный слот
+                provider.breaker.release_trial()
+                raise
+            provider.record(False, time.monotonic() - started)
+            provider.breaker.record_failure()
+            if provider.breaker.state == CircuitBreaker.OPEN:
+                logger.warning(f"⚠️ Circuit breaker провайдера {provider.name} открыт на {PROVIDER_BREAKER_RESET_SECONDS:.0f}с")
+            if not is_last:
+                logger.warning(f"⚠️ Провайдер {provider.name} не сгенерировал изображение ({e}), переключаемся на следующий")
+            continue
+
+        provider.record(True, time.monotonic() - started)
+        provider.breaker.record_success()
+        if index > 0:
+            logger.info(f"✓ Изображение сгенерировано резервным провайдером {provider.name}")
+        return image_bytes
+
+    if not attempted:
+        raise HTTPException(
+            status_code=503,
+            detail="Все провайдеры генерации изображений временно недоступны (идёт проверка после сбоев), попробуйте позже"
+        )
+    if isinstance(last_error, HTTPException):
+        raise last_error
+    raise HTTPException(
+        status_code=503,
+        detail=f"Все провайдеры генерации изображений недоступны: {last_error}"
+    )
+
+
+def get_provider_stats() -> Dict[str, Dict[str, object]]:
+    """Состояние circuit breaker'ов, задержки и доля ошибок по провайдерам."""
+    return {p.name: p.stats() for p in get_image_providers()}
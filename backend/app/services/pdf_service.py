@@ -10,7 +10,12 @@ PRINT-READY FEATURES:
 - Skin-tone safe цвета
 - PDF/X-4 совместимость
 """
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from dataclasses import dataclass
 from reportlab.lib.pagesizes import A4
@@ -29,11 +34,13 @@ from PIL import Image as PILImage
 
 # ЧАСТЬ B: НЕ ДОПУСКАТЬ "ЗАГЛУШКИ" ВМЕСТО ИЗОБРАЖЕНИЯ
 from .image_fetcher import fetch_image_bytes, ImageFetchError
+from .print_asset_cache import get_print_asset, store_print_asset
 
 # PRINT-READY конфигурация
 try:
     from ..print.print_config import PRINT_CONFIG, FINAL_PAGE_WIDTH, FINAL_PAGE_HEIGHT
-    from ..print.color_pipeline import rgb_to_cmyk_print_safe
+    from ..print.color_pipeline import rgb_image_to_print_safe
+    from ..print.color_management import get_color_conversion_id
     from ..print.skin_tone_safe import apply_skin_tone_clamp_to_image
     PRINT_READY_AVAILABLE = True
 except ImportError as e:
@@ -71,6 +78,68 @@ else:
     PAGE_WIDTH = (210 + 6) * mm
     PAGE_HEIGHT = (297 + 6) * mm
 
+# Встраивание обработанных изображений страниц (после CMYK/skin-tone стадий):
+# "jpeg" — одно JPEG-кодирование в конце pipeline (компактный PDF),
+# "raw" — PIL изображение передаётся в reportlab напрямую, без потерь (PDF заметно больше)
+PDF_IMAGE_EMBED = os.getenv("PDF_IMAGE_EMBED", "jpeg").lower()
+PDF_IMAGE_JPEG_QUALITY = int(os.getenv("PDF_IMAGE_JPEG_QUALITY", "98"))
+# Максимальное разрешение изображений страниц в PDF: более крупные уменьшаются под размер области
+# (0 — не уменьшать)
+PDF_IMAGE_MAX_DPI = int(os.getenv("PDF_IMAGE_MAX_DPI", "300"))
+# Потоков для параллельной подготовки изображений страниц (загрузка, CMYK, skin-tone, resize);
+# пул общий для процесса, поэтому одновременные рендеры книг делят эти потоки, а не умножают их
+PDF_PREPARE_WORKERS = int(os.getenv("PDF_PREPARE_WORKERS", "8"))
+
+# Профили рендера PDF:
+# - print — PRINT-READY для типографии: CMYK/skin-tone стадии, crop marks, полное разрешение;
+# - screen — для чтения в приложении и отправки: без CMYK/skin-tone и crop marks,
+#   изображения (включая обложку) уменьшаются до PDF_SCREEN_DPI, progressive JPEG
+PDF_RENDER_PROFILES = {
+    "print": {
+        "color_stages": True,
+        "crop_marks": True,
+        "process_cover": False,
+        "max_dpi": PDF_IMAGE_MAX_DPI,
+        "embed": PDF_IMAGE_EMBED,
+        "jpeg_quality": PDF_IMAGE_JPEG_QUALITY,
+        "progressive": False,
+    },
+    "screen": {
+        "color_stages": False,
+        "crop_marks": False,
+        "process_cover": True,
+        "max_dpi": int(os.getenv("PDF_SCREEN_DPI", "144")),
+        "embed": "jpeg",
+        "jpeg_quality": int(os.getenv("PDF_SCREEN_JPEG_QUALITY", "80")),
+        "progressive": True,
+    },
+}
+
+# Доля высоты story-страницы под изображение (остальное — текст)
+STORY_IMAGE_RATIO = 0.75
+
+# Preset skin-tone коррекции для детской кожи
+SKIN_TONE_PRESET = "child_light"
+
+# Кэш подготовленных изображений страниц в процессе: при повторной сборке книги после правки
+# сцены заново обрабатываются только изменившиеся страницы. Второй уровень — дисковый кэш
+# печатных ассетов (print_asset_cache), общий для процессов и скриптов. Ключ — содержимое
+# изображения и всё, что влияет на его подготовку (ICC профиль, preset, область на странице,
+# параметры встраивания); PRINT_PIPELINE_VERSION увеличивается при изменении обработки
+# или лэйаута изображений. Размер ограничен в байтах (PDF_PAGE_CACHE_MAX_MB); кэшируются только
+# закодированные JPEG — декодированные PIL изображения (PDF_IMAGE_EMBED=raw) слишком велики
+PDF_PAGE_CACHE_MAX_MB = int(os.getenv("PDF_PAGE_CACHE_MAX_MB", "128"))
+PRINT_PIPELINE_VERSION = 1
+
+_page_cache_lock = threading.Lock()
+# key -> JPEG байты подготовленного изображения
+_page_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_page_cache_bytes = 0
+_page_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+_prepare_executor: Optional[ThreadPoolExecutor] = None
+_prepare_executor_lock = threading.Lock()
+
 # Регистрируем шрифт с поддержкой кириллицы
 _cyrillic_font_available = False
 
@@ -197,6 +266,17 @@ class PdfPage:
     age: Optional[int] = None  # Возраст ребёнка для адаптации
 
 
+@dataclass
+class PreparedImage:
+    """Изображение страницы, подготовленное к отрисовке (загружено и обработано)"""
+    reader: Optional[ImageReader]  # None — изображение не удалось подготовить
+    image_source: str  # "local" | "http" | "none"
+    image_ok: bool
+    error: str = ""
+    elapsed: float = 0.0  # Время подготовки, секунды
+    cached: bool = False  # Взято из кэша страниц (обработка не выполнялась)
+
+
 def is_cover_page(page: PdfPage) -> bool:
     """Проверяет, является ли страница обложкой."""
     return page.order == 0
@@ -211,10 +291,11 @@ def render_book_pdf(
     title: str,
     pages: List[PdfPage],
     style: str = "storybook",
-    child_age: Optional[int] = None
+    child_age: Optional[int] = None,
+    profile: str = "print"
 ) -> None:
     """
-    Создает PRINT-READY PDF файл из списка страниц.
+    Создает PDF файл из списка страниц.
     
     Args:
         output_path: Путь для сохранения PDF файла
@@ -222,14 +303,20 @@ def render_book_pdf(
         pages: Список страниц (PdfPage)
         style: Стиль книги
         child_age: Возраст ребёнка (если не указан, берется из первой страницы с age)
+        profile: Профиль рендера из PDF_RENDER_PROFILES: "print" (PRINT-READY для типографии)
+            или "screen" (лёгкий PDF для чтения в приложении)
     """
     try:
+        if profile not in PDF_RENDER_PROFILES:
+            raise ValueError(f"Неизвестный профиль рендера PDF: {profile}")
+        render_profile = PDF_RENDER_PROFILES[profile]
+        
         # ЖЁСТКИЕ ASSERT'Ы ДЛЯ ЗАЩИТЫ ОТ РЕГРЕССА
-        if PRINT_READY_AVAILABLE:
+        if PRINT_READY_AVAILABLE and profile == "print":
             assert PRINT_CONFIG["output_space"] == "CMYK", "❌ OUTPUT SPACE ДОЛЖЕН БЫТЬ CMYK"
             logger.info(f"🎨 PRINT-READY режим: {PRINT_CONFIG['pdf_standard']}, {PRINT_CONFIG['color_profile']}")
         
-        logger.info(f"📄 Начало генерации PRINT-READY PDF: {output_path}, страниц: {len(pages)}")
+        logger.info(f"📄 Начало генерации PDF (профиль {profile}): {output_path}, страниц: {len(pages)}")
         
         # ШАГ 7: ФИНАЛЬНАЯ ПРОВЕРКА - валидация входных данных
         assert len(pages) > 0, "❌ PDF должен содержать хотя бы одну страницу"
@@ -267,11 +354,16 @@ def render_book_pdf(
             c.setTitle(title or "StoryHero")
             c.setSubject("Детская книга")
             c.setCreator("StoryHero")
-            c.setProducer(f"StoryHero PDF Generator ({PRINT_CONFIG['pdf_standard']})")
+            c.setProducer(f"StoryHero PDF Generator ({PRINT_CONFIG['pdf_standard'] if profile == 'print' else profile})")
         
-        # Обрабатываем каждую страницу
+        # Фаза 1: параллельно готовим изображения всех страниц (загрузка, CMYK, skin-tone, resize)
+        prepared_images = _prepare_page_images(pages, PAGE_WIDTH, PAGE_HEIGHT, profile)
+        
+        # Фаза 2: последовательно собираем canvas из подготовленных изображений
         # ШАГ 1: ЖЁСТКО ЗАКРЕПИТЬ ОБЛОЖКУ - исправленная логика showPage()
+        assembly_started = time.monotonic()
         for idx, page in enumerate(pages):
+            page_started = time.monotonic()
             # ПРАВИЛО: первая страница (idx=0) НЕ вызывает showPage()
             # Все последующие страницы вызывают showPage() ПЕРЕД обработкой
             if idx > 0:
@@ -287,22 +379,15 @@ def render_book_pdf(
                 image_loaded = False
                 
                 if page.image_url:
-                    # ШАГ 4: Используем локальный путь для обложки
-                    local_path_or_url, image_source = _url_to_local_path(page.image_url)
+                    prepared = prepared_images[idx]
+                    if prepared.reader is None:
+                        logger.error(f"❌ Ошибка при загрузке изображения обложки: {prepared.error}")
+                        # НЕ продолжаем генерацию PDF с битым изображением
+                        raise RuntimeError(f"Не удалось загрузить изображение обложки: {prepared.error}")
+                    logger.info(f"✓ Обложка: изображение загружено (source={prepared.image_source})")
                     
                     try:
-                        if image_source == "local":
-                            # Читаем с диска
-                            with open(local_path_or_url, "rb") as f:
-                                image_bytes = f.read()
-                            img = ImageReader(BytesIO(image_bytes))
-                            logger.info(f"✓ Обложка: изображение загружено с диска ({len(image_bytes)} байт)")
-                        else:
-                            # HTTP загрузка
-                            image_bytes = fetch_image_bytes(local_path_or_url, timeout=20, retries=3)
-                            img = ImageReader(BytesIO(image_bytes))
-                            logger.info(f"✓ Обложка: изображение загружено по HTTP ({len(image_bytes)} байт)")
-                        
+                        img = prepared.reader
                         if PRINT_READY_AVAILABLE:
                             c.drawImage(img, -BLEED, -BLEED, width=PAGE_WIDTH + BLEED * 2, height=PAGE_HEIGHT + BLEED * 2, preserveAspectRatio=True)
                         else:
@@ -310,13 +395,9 @@ def render_book_pdf(
                         image_loaded = True
                         
                         # ШАГ 7: ДИАГНОСТИКА
-                        logger.info(f"📄 PDF page order=0 cover=True image_source={image_source} image_ok=True text_len=0 font=CyrillicFontBold")
-                    except ImageFetchError as e:
-                        logger.error(f"❌ Ошибка при загрузке изображения обложки: {e}")
-                        # НЕ продолжаем генерацию PDF с битым изображением
-                        raise RuntimeError(f"Не удалось загрузить изображение обложки: {e}")
+                        logger.info(f"📄 PDF page order=0 cover=True image_source={prepared.image_source} image_ok=True text_len=0 font=CyrillicFontBold")
                     except Exception as e:
-                        logger.error(f"❌ Неожиданная ошибка при загрузке изображения обложки: {e}", exc_info=True)
+                        logger.error(f"❌ Неожиданная ошибка при отрисовке изображения обложки: {e}", exc_info=True)
                         raise RuntimeError(f"Неожиданная ошибка при загрузке изображения обложки: {e}")
                 
                 # ШАГ 2: ДОБАВИТЬ НАЗВАНИЕ НА ОБЛОЖКУ - ВСЕГДА вызывается
@@ -333,8 +414,9 @@ def render_book_pdf(
                     # Но продолжаем обработку остальных страниц
                     continue
                 
-                if PRINT_READY_AVAILABLE:
+                if render_profile["crop_marks"]:
                     _draw_crop_marks(c, PAGE_WIDTH, PAGE_HEIGHT, BLEED)
+                logger.debug(f"⏱️ Страница order={page.order} отрисована за {(time.monotonic() - page_started) * 1000:.0f}мс")
                 continue
             
             # STORY-страница: адаптированная под возраст
@@ -345,24 +427,90 @@ def render_book_pdf(
             
             # Обрабатываем story-страницу
             try:
-                _draw_story_page(c, page, PAGE_WIDTH, PAGE_HEIGHT, age_config, style)
+                _draw_story_page(c, page, PAGE_WIDTH, PAGE_HEIGHT, age_config, style, prepared=prepared_images.get(idx))
                 # Рисуем crop marks для story-страницы
-                if PRINT_READY_AVAILABLE:
+                if render_profile["crop_marks"]:
                     _draw_crop_marks(c, PAGE_WIDTH, PAGE_HEIGHT, BLEED)
+                logger.debug(f"⏱️ Страница order={page.order} отрисована за {(time.monotonic() - page_started) * 1000:.0f}мс")
             except Exception as e:
                 logger.error(f"❌ Ошибка при обработке story-страницы order={page.order}: {e}")
                 # Пропускаем страницу при ошибке
                 continue
         
+        logger.info(f"⏱️ Сборка canvas: {time.monotonic() - assembly_started:.2f}с")
+        
         # Сохраняем PDF
         c.save()
-        logger.info(f"✅ PRINT-READY PDF успешно создан: {output_path}")
+        logger.info(f"✅ PDF успешно создан (профиль {profile}): {output_path}")
         
     except Exception as e:
         logger.error(f"❌ Ошибка при создании PDF: {str(e)}", exc_info=True)
         raise
 
 
+def _prepare_page_images(
+    pages: List[PdfPage],
+    page_width: float,
+    page_height: float,
+    profile: str = "print"
+) -> Dict[int, PreparedImage]:
+    """
+    Параллельно готовит изображения всех страниц книги (фаза 1 render_book_pdf).
+    
+    Загрузка, CMYK конвертация, skin-tone коррекция и уменьшение до целевого DPI не зависят
+    от canvas, поэтому выполняются в общем для процесса пуле потоков (PDF_PREPARE_WORKERS): одновременные
+    рендеры нескольких книг не создают каждый свои потоки; Pillow, ImageCms и NumPy
+    отпускают GIL. Последовательно рисуется только canvas, поэтому время подготовки книги
+    близко ко времени самой долгой страницы, а не к сумме всех страниц.
+    
+    Returns:
+        Dict[int, PreparedImage]: индекс страницы в pages -> подготовленное изображение
+            (страницы без изображения не включаются)
+    """
+    # Область изображения: обложка — вся страница, story-страница — верхние STORY_IMAGE_RATIO
+    jobs = {
+        idx: (page.image_url, page_width, page_height if page.order == 0 else page_height * STORY_IMAGE_RATIO, page.order == 0, profile)
+        for idx, page in enumerate(pages)
+        if page.image_url
+    }
+    if not jobs:
+        return {}
+    
+    started = time.monotonic()
+    workers = max(1, min(PDF_PREPARE_WORKERS, len(jobs)))
+    executor = _get_prepare_executor()
+    futures = {idx: executor.submit(_prepare_page_image, *job) for idx, job in jobs.items()}
+    prepared = {idx: future.result() for idx, future in futures.items()}
+    elapsed = time.monotonic() - started
+    
+    for idx, result in prepared.items():
+        if result.reader is None:
+            status = f"ошибка: {result.error[:80]}"
+        else:
+            status = "из кэша" if result.cached else "ok"
+        logger.info(f"⏱️ Страница order={pages[idx].order} подготовлена за {result.elapsed * 1000:.0f}мс ({status})")
+    slowest = max(result.elapsed for result in prepared.values())
+    total = sum(result.elapsed for result in prepared.values())
+    cached = sum(1 for result in prepared.values() if result.cached)
+    logger.info(
+        f"⏱️ Подготовка {len(prepared)} изображений: {elapsed:.2f}с "
+        f"(самая долгая страница {slowest:.2f}с, сумма {total:.2f}с, потоков {workers}, из кэша {cached})"
+    )
+    return prepared
+
+
+def _get_prepare_executor() -> ThreadPoolExecutor:
+    """Общий для процесса пул подготовки изображений страниц (PDF_PREPARE_WORKERS потоков)."""
+    global _prepare_executor
+    if _prepare_executor is None:
+        with _prepare_executor_lock:
+            if _prepare_executor is None:
+                _prepare_executor = ThreadPoolExecutor(
+                    max_workers=max(1, PDF_PREPARE_WORKERS), thread_name_prefix="pdf-prepare"
+                )
+    return _prepare_executor
+
+
 # ============================================================
 # БЕЗОПАСНАЯ ЗАГРУЗКА ИЗОБРАЖЕНИЙ (С FALLBACK)
 # ============================================================
@@ -402,6 +550,278 @@ def _url_to_local_path(image_url: str) -> tuple[str, str]:
         return image_url, "http"
 
 
+def _fit_image(img_w: int, img_h: int, x: float, y: float, w: float, h: float) -> tuple[float, float, float, float]:
+    """
+    Вычисляет размещение изображения для заполнения области.
+    
+    Returns:
+        tuple: (draw_x, draw_y, draw_w, draw_h)
+    """
+    ratio = img_w / img_h
+    area_ratio = w / h
+    
+    # ШАГ 3: Вычисляем размеры изображения для заполнения области
+    # ВАЖНО: изображение должно строго оставаться в области [y, y+h]
+    if ratio > area_ratio:
+        # Изображение шире области - заполняем по высоте
+        draw_h = h
+        draw_w = draw_h * ratio
+        draw_x = x + (w - draw_w) / 2
+        draw_y = y  # НЕ y=0, а строго y (начало области изображения)
+    else:
+        # Изображение выше области - заполняем по ширине
+        draw_w = w
+        draw_h = draw_w / ratio
+        draw_x = x
+        # ВАЖНО: draw_y должен быть >= y, чтобы не залезать на текст
+        draw_y = max(y, y + (h - draw_h) / 2)
+    
+    # ШАГ 3: Проверка что изображение не залезает на текст
+    # Изображение должно быть строго в области [y, y+h]
+    if draw_y < y:
+        logger.warning(f"⚠️ Изображение выходит за верхнюю границу, корректируем: draw_y={draw_y} -> y={y}")
+        draw_y = y
+    if draw_y + draw_h > y + h:
+        logger.warning(f"⚠️ Изображение выходит за нижнюю границу, корректируем")
+        draw_h = (y + h) - draw_y
+    
+    return draw_x, draw_y, draw_w, draw_h
+
+
+def _prepare_page_image(
+    image_url: str,
+    w: float,
+    h: float,
+    is_cover: bool = False,
+    profile: str = "print"
+) -> PreparedImage:
+    """
+    Загружает и обрабатывает изображение страницы (без обращения к canvas).
+    
+    Безопасна для вызова из нескольких потоков: render_book_pdf готовит изображения всех страниц
+    параллельно, а canvas собирает последовательно.
+    
+    Args:
+        image_url: URL изображения
+        w, h: Размер области, в которую будет нарисовано изображение (для уменьшения до целевого DPI)
+        is_cover: True если это обложка (в профиле print обложка передаётся в reportlab без обработки)
+        profile: Профиль рендера из PDF_RENDER_PROFILES
+    
+    Returns:
+        PreparedImage: reader=None и error, если изображение не удалось загрузить
+    """
+    started = time.monotonic()
+    
+    def _failed(image_source: str, error: str) -> PreparedImage:
+        return PreparedImage(None, image_source, False, error, time.monotonic() - started)
+    
+    # ШАГ 4: Конвертируем URL в локальный путь
+    local_path_or_url, image_source = _url_to_local_path(image_url)
+    
+    logger.debug(f"📥 Загружаю изображение: {image_url} (source={image_source})")
+    
+    # Загружаем изображение
+    if image_source == "local":
+        # Читаем с диска
+        try:
+            with open(local_path_or_url, "rb") as f:
+                image_bytes = f.read()
+            logger.debug(f"✓ Изображение загружено с диска: {len(image_bytes)} байт")
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения локального файла {local_path_or_url}: {e}")
+            return _failed("none", f"Local file error: {e}")
+    else:
+        # HTTP загрузка (для обложки — больше попыток)
+        try:
+            image_bytes = fetch_image_bytes(local_path_or_url, timeout=20, retries=3 if is_cover else 2)
+            logger.debug(f"✓ Изображение загружено по HTTP: {len(image_bytes)} байт")
+        except ImageFetchError as e:
+            logger.error(f"❌ Ошибка при загрузке изображения по HTTP: {e}")
+            return _failed("http", f"HTTP error: {e}")
+        except Exception as e:
+            logger.error(f"❌ Image failed: {image_url} | {e}")
+            return _failed("none", f"Exception: {e}")
+    
+    render_profile = PDF_RENDER_PROFILES[profile]
+    # Печатные ассеты на диске — только для профиля print (screen-ассеты дёшевы и малы)
+    use_disk_cache = profile == "print" and render_profile["embed"] != "raw"
+    cached = False
+    try:
+        # ВАЖНО: В профиле print обработку обложки пропускаем, чтобы избежать проблем с памятью
+        # (CMYK конвертация будет применена при сохранении PDF) — её байты идут в reportlab как есть
+        if is_cover and not render_profile["process_cover"]:
+            asset = image_bytes
+        else:
+            key = _page_cache_key(image_bytes, w, h, profile)
+            asset = _page_cache_get(key)
+            if asset is None and use_disk_cache:
+                asset = get_print_asset(key)
+                if asset is not None:
+                    _page_cache_put(key, asset)
+            cached = asset is not None
+            if not cached:
+                asset = _process_page_image(image_bytes, w, h, profile)
+                if asset is not image_bytes:
+                    _page_cache_put(key, asset)
+                    if use_disk_cache and isinstance(asset, bytes):
+                        store_print_asset(key, asset)
+        reader = ImageReader(BytesIO(asset)) if isinstance(asset, bytes) else ImageReader(asset)
+    except Exception as e:
+        logger.error(f"❌ Image failed: {image_url} | {e}")
+        return _failed("none", f"Exception: {e}")
+    
+    return PreparedImage(reader, image_source, True, "", time.monotonic() - started, cached)
+
+
+def _page_cache_key(image_bytes: bytes, w: float, h: float, profile: str = "print") -> str:
+    render_profile = PDF_RENDER_PROFILES[profile]
+    color_stages = render_profile["color_stages"]
+    digest = hashlib.sha256(image_bytes)
+    digest.update(repr((
+        PRINT_PIPELINE_VERSION, round(w, 2), round(h, 2),
+        get_color_conversion_id() if color_stages and PRINT_READY_AVAILABLE else None,
+        SKIN_TONE_PRESET if color_stages and SKIN_TONE_AVAILABLE else None,
+        render_profile["embed"], render_profile["jpeg_quality"], render_profile["max_dpi"],
+        render_profile["progressive"]
+    )).encode())
+    return digest.hexdigest()
+
+
+def _page_cache_get(key: str):
+    with _page_cache_lock:
+        asset = _page_cache.get(key)
+        if asset is None:
+            _page_cache_stats["misses"] += 1
+            return None
+        _page_cache.move_to_end(key)
+        _page_cache_stats["hits"] += 1
+        return asset
+
+
+def _page_cache_put(key: str, asset) -> None:
+    global _page_cache_bytes
+    limit = PDF_PAGE_CACHE_MAX_MB * 1024 * 1024
+    if not isinstance(asset, bytes) or len(asset) > limit:
+        return
+    with _page_cache_lock:
+        _page_cache_bytes -= len(_page_cache.pop(key, b""))
+        _page_cache[key] = asset
+        _page_cache_bytes += len(asset)
+        while _page_cache_bytes > limit:
+            _, evicted = _page_cache.popitem(last=False)
+            _page_cache_bytes -= len(evicted)
+            _page_cache_stats["evictions"] += 1
+
+
+def get_pdf_page_cache_stats() -> Dict[str, object]:
+    """Метрики кэша подготовленных изображений страниц PDF."""
+    with _page_cache_lock:
+        lookups = _page_cache_stats["hits"] + _page_cache_stats["misses"]
+        return {
+            "size": len(_page_cache),
+            "size_mb": round(_page_cache_bytes / 1024 / 1024, 1),
+            "max_mb": PDF_PAGE_CACHE_MAX_MB,
+            "hit_rate": round(_page_cache_stats["hits"] / lookups, 3) if lookups else 0.0,
+            **_page_cache_stats,
+        }
+
+
+def prewarm_page_image(image_url: str) -> bool:
+    """
+    Подготовить изображение story-страницы заранее (кэш в памяти и print_asset_cache).
+
+    Returns:
+        bool: True если изображение подготовлено или уже было в кэше
+    """
+    prepared = _prepare_page_image(image_url, PAGE_WIDTH, PAGE_HEIGHT * STORY_IMAGE_RATIO)
+    return prepared.reader is not None
+
+
+def _process_page_image(image_bytes: bytes, w: float, h: float, profile: str = "print"):
+    """
+    CMYK и skin-tone обработка изображения страницы и уменьшение до DPI профиля рендера.
+    
+    Изображение декодируется один раз: стадии работают с PIL объектом, кодирование
+    (или передача raw в reportlab) — один раз в конце.
+    
+    Returns:
+        JPEG байты, PIL изображение (embed=raw) или исходные image_bytes,
+        если ни одна стадия не применилась
+    """
+    render_profile = PDF_RENDER_PROFILES[profile]
+    apply_cmyk = render_profile["color_stages"] and PRINT_READY_AVAILABLE
+    apply_skin_tone = render_profile["color_stages"] and SKIN_TONE_AVAILABLE
+    max_dpi = render_profile["max_dpi"]
+    
+    # Исходные байты — ключ кэша детекции лиц (bbox, найденные при генерации изображения)
+    source_image_bytes = image_bytes
+    
+    # Открытие ленивое: до load() читается только заголовок
+    image_pil = PILImage.open(BytesIO(image_bytes))
+    scale = 1.0
+    if max_dpi > 0:
+        _, _, draw_w, _ = _fit_image(image_pil.width, image_pil.height, 0, 0, w, h)
+        scale = min(1.0, draw_w / 72 * max_dpi / image_pil.width)
+    
+    if not (apply_cmyk or apply_skin_tone or scale < 1.0):
+        logger.debug(f"🖼️ Создаю ImageReader из {len(image_bytes)} байт")
+        return image_bytes
+    
+    image_pil.load()
+    processed = False
+    
+    # PRINT-READY: RGB -> CMYK -> RGB через ICC профиль
+    if apply_cmyk:
+        try:
+            image_pil = rgb_image_to_print_safe(image_pil, use_icc=True)
+            processed = True
+            logger.debug("🎨 RGB->CMYK конвертация выполнена")
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка при CMYK конвертации: {e}. Используется оригинальное изображение.")
+    
+    # Применяем Skin-Tone Safe CMYK (если доступно)
+    if apply_skin_tone:
+        try:
+            image_cmyk = apply_skin_tone_safe_cmyk(
+                image_rgb=image_pil,
+                face_bbox=None,  # Автоматическое определение
+                preset_name=SKIN_TONE_PRESET,
+                image_bytes=source_image_bytes
+            )
+            # Конвертируем CMYK обратно в RGB для ImageReader
+            image_pil = image_cmyk.convert("RGB")
+            processed = True
+            logger.debug("🎨 Skin-tone CMYK коррекция применена к странице")
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка при применении skin-tone коррекции: {e}. Используется оригинальное изображение.")
+    
+    # Уменьшаем до целевого DPI после skin-tone: bbox лиц из кэша детекции заданы в исходных пикселях
+    if scale < 1.0:
+        target_size = (max(1, round(image_pil.width * scale)), max(1, round(image_pil.height * scale)))
+        logger.debug(f"📐 Уменьшаю изображение {image_pil.size} -> {target_size} ({max_dpi} DPI)")
+        image_pil = image_pil.resize(target_size, PILImage.LANCZOS)
+        processed = True
+    
+    if not processed:
+        return image_bytes
+    if render_profile["embed"] == "raw":
+        logger.debug(f"🖼️ Создаю ImageReader из PIL изображения {image_pil.size} (raw)")
+        return image_pil
+    
+    if image_pil.mode != "RGB":
+        image_pil = image_pil.convert("RGB")
+    img_buffer = BytesIO()
+    image_pil.save(
+        img_buffer,
+        format="JPEG",
+        quality=render_profile["jpeg_quality"],
+        optimize=True,
+        progressive=render_profile["progressive"]
+    )
+    logger.debug(f"🖼️ Создаю ImageReader из {img_buffer.tell()} байт (JPEG quality={render_profile['jpeg_quality']})")
+    return img_buffer.getvalue()
+
+
 def _safe_draw_image(
     c: canvas.Canvas,
     image_url: str,
@@ -409,7 +829,8 @@ def _safe_draw_image(
     y: float,
     w: float,
     h: float,
-    is_cover: bool = False
+    is_cover: bool = False,
+    prepared: Optional[PreparedImage] = None
 ) -> tuple[bool, str, bool]:
     """
     Безопасно загружает и рисует изображение с обработкой ошибок.
@@ -419,6 +840,7 @@ def _safe_draw_image(
         image_url: URL изображения
         x, y, w, h: Координаты и размеры
         is_cover: True если это обложка (для skin-tone коррекции)
+        prepared: Изображение, заранее подготовленное _prepare_page_image (иначе готовится здесь)
     
     Returns:
         tuple: (success, image_source, image_ok) где:
@@ -426,115 +848,23 @@ def _safe_draw_image(
             image_source: "local" | "http" | "none"
             image_ok: True если изображение валидно
     """
+    if prepared is None:
+        prepared = _prepare_page_image(image_url, w, h, is_cover=is_cover)
+    if prepared.reader is None:
+        # Fallback на placeholder
+        return _draw_placeholder_image(c, x, y, w, h, prepared.error), prepared.image_source, False
+    
     try:
-        # ШАГ 4: Конвертируем URL в локальный путь
-        local_path_or_url, image_source = _url_to_local_path(image_url)
-        
-        logger.debug(f"📥 Загружаю изображение: {image_url} (source={image_source})")
-        
-        # Загружаем изображение
-        if image_source == "local":
-            # Читаем с диска
-            try:
-                with open(local_path_or_url, "rb") as f:
-                    image_bytes = f.read()
-                logger.debug(f"✓ Изображение загружено с диска: {len(image_bytes)} байт")
-                image_ok = True
-            except Exception as e:
-                logger.error(f"❌ Ошибка чтения локального файла {local_path_or_url}: {e}")
-                # Fallback на placeholder
-                return _draw_placeholder_image(c, x, y, w, h, f"Local file error: {e}"), "none", False
-        else:
-            # HTTP загрузка
-            try:
-                image_bytes = fetch_image_bytes(local_path_or_url, timeout=20, retries=2)
-                logger.debug(f"✓ Изображение загружено по HTTP: {len(image_bytes)} байт")
-                image_ok = True
-            except ImageFetchError as e:
-                logger.error(f"❌ Ошибка при загрузке изображения по HTTP: {e}")
-                # Fallback на placeholder
-                return _draw_placeholder_image(c, x, y, w, h, f"HTTP error: {e}"), "http", False
-        
-        # PRINT-READY: Конвертируем RGB -> CMYK
-        # ВАЖНО: Для обложки пропускаем CMYK конвертацию, чтобы избежать проблем с памятью
-        # CMYK конвертация будет применена при сохранении PDF
-        if PRINT_READY_AVAILABLE and not is_cover:
-            try:
-                # Конвертируем в CMYK через ICC профиль (только для story-страниц)
-                image_bytes = rgb_to_cmyk_print_safe(image_bytes, use_icc=True)
-                logger.debug("🎨 RGB->CMYK конвертация выполнена")
-            except Exception as e:
-                logger.warning(f"⚠️ Ошибка при CMYK конвертации: {e}. Используется оригинальное изображение.")
-        
-        # Применяем Skin-Tone Safe CMYK для обложки и story-страниц (если доступно)
-        # ВАЖНО: Для обложки временно отключаем skin-tone коррекцию, чтобы избежать проблем
-        if SKIN_TONE_AVAILABLE and not is_cover:
-            try:
-                # Загружаем как PIL Image
-                image_pil = PILImage.open(BytesIO(image_bytes))
-                if image_pil.mode != "RGB":
-                    image_pil = image_pil.convert("RGB")
-                
-                # Применяем skin-tone safe CMYK коррекцию
-                image_cmyk = apply_skin_tone_safe_cmyk(
-                    image_rgb=image_pil,
-                    face_bbox=None,  # Автоматическое определение
-                    preset_name="child_light"
-                )
-                
-                # Конвертируем CMYK обратно в RGB для ImageReader
-                image_rgb_final = image_cmyk.convert("RGB")
-                
-                # Сохраняем в BytesIO для ImageReader
-                img_buffer = BytesIO()
-                image_rgb_final.save(img_buffer, format="JPEG", quality=95)
-                img_buffer.seek(0)
-                image_bytes = img_buffer.getvalue()
-                
-                if is_cover:
-                    logger.info("🎨 Skin-tone CMYK коррекция применена к обложке")
-                else:
-                    logger.debug("🎨 Skin-tone CMYK коррекция применена к странице")
-            except Exception as e:
-                logger.warning(f"⚠️ Ошибка при применении skin-tone коррекции: {e}. Используется оригинальное изображение.")
-        
-        logger.debug(f"🖼️ Создаю ImageReader из {len(image_bytes)} байт")
-        img = ImageReader(BytesIO(image_bytes))
+        img = prepared.reader
         img_w, img_h = img.getSize()
         logger.debug(f"✓ ImageReader создан: {img_w}x{img_h}")
-        ratio = img_w / img_h
-        area_ratio = w / h
-        
-        # ШАГ 3: Вычисляем размеры изображения для заполнения области
-        # ВАЖНО: изображение должно строго оставаться в области [y, y+h]
-        if ratio > area_ratio:
-            # Изображение шире области - заполняем по высоте
-            draw_h = h
-            draw_w = draw_h * ratio
-            draw_x = x + (w - draw_w) / 2
-            draw_y = y  # НЕ y=0, а строго y (начало области изображения)
-        else:
-            # Изображение выше области - заполняем по ширине
-            draw_w = w
-            draw_h = draw_w / ratio
-            draw_x = x
-            # ВАЖНО: draw_y должен быть >= y, чтобы не залезать на текст
-            draw_y = max(y, y + (h - draw_h) / 2)
-        
-        # ШАГ 3: Проверка что изображение не залезает на текст
-        # Изображение должно быть строго в области [y, y+h]
-        if draw_y < y:
-            logger.warning(f"⚠️ Изображение выходит за верхнюю границу, корректируем: draw_y={draw_y} -> y={y}")
-            draw_y = y
-        if draw_y + draw_h > y + h:
-            logger.warning(f"⚠️ Изображение выходит за нижнюю границу, корректируем")
-            draw_h = (y + h) - draw_y
+        draw_x, draw_y, draw_w, draw_h = _fit_image(img_w, img_h, x, y, w, h)
         
         # Рисуем изображение
         logger.debug(f"🎨 Рисую изображение: {draw_x:.0f}, {draw_y:.0f}, {draw_w:.0f}x{draw_h:.0f}")
         c.drawImage(img, draw_x, draw_y, width=draw_w, height=draw_h)
         logger.debug(f"✓ Изображение нарисовано")
-        return True, image_source, image_ok
+        return True, prepared.image_source, prepared.image_ok
         
     except Exception as e:
         logger.error(f"❌ Image failed: {image_url} | {e}")
@@ -737,7 +1067,8 @@ def _draw_story_page(
     page_width: float,
     page_height: float,
     age_config: Dict,
-    style: str
+    style: str,
+    prepared: Optional[PreparedImage] = None
 ) -> None:
     """
     Рисует STORY-страницу: изображение сверху (75%), текст снизу (25%).
@@ -750,11 +1081,12 @@ def _draw_story_page(
         page_height: Высота страницы
         age_config: Конфигурация для возраста (из get_age_style)
         style: Стиль книги
+        prepared: Заранее подготовленное изображение страницы (см. _prepare_page_images)
     """
     # ЕДИНЫЙ LAYOUT-КОНТРАКТ (строго)
     # Для НЕ-обложки: 75% image, 25% text (независимо от возраста)
-    IMAGE_RATIO = 0.75
-    TEXT_RATIO = 0.25
+    IMAGE_RATIO = STORY_IMAGE_RATIO
+    TEXT_RATIO = 1 - STORY_IMAGE_RATIO
     
     image_h = page_height * IMAGE_RATIO
     text_h = page_height * TEXT_RATIO
@@ -784,7 +1116,8 @@ def _draw_story_page(
         y=IMAGE_Y,
         w=page_width,
         h=image_h,
-        is_cover=False
+        is_cover=False,
+        prepared=prepared
     )
     
     # ШАГ 7: ДИАГНОСТИКА - логируем информацию о странице
@@ -6,8 +6,19 @@ import logging
 import os
 import time
 import asyncio
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import httpx
+from .http_clients import http_client
+from .rate_limiter import get_rate_limiter, retry_delay
+from .request_hedging import run_hedged
+from .image_cache import (
+    deterministic_seed,
+    get_cached_image,
+    is_cache_enabled,
+    make_cache_key,
+    normalize_prompt,
+    store_cached_image,
+)
 import urllib.parse
 from fastapi import HTTPException
 
@@ -20,6 +31,18 @@ POLLINATIONS_IMG2IMG_BASE_URL = "https://image.pollinations.ai/prompt"
 DEFAULT_STRENGTH = 0.25  # Сила влияния reference изображения (0.0 - 1.0)
 DEFAULT_MAX_RETRIES = 3
 DEFAULT_BACKOFF = 2.0  # секунды
+# Сколько кандидатов generate_with_verification генерирует одновременно (1 — по очереди)
+FACE_VERIFY_CONCURRENCY = int(os.getenv("FACE_VERIFY_CONCURRENCY", "1"))
+# Similarity, при которой обложка принимается досрочно
+COVER_EARLY_STOP_SIMILARITY = 0.90
+
+
+class _ProviderStatusError(Exception):
+    """Pollinations.ai ответил не 200 — решение о повторе принимается в цикле попыток."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Pollinations.ai вернул статус {status_code}")
+        self.status_code = status_code
 
 
 def build_prompt(base_prompt: str, strict_identity: bool = True, is_cover: bool = False) -> str:
@@ -58,7 +81,8 @@ async def generate_img2img(
     reference_image_url: str,
     strength: float = DEFAULT_STRENGTH,
     seed: Optional[int] = None,
-    max_retries: int = DEFAULT_MAX_RETRIES
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    use_cache: bool = True
 ) -> bytes:
     """
     Сгенерировать изображение через Pollinations.ai img2img.
@@ -69,6 +93,7 @@ async def generate_img2img(
         strength: Сила влияния reference изображения (0.0 - 1.0)
         seed: Случайный seed для генерации (опционально)
         max_retries: Максимальное количество попыток при ошибке
+        use_cache: Использовать кэш изображений (без seed он выводится из параметров запроса)
     
     Returns:
         bytes: Байты сгенерированного изображения (JPEG/PNG)
@@ -79,6 +104,19 @@ async def generate_img2img(
     # Pollinations.ai поддерживает img2img через параметр image в URL
     # Формат: https://image.pollinations.ai/prompt/{prompt}?image={reference_url}&strength={strength}
     
+    cache_key = None
+    if is_cache_enabled(use_cache):
+        cache_params = dict(
+            provider="pollinations-img2img", model="flux", width=1024, height=1024,
+            prompt=normalize_prompt(prompt), image=reference_image_url, strength=str(strength)
+        )
+        if not seed:
+            seed = deterministic_seed(make_cache_key(**cache_params))
+        cache_key = make_cache_key(seed=int(seed), **cache_params)
+        cached = await get_cached_image(cache_key)
+        if cached:
+            return cached
+    
     last_error = None
     for attempt in range(max_retries + 1):
         try:
@@ -102,10 +140,6 @@ async def generate_img2img(
                 import random
                 params["seed"] = str(random.randint(1, 1000000))
             
-            # Формируем полный URL
-            query_string = urllib.parse.urlencode(params)
-            api_url = f"{POLLINATIONS_IMG2IMG_BASE_URL}/{encoded_prompt}?{query_string}"
-            
             logger.info(
                 f"🔄 Запрос к Pollinations.ai img2img (попытка {attempt + 1}/{max_retries + 1}): "
                 f"strength={strength}, seed={params.get('seed')}"
@@ -114,47 +148,21 @@ async def generate_img2img(
             # Отправляем GET запрос с таймаутом
             timeout = httpx.Timeout(300.0, connect=10.0, read=300.0)  # 5 минут
             
-            async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-                logger.info(f"📤 Отправка запроса в Pollinations.ai img2img API...")
-                resp = await client.get(api_url)
-                
-                if resp.status_code == 503:
-                    # Сервис временно недоступен
-                    if attempt < max_retries:
-                        wait_time = DEFAULT_BACKOFF * (2 ** attempt)
-                        logger.warning(f"⚠️ Pollinations.ai недоступен (503), повтор через {wait_time:.1f}с...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    else:
-                        raise HTTPException(
-                            status_code=503,
-                            detail="Pollinations.ai временно недоступен"
-                        )
+            async def fetch(request_seed: int) -> bytes:
+                # Формируем полный URL
+                query_string = urllib.parse.urlencode({**params, "seed": str(request_seed)})
+                api_url = f"{POLLINATIONS_IMG2IMG_BASE_URL}/{encoded_prompt}?{query_string}"
                 
-                if resp.status_code == 429:
-                    # Rate limit
-                    if attempt < max_retries:
-                        wait_time = DEFAULT_BACKOFF * (2 ** attempt)
-                        logger.warning(f"⚠️ Rate limit (429), повтор через {wait_time:.1f}с...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    else:
-                        raise HTTPException(
-                            status_code=429,
-                            detail="Превышен лимит запросов к Pollinations.ai"
-                        )
+                async with http_client("pollinations") as client:
+                    logger.info(f"📤 Отправка запроса в Pollinations.ai img2img API (seed={request_seed})...")
+                    # Общий для процесса ограничитель: темп запросов и окно одновременных запросов
+                    async with get_rate_limiter("pollinations").acquire() as permit:
+                        resp = await client.get(api_url, timeout=timeout)
+                        if resp.status_code in (429, 503):
+                            permit.mark_overloaded()
                 
                 if resp.status_code != 200:
-                    error_msg = f"Pollinations.ai вернул статус {resp.status_code}"
-                    if attempt < max_retries:
-                        logger.warning(f"⚠️ {error_msg}, повтор через {DEFAULT_BACKOFF * (2 ** attempt):.1f}с...")
-                        await asyncio.sleep(DEFAULT_BACKOFF * (2 ** attempt))
-                        continue
-                    else:
-                        raise HTTPException(
-                            status_code=500,
-                            detail=error_msg
-                        )
+                    raise _ProviderStatusError(resp.status_code)
                 
                 # Проверяем, что это изображение
                 content_type = resp.headers.get("content-type", "")
@@ -170,21 +178,62 @@ async def generate_img2img(
                         status_code=500,
                         detail="Pollinations.ai вернул пустое изображение"
                     )
-                
-                logger.info(f"✅ Изображение успешно сгенерировано через Pollinations.ai img2img, размер: {len(image_bytes)} байт")
                 return image_bytes
+            
+            try:
+                # При медленном ответе (HEDGE_ENABLED) параллельно отправляется запрос с другим seed
+                image_bytes = await run_hedged("pollinations_img2img", fetch, int(params["seed"]))
+            except _ProviderStatusError as e:
+                if e.status_code == 503:
+                    # Сервис временно недоступен
+                    if attempt < max_retries:
+                        wait_time = retry_delay(DEFAULT_BACKOFF * (2 ** attempt))
+                        logger.warning(f"⚠️ Pollinations.ai недоступен (503), повтор через {wait_time:.1f}с...")
+                        await asyncio.sleep(wait_time)
+                        continue
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Pollinations.ai временно недоступен"
+                    )
+                
+                if e.status_code == 429:
+                    # Rate limit
+                    if attempt < max_retries:
+                        wait_time = retry_delay(DEFAULT_BACKOFF * (2 ** attempt))
+                        logger.warning(f"⚠️ Rate limit (429), повтор через {wait_time:.1f}с...")
+                        await asyncio.sleep(wait_time)
+                        continue
+                    raise HTTPException(
+                        status_code=429,
+                        detail="Превышен лимит запросов к Pollinations.ai"
+                    )
+                
+                error_msg = f"Pollinations.ai вернул статус {e.status_code}"
+                if attempt < max_retries:
+                    logger.warning(f"⚠️ {error_msg}, повтор через {DEFAULT_BACKOFF * (2 ** attempt):.1f}с...")
+                    await asyncio.sleep(DEFAULT_BACKOFF * (2 ** attempt))
+                    continue
+                raise HTTPException(
+                    status_code=500,
+                    detail=error_msg
+                )
+            
+            logger.info(f"✅ Изображение успешно сгенерировано через Pollinations.ai img2img, размер: {len(image_bytes)} байт")
+            if cache_key:
+                await store_cached_image(cache_key, image_bytes)
+            return image_bytes
                 
         except httpx.TimeoutException:
             last_error = "Таймаут при запросе к Pollinations.ai"
             if attempt < max_retries:
-                wait_time = DEFAULT_BACKOFF * (2 ** attempt)
+                wait_time = retry_delay(DEFAULT_BACKOFF * (2 ** attempt))
                 logger.warning(f"⚠️ {last_error}, повтор через {wait_time:.1f}с...")
                 await asyncio.sleep(wait_time)
                 continue
         except httpx.RequestError as e:
             last_error = f"Ошибка сети при запросе к Pollinations.ai: {str(e)}"
             if attempt < max_retries:
-                wait_time = DEFAULT_BACKOFF * (2 ** attempt)
+                wait_time = retry_delay(DEFAULT_BACKOFF * (2 ** attempt))
                 logger.warning(f"⚠️ {last_error}, повтор через {wait_time:.1f}с...")
                 await asyncio.sleep(wait_time)
                 continue
@@ -194,7 +243,7 @@ async def generate_img2img(
             last_error = f"Неожиданная ошибка: {str(e)}"
             logger.error(f"❌ {last_error}", exc_info=True)
             if attempt < max_retries:
-                wait_time = DEFAULT_BACKOFF * (2 ** attempt)
+                wait_time = retry_delay(DEFAULT_BACKOFF * (2 ** attempt))
                 logger.warning(f"⚠️ Повтор через {wait_time:.1f}с...")
                 await asyncio.sleep(wait_time)
                 continue
@@ -215,7 +264,9 @@ async def generate_with_verification(
     similarity_threshold: float = 0.60,
     seed: Optional[int] = None,
     is_cover: bool = False,
-    reference_image_path: Optional[str] = None
+    reference_image_path: Optional[str] = None,
+    use_cache: bool = True,
+    concurrency: Optional[int] = None
 ) -> Tuple[bytes, dict]:
     """
     Сгенерировать изображение с верификацией лица и автоматической перегенерацией при плохом совпадении.
@@ -236,6 +287,10 @@ async def generate_with_verification(
         seed: Начальный seed (опционально)
         is_cover: Флаг, что это обложка (использует двухэтапный пайплайн)
         reference_image_path: Путь к reference.png для face swap (только для обложки)
+        use_cache: Использовать кэш изображений — последовательность seed выводится из промпта,
+            reference и embedding профиля, поэтому повторный запуск попадает в кэш
+        concurrency: Сколько кандидатов генерировать одновременно (по умолчанию FACE_VERIFY_CONCURRENCY);
+            при > 1 кандидаты проверяются по мере готовности, остальные отменяются после первого успешного
     
     Returns:
         Tuple[bytes, dict]:
@@ -243,6 +298,7 @@ async def generate_with_verification(
             - dict: метаданные (face_similarity, face_verified, attempts, best_similarity)
     """
     from .face_service import verify_face
+    from .cpu_pool import run_cpu_bound
     import asyncio
     import random
     
@@ -250,7 +306,33 @@ async def generate_with_verification(
     best_similarity = 0.0
     attempts = 0
     
-    current_seed = seed if seed else random.randint(1, 1000000)
+    # При использовании кэша seed попыток детерминированы; новый профиль лица (embedding) — новые seed
+    if is_cache_enabled(use_cache):
+        import hashlib
+        rng = random.Random(deterministic_seed(make_cache_key(
+            prompt=normalize_prompt(prompt), image=reference_image_url, strength=str(strength),
+            embedding=hashlib.sha256(mean_embedding_bytes or b"").hexdigest(), is_cover=is_cover
+        )))
+    else:
+        rng = random.Random()
+    
+    current_seed = seed if seed else rng.randint(1, 1000000)
+    
+    if concurrency is None:
+        concurrency = FACE_VERIFY_CONCURRENCY
+    if concurrency > 1 and max_retries > 1:
+        seeds = [current_seed] + [rng.randint(1, 1000000) for _ in range(max_retries - 1)]
+        return await _generate_with_verification_concurrent(
+            prompt=prompt,
+            reference_image_url=reference_image_url,
+            mean_embedding_bytes=mean_embedding_bytes,
+            strength=strength,
+            seeds=seeds,
+            similarity_threshold=similarity_threshold,
+            reference_image_path=reference_image_path if is_cover else None,
+            use_cache=use_cache,
+            concurrency=concurrency
+        )
     
     # Для обложки используем двухэтапный пайплайн: img2img + face swap
     if is_cover and reference_image_path:
@@ -267,7 +349,8 @@ async def generate_with_verification(
                     reference_image_url=reference_image_url,
                     strength=strength,
                     seed=current_seed,
-                    max_retries=1
+                    max_retries=1,
+                    use_cache=use_cache
                 )
                 
                 # ЭТАП 2: Применяем face swap с reference.png
@@ -278,7 +361,8 @@ async def generate_with_verification(
                 )
                 
                 # ЭТАП 3: Верифицируем лицо после face swap
-                verified, similarity = verify_face(
+                verified, similarity = await run_cpu_bound(
+                    verify_face,
                     mean_embedding_bytes=mean_embedding_bytes,
                     generated_img_bytes=swapped_bytes,
                     threshold=similarity_threshold
@@ -309,13 +393,13 @@ async def generate_with_verification(
                 
                 # Если не последняя попытка, меняем seed для следующей генерации
                 if attempt_num < max_retries - 1:
-                    current_seed = random.randint(1, 1000000)
+                    current_seed = rng.randint(1, 1000000)
                     await asyncio.sleep(1.0)  # Небольшая задержка между попытками
             
             except Exception as e:
                 logger.error(f"❌ Ошибка при попытке {attempt_num + 1} для обложки: {e}", exc_info=True)
                 if attempt_num < max_retries - 1:
-                    current_seed = random.randint(1, 1000000)
+                    current_seed = rng.randint(1, 1000000)
                     await asyncio.sleep(1.0)
                 continue
         
@@ -359,11 +443,13 @@ async def generate_with_verification(
                 reference_image_url=reference_image_url,
                 strength=strength,
                 seed=current_seed,
-                max_retries=1  # Внутри уже есть retry логика
+                max_retries=1,  # Внутри уже есть retry логика
+                use_cache=use_cache
             )
             
             # Верифицируем лицо
-            verified, similarity = verify_face(
+            verified, similarity = await run_cpu_bound(
+                verify_face,
                 mean_embedding_bytes=mean_embedding_bytes,
                 generated_img_bytes=generated_bytes,
                 threshold=similarity_threshold
@@ -392,13 +478,13 @@ async def generate_with_verification(
             
             # Если не последняя попытка, меняем seed для следующей генерации
             if attempt_num < max_retries - 1:
-                current_seed = random.randint(1, 1000000)
+                current_seed = rng.randint(1, 1000000)
                 await asyncio.sleep(1.0)  # Небольшая задержка между попытками
         
         except Exception as e:
             logger.error(f"❌ Ошибка при попытке {attempt_num + 1}: {e}", exc_info=True)
             if attempt_num < max_retries - 1:
-                current_seed = random.randint(1, 1000000)
+                current_seed = rng.randint(1, 1000000)
                 await asyncio.sleep(1.0)
             continue
     
@@ -422,3 +508,120 @@ async def generate_with_verification(
         "face_swap_applied": False
     }
 
+
+async def _generate_with_verification_concurrent(
+    prompt: str,
+    reference_image_url: str,
+    mean_embedding_bytes: bytes,
+    strength: float,
+    seeds: List[int],
+    similarity_threshold: float,
+    reference_image_path: Optional[str],
+    use_cache: bool,
+    concurrency: int
+) -> Tuple[bytes, dict]:
+    """
+    Параллельный вариант generate_with_verification: до `concurrency` кандидатов (по одному на seed)
+    генерируются одновременно и проверяются по мере готовности. Первый кандидат, прошедший порог
+    (для обложки с face swap — similarity >= 0.90), возвращается сразу, остальные запросы отменяются.
+    Если досрочной остановки не было, возвращается лучший кандидат — как в последовательном режиме.
+    """
+    from .face_service import verify_face
+    from .cpu_pool import run_cpu_bound
+
+    face_swap = reference_image_path is not None
+    stop_similarity = COVER_EARLY_STOP_SIMILARITY if face_swap else similarity_threshold
+
+    async def candidate(candidate_seed: int) -> Tuple[bytes, bool, float]:
+        generated_bytes = await generate_img2img(
+            prompt=prompt,
+            reference_image_url=reference_image_url,
+            strength=strength,
+            seed=candidate_seed,
+            max_retries=1,
+            use_cache=use_cache
+        )
+        if face_swap:
+            from .face_swap_service import apply_face_swap_with_reference
+            generated_bytes = await apply_face_swap_with_reference(
+                generated_image_bytes=generated_bytes,
+                reference_image_path=reference_image_path
+            )
+        verified, similarity = await run_cpu_bound(
+            verify_face, mean_embedding_bytes, generated_bytes, similarity_threshold
+        )
+        return generated_bytes, verified, similarity
+
+    logger.info(
+        f"🎯 Параллельная генерация {len(seeds)} кандидатов (одновременно {concurrency}, "
+        f"face_swap={face_swap}, порог досрочной остановки {stop_similarity:.2f})"
+    )
+
+    best_image = None
+    best_similarity = 0.0
+    attempts = 0
+    next_seed = 0
+    running: Dict[asyncio.Task, int] = {}
+
+    def launch():
+        nonlocal next_seed
+        while len(running) < concurrency and next_seed < len(seeds):
+            task = asyncio.create_task(candidate(seeds[next_seed]))
+            running[task] = seeds[next_seed]
+            next_seed += 1
+
+    launch()
+    try:
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                candidate_seed = running.pop(task)
+                attempts += 1
+                try:
+                    generated_bytes, verified, similarity = task.result()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка кандидата seed={candidate_seed}: {e}", exc_info=True)
+                    continue
+
+                logger.info(
+                    f"🔁 Кандидат seed={candidate_seed}: similarity={similarity:.3f}, "
+                    f"threshold={similarity_threshold}, verified={verified}"
+                )
+                if similarity > best_similarity:
+                    best_similarity = similarity
+                    best_image = generated_bytes
+
+                if verified and similarity >= stop_similarity:
+                    logger.info(f"✅ Кандидат seed={candidate_seed} прошёл верификацию ({similarity:.3f}), отменяем остальные")
+                    return generated_bytes, {
+                        "face_similarity": similarity,
+                        "face_verified": True,
+                        "attempts": attempts,
+                        "best_similarity": similarity,
+                        "face_swap_applied": face_swap
+                    }
+            launch()
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    if best_image is None:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Не удалось сгенерировать изображение с приемлемым сходством лица после {len(seeds)} попыток"
+        )
+
+    final_verified = best_similarity >= similarity_threshold
+    logger.warning(
+        f"⚠️ Досрочной остановки не было, возвращаем лучшего кандидата "
+        f"(similarity={best_similarity:.3f}, verified={final_verified})"
+    )
+    return best_image, {
+        "face_similarity": best_similarity,
+        "face_verified": final_verified,
+        "attempts": attempts,
+        "best_similarity": best_similarity,
+        "face_swap_applied": face_swap
+    }
@@ -5,6 +5,17 @@
 """
 import logging
 import httpx
+from .http_clients import http_client
+from .rate_limiter import get_rate_limiter, retry_delay
+from .request_hedging import run_hedged
+from .image_cache import (
+    deterministic_seed,
+    get_cached_image,
+    is_cache_enabled,
+    make_cache_key,
+    normalize_prompt,
+    store_cached_image,
+)
 from io import BytesIO
 from fastapi import HTTPException
 from PIL import Image, ImageDraw, ImageFont
@@ -18,7 +29,7 @@ logger = logging.getLogger(__name__)
 POLLINATIONS_API_BASE_URL = "https://image.pollinations.ai/prompt"
 
 
-async def generate_raw_image(prompt: str, max_retries: int = 2, is_cover: bool = False) -> bytes:
+async def generate_raw_image(prompt: str, max_retries: int = 2, is_cover: bool = False, use_cache: bool = True) -> bytes:
     """
     Генерирует изображение через Pollinations.ai API.
     Для повышения качества сначала переводит промпт с русского на английский через Gemini.
@@ -27,11 +38,23 @@ async def generate_raw_image(prompt: str, max_retries: int = 2, is_cover: bool =
         prompt: Промпт на русском языке
         max_retries: Максимальное количество попыток при ошибке
         is_cover: Флаг, что это промпт для обложки (требует особой обработки)
+        use_cache: Использовать кэш изображений (seed выводится из промпта);
+            False — получить новый вариант со случайным seed
     
     Returns:
         bytes: Байты изображения (JPEG/PNG)
     """
     import re  # Импортируем re в начале функции
+    cache_key = None
+    if is_cache_enabled(use_cache):
+        cache_key = make_cache_key(
+            provider="pollinations", model="flux", width=1024, height=1024,
+            prompt=normalize_prompt(prompt), is_cover=is_cover
+        )
+        cached = await get_cached_image(cache_key)
+        if cached:
+            return cached
+    
     last_error = None
     for attempt in range(max_retries + 1):
         try:
@@ -212,8 +235,10 @@ async def generate_raw_image(prompt: str, max_retries: int = 2, is_cover: bool =
             
             # Параметры для генерации изображения
             # Используем случайный seed для каждого изображения для разнообразия
+            # (при использовании кэша seed выводится из ключа и номера попытки: результат воспроизводим,
+            # а повтор после неудачного ответа не запрашивает тот же seed; в кэш попадает только удачная попытка)
             import random
-            random_seed = random.randint(1, 1000000)
+            random_seed = deterministic_seed(cache_key, attempt) if cache_key else random.randint(1, 1000000)
             params = {
                 "width": 1024,
                 "height": 1024,
@@ -228,23 +253,22 @@ async def generate_raw_image(prompt: str, max_retries: int = 2, is_cover: bool =
             
             timeout = httpx.Timeout(300.0, connect=10.0, read=300.0)  # 5 минут таймаут
             
-            async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-                # Отправляем GET запрос
-                logger.info(f"📤 Отправка запроса в Pollinations.ai API...")
-                resp = await client.get(api_url, params=params)
+            async def fetch(request_seed: int) -> bytes:
+                async with http_client("pollinations") as client:
+                    # Отправляем GET запрос
+                    logger.info(f"📤 Отправка запроса в Pollinations.ai API (seed={request_seed})...")
+                    # Общий для процесса ограничитель: темп запросов и окно одновременных запросов
+                    async with get_rate_limiter("pollinations").acquire() as permit:
+                        resp = await client.get(api_url, params={**params, "seed": request_seed}, timeout=timeout)
+                        if resp.status_code in (429, 503):
+                            permit.mark_overloaded()
                 
                 if resp.status_code == 503:
-                    # Сервис недоступен, ждём и повторяем
-                    if attempt < max_retries:
-                        wait_time = 10 * (attempt + 1)  # Экспоненциальная задержка
-                        logger.warning(f"⚠️ Pollinations.ai сервис недоступен, ждём {wait_time} секунд...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    else:
-                        raise HTTPException(
-                            status_code=503,
-                            detail="Pollinations.ai сервис недоступен. Попробуйте позже."
-                        )
+                    # Сервис недоступен — повтор с задержкой выполняется ниже (except HTTPException)
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Pollinations.ai сервис недоступен. Попробуйте позже."
+                    )
                 
                 if resp.status_code not in (200, 201, 202):
                     error_text = resp.text[:500] if resp.text else "Unknown error"
@@ -270,15 +294,21 @@ async def generate_raw_image(prompt: str, max_retries: int = 2, is_cover: bool =
                         status_code=500,
                         detail="Pollinations.ai вернул пустое изображение"
                     )
-                
-                logger.info(f"✅ Изображение успешно сгенерировано через Pollinations.ai, размер: {len(image_bytes)} байт")
                 return image_bytes
             
+            # При медленном ответе (HEDGE_ENABLED) параллельно отправляется запрос с другим seed
+            image_bytes = await run_hedged("pollinations", fetch, random_seed)
+            
+            logger.info(f"✅ Изображение успешно сгенерировано через Pollinations.ai, размер: {len(image_bytes)} байт")
+            if cache_key:
+                await store_cached_image(cache_key, image_bytes)
+            return image_bytes
+            
         except HTTPException as e:
             # Для 503 (сервис недоступен) делаем retry
             if e.status_code == 503 and attempt < max_retries:
-                wait_time = 10 * (attempt + 1)
-                logger.warning(f"⚠️ Попытка {attempt + 1}/{max_retries + 1} не удалась: {e.detail}, ждём {wait_time} секунд...")
+                wait_time = retry_delay(10 * (attempt + 1))
+                logger.warning(f"⚠️ Попытка {attempt + 1}/{max_retries + 1} не удалась: {e.detail}, ждём {wait_time:.0f} секунд...")
                 await asyncio.sleep(wait_time)
                 last_error = e
                 continue
@@ -0,0 +1,196 @@
+"""
+Дисковый кэш подготовленных для печати изображений страниц (после CMYK/skin-tone обработки).
+
+Одно и то же финальное изображение попадает в PDF много раз: /finalize/render после каждой
+правки, payments.confirm → generate_pdf_for_book, regenerate_cover_and_pdf.py и другие
+скрипты. Результат обработки сохраняется на диск по ключу из pdf_service (SHA-256 исходного
+изображения, ICC профиль и способ конвертации, preset skin-tone, версия pipeline, параметры
+встраивания), поэтому повторный рендер в любом процессе — в основном сборка canvas.
+
+Размер кэша ограничен PRINT_ASSET_CACHE_MAX_MB (LRU-вытеснение). Если включён
+PRINT_ASSET_PREWARM, изображение обрабатывается в фоне сразу после генерации финальной
+иллюстрации, и к оплате книги ассеты уже готовы.
+"""
+import asyncio
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from .image_cache import IMAGE_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+PRINT_ASSET_CACHE_ENABLED = os.getenv("PRINT_ASSET_CACHE_ENABLED", "true").lower() == "true"
+PRINT_ASSET_CACHE_DIR = os.getenv(
+    "PRINT_ASSET_CACHE_DIR",
+    os.path.join(os.path.dirname(IMAGE_CACHE_DIR.rstrip("/")), "print_assets")
+)
+PRINT_ASSET_CACHE_MAX_MB = int(os.getenv("PRINT_ASSET_CACHE_MAX_MB", "1024"))
+PRINT_ASSET_PREWARM = os.getenv("PRINT_ASSET_PREWARM", "true").lower() == "true"
+
+_lock = threading.Lock()
+# key -> размер файла; порядок — от давно использованных к недавно использованным
+_index: Optional["OrderedDict[str, int]"] = None
+_total_bytes = 0
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "prewarmed": 0, "prewarm_failed": 0}
+# Ссылки на фоновые задачи прогрева, чтобы их не собрал GC до завершения
+_prewarm_tasks: Set["asyncio.Task"] = set()
+
+
+def _path_for(key: str) -> str:
+    return os.path.join(PRINT_ASSET_CACHE_DIR, key[:2], f"{key}.jpg")
+
+
+def _load_index() -> "OrderedDict[str, int]":
+    """
+    Построить индекс по файлам на диске (один раз на процесс), порядок — по mtime.
+    Обход каталога выполняется без _lock, под блокировкой индекс только присваивается.
+    """
+    global _index, _total_bytes
+    if _index is not None:
+        return _index
+    entries = []
+    if os.path.isdir(PRINT_ASSET_CACHE_DIR):
+        for root, _, files in os.walk(PRINT_ASSET_CACHE_DIR):
+            for name in files:
+                if not name.endswith(".jpg"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name[:-4], st.st_size))
+    entries.sort()
+    with _lock:
+        if _index is None:
+            _index = OrderedDict((key, size) for _, key, size in entries)
+            _total_bytes = sum(_index.values())
+            if _index:
+                logger.info(f"✓ Кэш печатных ассетов: {len(_index)} файлов, {_total_bytes / 1024 / 1024:.1f} МБ")
+    return _index
+
+
+def _evict_locked(index: "OrderedDict[str, int]") -> List[str]:
+    """Убрать из индекса давно не использованные ключи сверх лимита; файлы удаляет вызывающий вне _lock."""
+    global _total_bytes
+    limit = PRINT_ASSET_CACHE_MAX_MB * 1024 * 1024
+    evicted = []
+    while _total_bytes > limit and index:
+        key, size = index.popitem(last=False)
+        _total_bytes -= size
+        _stats["evictions"] += 1
+        evicted.append(key)
+    return evicted
+
+
+def get_print_asset(key: str) -> Optional[bytes]:
+    """Вернуть подготовленное изображение из кэша или None (ошибки кэша не прерывают рендер)."""
+    global _total_bytes
+    if not PRINT_ASSET_CACHE_ENABLED:
+        return None
+    path = _path_for(key)
+    try:
+        index = _load_index()
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # Файл мог удалить другой процесс, использующий тот же каталог
+            with _lock:
+                size = index.pop(key, None)
+                if size:
+                    _total_bytes -= size
+                _stats["misses"] += 1
+            return None
+        with _lock:
+            if key not in index:
+                index[key] = len(data)
+                _total_bytes += len(data)
+            index.move_to_end(key)
+            _stats["hits"] += 1
+        return data
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка чтения кэша печатных ассетов: {e}")
+        return None
+
+
+def store_print_asset(key: str, data: bytes):
+    """Сохранить подготовленное изображение в кэш (ошибки кэша не прерывают рендер)."""
+    global _total_bytes
+    if not PRINT_ASSET_CACHE_ENABLED or not data:
+        return
+    path = _path_for(key)
+    try:
+        index = _load_index()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with _lock:
+            _total_bytes -= index.pop(key, 0)
+            index[key] = len(data)
+            _total_bytes += len(data)
+            _stats["stores"] += 1
+            evicted = _evict_locked(index)
+        for evicted_key in evicted:
+            try:
+                os.remove(_path_for(evicted_key))
+            except OSError:
+                pass
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось сохранить печатный ассет в кэш: {e}")
+
+
+def schedule_prewarm(image_url: str, scene_order: int):
+    """
+    Подготовить печатный ассет финального изображения в фоне (в пуле CPU-операций).
+
+    Обложка (order=0) в PDF встраивается без обработки, поэтому не прогревается.
+    Вызывается из async-кода сразу после сохранения финального изображения сцены.
+    """
+    if not (PRINT_ASSET_CACHE_ENABLED and PRINT_ASSET_PREWARM) or not image_url or scene_order == 0:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(_prewarm(image_url, scene_order))
+    _prewarm_tasks.add(task)
+    task.add_done_callback(_prewarm_tasks.discard)
+
+
+async def _prewarm(image_url: str, scene_order: int):
+    from .cpu_pool import run_cpu_bound
+    from .pdf_service import prewarm_page_image
+
+    try:
+        ok = await run_cpu_bound(prewarm_page_image, image_url)
+    except Exception as e:
+        ok = False
+        logger.warning(f"⚠️ Ошибка прогрева печатного ассета для сцены order={scene_order}: {e}")
+    with _lock:
+        _stats["prewarmed" if ok else "prewarm_failed"] += 1
+    if ok:
+        logger.info(f"🔥 Печатный ассет сцены order={scene_order} подготовлен заранее")
+
+
+def get_print_asset_cache_stats() -> Dict[str, Any]:
+    """Метрики кэша: попадания/промахи, размер, прогрев."""
+    with _lock:
+        files = len(_index) if _index is not None else None
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "enabled": PRINT_ASSET_CACHE_ENABLED,
+            "prewarm": PRINT_ASSET_PREWARM,
+            "dir": PRINT_ASSET_CACHE_DIR,
+            "max_mb": PRINT_ASSET_CACHE_MAX_MB,
+            "size_mb": round(_total_bytes / 1024 / 1024, 1),
+            "files": files,
+            "prewarm_pending": len(_prewarm_tasks),
+            "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+            **_stats,
+        }
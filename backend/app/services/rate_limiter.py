@@ -0,0 +1,206 @@
+"""
+Адаптивный ограничитель запросов к внешним сервисам генерации (Pollinations.ai).
+
+Сочетает token bucket (не больше RATE запросов в секунду с запасом BURST) и окно
+одновременных запросов с AIMD-регулированием: окно растёт на ~1 за каждое «окно» успешных
+ответов и уменьшается вдвое при 429/503/таймауте (не чаще раза в COOLDOWN секунд).
+Все книги процесса проходят через один ограничитель, поэтому при перегрузке сервиса
+они замедляются согласованно, а не повторяют запросы одновременно.
+
+Ограничитель действует в пределах процесса (API или воркера).
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_OVERLOAD = "overload"
+OUTCOME_NEUTRAL = "neutral"
+
+
+class RatePermit:
+    """Разрешение на один запрос; вызывающий код отмечает перегрузку сервиса (429/503)."""
+
+    def __init__(self):
+        self.outcome: Optional[str] = None
+
+    def mark_overloaded(self):
+        self.outcome = OUTCOME_OVERLOAD
+
+    def mark_neutral(self):
+        """Ошибка, не связанная с нагрузкой (например, 400) — окно не меняется."""
+        self.outcome = OUTCOME_NEUTRAL
+
+
+class AdaptiveRateLimiter:
+    """Token bucket + AIMD-окно одновременных запросов."""
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        min_window: int,
+        max_window: int,
+        initial_window: int,
+        decrease_factor: float = 0.5,
+        cooldown: float = 5.0
+    ):
+        self.name = name
+        self.rate = max(rate, 0.001)
+        self.burst = max(burst, 1)
+        self.min_window = max(min_window, 1)
+        self.max_window = max(max_window, self.min_window)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self._window = float(min(max(initial_window, self.min_window), self.max_window))
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._in_flight = 0
+        self._waiting = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._condition_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Метрики
+        self._requests_total = 0
+        self._overloads_total = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._condition_loop is not loop:
+            self._condition = asyncio.Condition()
+            self._condition_loop = loop
+        return self._condition
+
+    def _refill(self, now: float):
+        self._tokens = min(float(self.burst), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def _acquire(self):
+        started = time.monotonic()
+        condition = self._get_condition()
+        self._waiting += 1
+        try:
+            async with condition:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    window_free = self._in_flight < int(self._window)
+                    if window_free and self._tokens >= 1:
+                        self._tokens -= 1
+                        self._in_flight += 1
+                        break
+                    # Окно свободно — ждём следующий токен, иначе ждём освобождения слота
+                    timeout = (1 - self._tokens) / self.rate if window_free else None
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self._waiting -= 1
+
+        waited = time.monotonic() - started
+        self._requests_total += 1
+        self._wait_total += waited
+        self._wait_last = waited
+        self._wait_max = max(self._wait_max, waited)
+        if waited > 5:
+            logger.info(f"⏳ [{self.name}] Запрос ждал в очереди {waited:.1f}с (окно={int(self._window)}, в работе={self._in_flight})")
+
+    async def _release(self, outcome: str):
+        condition = self._get_condition()
+        async with condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if outcome == OUTCOME_SUCCESS:
+                # Аддитивное увеличение: ~+1 за каждое окно успешных запросов
+                self._window = min(float(self.max_window), self._window + 1.0 / self._window)
+            elif outcome == OUTCOME_OVERLOAD:
+                self._overloads_total += 1
+                if now - self._last_decrease >= self.cooldown:
+                    old_window = self._window
+                    # Мультипликативное уменьшение
+                    self._window = max(float(self.min_window), self._window * self.decrease_factor)
+                    self._last_decrease = now
+                    logger.warning(f"⚠️ [{self.name}] Сервис перегружен, окно запросов {old_window:.1f} → {self._window:.1f}")
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def acquire(self):
+        """
+        Дождаться разрешения на запрос.
+
+        Таймаут внутри блока считается перегрузкой, другие исключения не меняют окно,
+        успешный выход из блока увеличивает окно.
+        """
+        await self._acquire()
+        permit = RatePermit()
+        try:
+            yield permit
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            permit.mark_overloaded()
+            raise
+        except BaseException:
+            if permit.outcome is None:
+                permit.mark_neutral()
+            raise
+        finally:
+            await self._release(permit.outcome or OUTCOME_SUCCESS)
+
+    def stats(self) -> Dict[str, float]:
+        """Метрики ограничителя: размер окна, очередь и время ожидания."""
+        return {
+            "window": round(self._window, 2),
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "tokens": round(self._tokens, 2),
+            "rate_per_second": self.rate,
+            "requests_total": self._requests_total,
+            "overloads_total": self._overloads_total,
+            "queue_wait_avg_ms": round(self._wait_total / self._requests_total * 1000, 1) if self._requests_total else 0.0,
+            "queue_wait_max_ms": round(self._wait_max * 1000, 1),
+            "queue_wait_last_ms": round(self._wait_last * 1000, 1),
+        }
+
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+
+
+def get_rate_limiter(name: str = "pollinations") -> AdaptiveRateLimiter:
+    """Получить общий для процесса ограничитель сервиса (настройки из переменных окружения)."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        prefix = name.upper()
+        limiter = AdaptiveRateLimiter(
+            name=name,
+            rate=float(os.getenv(f"{prefix}_RATE_LIMIT_RPS", "1.0")),
+            burst=int(os.getenv(f"{prefix}_RATE_LIMIT_BURST", "3")),
+            min_window=int(os.getenv(f"{prefix}_MIN_CONCURRENCY", "1")),
+            max_window=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "8")),
+            initial_window=int(os.getenv(f"{prefix}_INITIAL_CONCURRENCY", "2")),
+        )
+        _limiters[name] = limiter
+    return limiter
+
+
+def get_rate_limiter_stats() -> Dict[str, Dict[str, float]]:
+    """Метрики всех созданных ограничителей."""
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
+
+
+def retry_delay(base_seconds: float) -> float:
+    """Задержка перед повтором со случайным разбросом, чтобы повторы разных книг не совпадали."""
+    return base_seconds * random.uniform(0.5, 1.5)
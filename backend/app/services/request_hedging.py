@@ -0,0 +1,163 @@
+"""
+Хеджирование медленных запросов генерации изображений (Pollinations.ai).
+
+У Pollinations.ai длинный хвост задержек: большинство изображений готово за десятки секунд,
+но отдельные запросы висят до таймаута (300с). В режиме хеджирования, если запрос не ответил
+за HEDGE_PERCENTILE наблюдаемых задержек, параллельно отправляется второй запрос с другим seed.
+Побеждает первое валидное изображение, проигравший запрос отменяется.
+
+Дополнительная нагрузка на провайдера ограничена: не больше HEDGE_MAX_EXTRA дополнительных
+запросов на изображение, хедж запускается только для самых медленных (1 - HEDGE_PERCENTILE)
+запросов и не запускается, если в ограничителе запросов уже есть очередь.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from .rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "20"))
+# Задержка до хеджа, пока наблюдений недостаточно для перцентиля
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "120"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MAX_EXTRA = int(os.getenv("HEDGE_MAX_EXTRA", "1"))
+
+_LATENCY_WINDOW = 200
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных запросов."""
+
+    def __init__(self, size: int = _LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self.hedges_launched = 0
+        self.hedge_wins = 0
+        self.requests_total = 0
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(p * len(ordered)))
+        return ordered[index]
+
+    def hedge_delay(self) -> float:
+        observed = self.percentile(HEDGE_PERCENTILE)
+        if observed is None:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, observed)
+
+    def stats(self) -> Dict[str, float]:
+        p50 = self.percentile(0.5)
+        p90 = self.percentile(0.9)
+        p99 = self.percentile(0.99)
+        return {
+            "samples": len(self._samples),
+            "latency_p50_s": round(p50, 1) if p50 is not None else None,
+            "latency_p90_s": round(p90, 1) if p90 is not None else None,
+            "latency_p99_s": round(p99, 1) if p99 is not None else None,
+            "hedge_delay_s": round(self.hedge_delay(), 1),
+            "requests_total": self.requests_total,
+            "hedges_launched": self.hedges_launched,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    tracker = _trackers.get(name)
+    if tracker is None:
+        tracker = LatencyTracker()
+        _trackers[name] = tracker
+    return tracker
+
+
+def get_hedging_stats() -> Dict[str, Dict[str, float]]:
+    return {name: {"enabled": HEDGE_ENABLED, **tracker.stats()} for name, tracker in _trackers.items()}
+
+
+def hedge_seed(seed: int, index: int) -> int:
+    """Seed дополнительного запроса: детерминирован (для кэша), но отличается от основного."""
+    return (seed * 7919 + index * 104729) % 1000000 + 1
+
+
+async def _timed(request: Callable[[int], Awaitable[bytes]], seed: int):
+    started = time.monotonic()
+    result = await request(seed)
+    return result, time.monotonic() - started
+
+
+async def run_hedged(
+    name: str,
+    request: Callable[[int], Awaitable[bytes]],
+    seed: int,
+    enabled: Optional[bool] = None
+) -> bytes:
+    """
+    Выполнить запрос request(seed) с хеджированием.
+
+    request должен вернуть валидное изображение или выбросить исключение — тогда ждём
+    оставшиеся запросы. Если все запросы завершились ошибкой, выбрасывается ошибка основного.
+    """
+    tracker = get_latency_tracker(name)
+    tracker.requests_total += 1
+    if enabled is None:
+        enabled = HEDGE_ENABLED
+
+    if not enabled or HEDGE_MAX_EXTRA <= 0:
+        result, latency = await _timed(request, seed)
+        tracker.record(latency)
+        return result
+
+    primary = asyncio.create_task(_timed(request, seed))
+    pending = {primary}
+    hedges = 0
+    first_error: Optional[BaseException] = None
+    try:
+        while pending:
+            can_hedge = hedges < HEDGE_MAX_EXTRA
+            timeout = tracker.hedge_delay() if can_hedge else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                try:
+                    result, latency = task.result()
+                except Exception as e:
+                    if first_error is None or task is primary:
+                        first_error = e
+                    continue
+                tracker.record(latency)
+                if task is not primary:
+                    tracker.hedge_wins += 1
+                    logger.info(f"🏁 [{name}] Дополнительный запрос обогнал основной ({latency:.1f}с)")
+                return result
+
+            if not done and can_hedge:
+                # Основной запрос медленнее перцентиля — хеджируем, если провайдер не перегружен
+                if get_rate_limiter("pollinations").stats()["waiting"] > 0:
+                    hedges = HEDGE_MAX_EXTRA
+                    continue
+                hedges += 1
+                tracker.hedges_launched += 1
+                logger.info(f"⏱️ [{name}] Запрос идёт дольше {timeout:.0f}с, отправляем дополнительный (seed={hedge_seed(seed, hedges)})")
+                pending.add(asyncio.create_task(_timed(request, hedge_seed(seed, hedges))))
+
+        # Все запросы завершились ошибкой — её обработает retry вызывающего кода
+        raise first_error
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -9,37 +9,11 @@ from typing import Tuple, Optional
 import cv2
 
 from .cmyk_presets import get_preset, DEFAULT_PRESET
-from .face_service import _get_face_analyzer
+from ..print.color_management import convert_rgb_to_cmyk
+from ..print.skin_tone_clamp import clamp_and_blend, preset_bounds
 
 logger = logging.getLogger(__name__)
 
-# ICC профиль для CMYK конвертации (ISO Coated v2 ECI)
-ICC_PROFILE_PATH = None  # Будет установлен при первом использовании
-
-
-def _get_icc_profile_path() -> Optional[str]:
-    """
-    Возвращает путь к ICC профилю ISO Coated v2 ECI.
-    Если профиль не найден, возвращает None (используется стандартная конвертация).
-    """
-    global ICC_PROFILE_PATH
-    
-    if ICC_PROFILE_PATH is not None:
-        return ICC_PROFILE_PATH
-    
-    import os
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    icc_path = os.path.join(script_dir, "..", "assets", "icc", "ISOcoated_v2_300_eci.icc")
-    
-    if os.path.exists(icc_path):
-        ICC_PROFILE_PATH = icc_path
-        logger.info(f"✓ ICC профиль найден: {icc_path}")
-        return icc_path
-    else:
-        logger.warning(f"⚠️ ICC профиль не найден: {icc_path}. Используется стандартная CMYK конвертация.")
-        ICC_PROFILE_PATH = ""  # Пустая строка означает "не найден"
-        return None
-
 
 def _expand_bbox(bbox: Tuple[int, int, int, int], width: int, height: int, 
                  expand_w: float = 0.12, expand_h: float = 0.18) -> Tuple[int, int, int, int]:
@@ -103,39 +77,11 @@ def _create_soft_mask(bbox: Tuple[int, int, int, int], width: int, height: int,
     return mask_soft
 
 
-def _clamp_cmyk_pixel(c: float, m: float, y: float, k: float, preset: dict) -> Tuple[float, float, float, float]:
-    """
-    Ограничивает CMYK значения пикселя по preset'у.
-    
-    Args:
-        c, m, y, k: CMYK значения (0-100)
-        preset: Preset с диапазонами CMYK
-    
-    Returns:
-        Tuple[float, float, float, float]: Ограниченные CMYK значения
-    """
-    c_min, c_max = preset["C"]
-    m_min, m_max = preset["M"]
-    y_min, y_max = preset["Y"]
-    k_min, k_max = preset["K"]
-    
-    c_clamped = np.clip(c, c_min, c_max)
-    m_clamped = np.clip(m, m_min, m_max)
-    y_clamped = np.clip(y, y_min, y_max)
-    k_clamped = np.clip(k, k_min, k_max)
-    
-    # Логируем если было ограничение
-    if c != c_clamped or m != m_clamped or y != y_clamped or k != k_clamped:
-        logger.debug(f"⚠️ CMYK clamped: C={c:.1f}→{c_clamped:.1f}, M={m:.1f}→{m_clamped:.1f}, "
-                    f"Y={y:.1f}→{y_clamped:.1f}, K={k:.1f}→{k_clamped:.1f}")
-    
-    return c_clamped, m_clamped, y_clamped, k_clamped
-
-
 def apply_skin_tone_safe_cmyk(
     image_rgb: Image.Image,
     face_bbox: Optional[Tuple[int, int, int, int]] = None,
-    preset_name: str = DEFAULT_PRESET
+    preset_name: str = DEFAULT_PRESET,
+    image_bytes: Optional[bytes] = None
 ) -> Image.Image:
     """
     Применяет Skin-Tone Safe CMYK коррекцию к зоне лица ребёнка.
@@ -144,6 +90,8 @@ def apply_skin_tone_safe_cmyk(
         image_rgb: RGB изображение (PIL.Image)
         face_bbox: Bounding box лица (x1, y1, x2, y2). Если None, определяется автоматически.
         preset_name: Имя preset'а для детской кожи (по умолчанию "child_light")
+        image_bytes: Исходные байты изображения — по ним берутся лица, найденные при генерации
+            (face_detection_cache), вместо повторной детекции
     
     Returns:
         Image.Image: CMYK изображение с коррекцией зоны лица
@@ -159,9 +107,9 @@ def apply_skin_tone_safe_cmyk(
         img_np = np.array(image_rgb)
         img_bgr = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
         
-        # Обнаруживаем лицо
-        analyzer = _get_face_analyzer()
-        faces = analyzer.get(img_bgr)
+        # Обнаруживаем лицо (или берём результат детекции, сохранённый при генерации)
+        from .face_detection_cache import detect_faces
+        faces = detect_faces(img_bgr, image_bytes=image_bytes)
         
         if not faces:
             logger.warning("⚠️ Лицо не обнаружено, пропускаем skin-tone коррекцию")
@@ -192,38 +140,8 @@ def apply_skin_tone_safe_cmyk(
     cmyk_array = np.array(image_cmyk, dtype=np.float32)
     
     x1, y1, x2, y2 = expanded_bbox
-    clamped_count = 0
-    
-    for y in range(y1, min(y2, height)):
-        for x in range(x1, min(x2, width)):
-            # Получаем вес маски для этого пикселя
-            mask_weight = mask[y, x]
-            
-            if mask_weight > 0.01:  # Только если пиксель в зоне лица
-                # Получаем CMYK значения
-                c, m, y_val, k = cmyk_array[y, x]
-                
-                # Ограничиваем по preset'у
-                c_clamped, m_clamped, y_clamped, k_clamped = _clamp_cmyk_pixel(
-                    c, m, y_val, k, preset
-                )
-                
-                # Применяем с учётом веса маски (плавный переход)
-                if mask_weight < 1.0:
-                    # Плавный переход на краях маски
-                    cmyk_array[y, x, 0] = c * (1 - mask_weight) + c_clamped * mask_weight
-                    cmyk_array[y, x, 1] = m * (1 - mask_weight) + m_clamped * mask_weight
-                    cmyk_array[y, x, 2] = y_val * (1 - mask_weight) + y_clamped * mask_weight
-                    cmyk_array[y, x, 3] = k * (1 - mask_weight) + k_clamped * mask_weight
-                else:
-                    # Полное применение в центре маски
-                    cmyk_array[y, x, 0] = c_clamped
-                    cmyk_array[y, x, 1] = m_clamped
-                    cmyk_array[y, x, 2] = y_clamped
-                    cmyk_array[y, x, 3] = k_clamped
-                
-                if c != c_clamped or m != m_clamped or y_val != y_clamped or k != k_clamped:
-                    clamped_count += 1
+    # Ограничиваем по preset'у и смешиваем по весу маски (плавный переход на краях) — векторизованно
+    clamped_count = clamp_and_blend(cmyk_array, mask, *preset_bounds(preset), expanded_bbox, threshold=0.01)
     
     # Защита от регресса: проверяем, что значения безопасны
     if clamped_count > 0:
@@ -251,6 +169,7 @@ def apply_skin_tone_safe_cmyk(
 def _convert_rgb_to_cmyk(image_rgb: Image.Image) -> Image.Image:
     """
     Конвертирует RGB изображение в CMYK с использованием ICC профиля (если доступен).
+    Трансформация ICC создаётся один раз на процесс (print/color_management).
     
     Args:
         image_rgb: RGB изображение (PIL.Image)
@@ -258,20 +177,6 @@ def _convert_rgb_to_cmyk(image_rgb: Image.Image) -> Image.Image:
     Returns:
         Image.Image: CMYK изображение
     """
-    icc_path = _get_icc_profile_path()
-    
-    if icc_path:
-        # Используем ICC профиль для точной конвертации
-        try:
-            # Конвертируем через ICC профиль
-            image_cmyk = image_rgb.convert("CMYK", icc_profile=icc_path)
-            logger.debug("✓ RGB → CMYK конвертация через ICC профиль")
-            return image_cmyk
-        except Exception as e:
-            logger.warning(f"⚠️ Ошибка при использовании ICC профиля: {e}. Используется стандартная конвертация.")
-    
-    # Стандартная конвертация (без ICC профиля)
-    image_cmyk = image_rgb.convert("CMYK")
-    logger.debug("✓ RGB → CMYK конвертация (стандартная)")
+    image_cmyk, method = convert_rgb_to_cmyk(image_rgb)
+    logger.debug(f"✓ RGB → CMYK конвертация ({method})")
     return image_cmyk
-
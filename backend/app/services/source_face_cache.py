@@ -0,0 +1,182 @@
+"""
+Кэш исходного лица ребёнка для face swap (embedding + landmarks).
+
+Исходное лицо не меняется между сценами и попытками обложки, но раньше каждый вызов face swap
+заново читал reference.png или до 5 фотографий ребёнка и запускал на них полную детекцию.
+Теперь подготовленное лицо хранится в памяти и на диске (JSON в FACE_DETECTION_CACHE_DIR/sources/<child_id>),
+чтобы воркер и API-процесс использовали один результат. Дисковые файлы входят в общий лимит
+FACE_DETECTION_CACHE_MAX_MB кэша детекции лиц.
+
+Ключ — набор исходных файлов вместе с их mtime и размером и конфигурация моделей лиц
+(face_model_config_id), поэтому изменённые файлы и смена FACE_MODEL_TIER не дают устаревшего лица. Дополнительно invalidate_child вызывается при загрузке/удалении фото,
+смене аватара и пересоздании face profile.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from .face_detection_cache import (
+    FACE_DETECTION_CACHE_DIR,
+    face_from_record,
+    face_to_record,
+    forget_cache_dir,
+    touch_cache_file,
+    write_cache_file,
+)
+
+logger = logging.getLogger(__name__)
+
+SOURCE_FACE_CACHE_SIZE = int(os.getenv("SOURCE_FACE_CACHE_SIZE", "64"))
+SOURCE_FACE_CACHE_DIR = os.path.join(FACE_DETECTION_CACHE_DIR, "sources")
+
+# Фото ребёнка лежат в children/{child_id}/, reference.png — в faces/{child_id}/
+_CHILD_DIR_RE = re.compile(r"[/\\](?:children|faces)[/\\](\d+)[/\\]")
+
+_lock = threading.Lock()
+# key -> (child scope, лицо или None, если лиц на исходных фото нет)
+_memory: "OrderedDict[str, Tuple[str, object]]" = OrderedDict()
+_key_locks: Dict[str, threading.Lock] = {}
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _child_scope(paths: List[str]) -> str:
+    for path in paths:
+        match = _CHILD_DIR_RE.search(path)
+        if match:
+            return match.group(1)
+    return "shared"
+
+
+def _fingerprint(paths: List[str]) -> str:
+    from .face_models import face_model_config_id
+    parts = [face_model_config_id()]
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append([os.path.abspath(path), st.st_mtime_ns, st.st_size])
+        except OSError:
+            parts.append([os.path.abspath(path), None, None])
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def _path_for(scope: str, key: str) -> str:
+    return os.path.join(SOURCE_FACE_CACHE_DIR, scope, f"{key}.json")
+
+
+def _remember(key: str, scope: str, face):
+    with _lock:
+        _memory[key] = (scope, face)
+        _memory.move_to_end(key)
+        while len(_memory) > SOURCE_FACE_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def _load(scope: str, key: str) -> Tuple[bool, object]:
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            _memory.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return True, entry[1]
+    path = _path_for(scope, key)
+    try:
+        with open(path) as f:
+            record = json.load(f)
+        face = face_from_record(record["face"]) if record.get("face") is not None else None
+    except (OSError, ValueError, KeyError):
+        return False, None
+    touch_cache_file(path)
+    _remember(key, scope, face)
+    with _lock:
+        _stats["disk_hits"] += 1
+    return True, face
+
+
+def _persist(scope: str, key: str, paths: List[str], face):
+    write_cache_file(
+        _path_for(scope, key),
+        {"paths": paths, "face": face_to_record(face) if face is not None else None},
+    )
+
+
+def _prepare_source_face(paths: List[str]):
+    """Первое лицо с каждого фото; из них выбирается самое крупное (наиболее детализированное)."""
+    import cv2
+    from .face_models import analyze_faces
+
+    all_faces = []
+    for photo_path in paths:
+        if not os.path.exists(photo_path):
+            logger.warning(f"⚠️ Файл фотографии ребёнка не найден: {photo_path}")
+            continue
+        image = cv2.imread(photo_path)
+        if image is None:
+            logger.warning(f"⚠️ Не удалось загрузить изображение ребёнка: {photo_path}")
+            continue
+        faces = analyze_faces(image)
+        if faces:
+            all_faces.append(faces[0])
+            logger.info(f"✓ Лицо найдено на фото: {photo_path}")
+        else:
+            logger.warning(f"⚠️ Лицо не найдено на фото ребёнка: {photo_path}")
+        del image
+
+    if not all_faces:
+        return None
+    if len(all_faces) > 1:
+        logger.info(f"✓ Используется лучшее лицо из {len(all_faces)} найденных лиц")
+    return max(all_faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+
+
+def get_source_face(paths: List[str]):
+    """
+    Подготовленное исходное лицо для face swap по списку фото (или одному reference.png).
+
+    Returns:
+        Face InsightFace или None, если ни на одном фото лицо не найдено.
+    """
+    scope = _child_scope(paths)
+    key = _fingerprint(paths)
+    found, face = _load(scope, key)
+    if found:
+        return face
+
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    # Параллельные сцены одной книги ждут одну детекцию, а не запускают свою
+    with key_lock:
+        found, face = _load(scope, key)
+        if found:
+            return face
+        with _lock:
+            _stats["misses"] += 1
+        face = _prepare_source_face(paths)
+        _remember(key, scope, face)
+        _persist(scope, key, paths, face)
+    with _lock:
+        _key_locks.pop(key, None)
+    return face
+
+
+def invalidate_child(child_id) -> None:
+    """Сбросить кэш исходного лица ребёнка (фото или face profile изменились)."""
+    scope = str(child_id)
+    with _lock:
+        for key in [key for key, (entry_scope, _) in _memory.items() if entry_scope == scope]:
+            del _memory[key]
+        _stats["invalidations"] += 1
+    scope_dir = os.path.join(SOURCE_FACE_CACHE_DIR, scope)
+    shutil.rmtree(scope_dir, ignore_errors=True)
+    forget_cache_dir(scope_dir)
+    logger.info(f"🧹 Кэш исходного лица сброшен для child_id={child_id}")
+
+
+def get_source_face_cache_stats() -> Dict[str, int]:
+    with _lock:
+        return {"memory_entries": len(_memory), "max_entries": SOURCE_FACE_CACHE_SIZE, **_stats}
@@ -1,21 +1,158 @@
+"""
+Персистентное хранилище задач генерации (таблица tasks в PostgreSQL).
+
+Статус, прогресс, метаданные, результат и ошибка задачи хранятся в БД, поэтому
+/books/task_status/{task_id} видит задачу из любого процесса uvicorn.
+Процесс, выполняющий задачу, периодически продлевает heartbeat/lease;
+задача в статусе running с истёкшим lease считается брошенной и помечается как interrupted.
+
+Режимы выполнения (TASK_RUNNER):
+- inline: задача запускается через asyncio.create_task в процессе API (по умолчанию)
+- worker: API только ставит задачу в очередь, выполняет её отдельный процесс python -m app.worker
+"""
 import asyncio
+import inspect
+import json
+import os
+import socket
 import uuid
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Callable, Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-logger = logging.getLogger(__name__)
+from sqlalchemy import text
+from sqlalchemy.orm import Session
 
-TASKS: Dict[str, Dict[str, Any]] = {}
+from ..db import SessionLocal
+from ..models import Task
+
+logger = logging.getLogger(__name__)
 
 # Максимальное время выполнения задачи (30 минут)
 MAX_TASK_DURATION = timedelta(minutes=30)
 
+# Аренда задачи: воркер продлевает lease каждые TASK_HEARTBEAT_SECONDS,
+# задача считается брошенной, если lease не продлевался дольше TASK_LEASE_SECONDS
+TASK_LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", "120"))
+TASK_HEARTBEAT_SECONDS = int(os.getenv("TASK_HEARTBEAT_SECONDS", "30"))
+
+# Статусы, в которых задача ещё не завершена
+ACTIVE_STATUSES = ("pending", "running")
+
+# inline — выполнять в процессе API, worker — ставить в очередь для python -m app.worker
+TASK_RUNNER = os.getenv("TASK_RUNNER", "inline").lower()
+
+# Реестр задач, которые может выполнить воркер: имя → функция
+TASK_HANDLERS: Dict[str, Callable] = {}
+
+# Маркер аргумента-сессии БД в payload: воркер подставляет вместо него собственную сессию
+_DB_SESSION_MARKER = "__db_session__"
+
+# Запись прогресса из event loop: один поток, чтобы обновления шли в БД в порядке вызова
+_progress_executor: Optional[ThreadPoolExecutor] = None
+
+
+def register_task(name: str):
+    """
+    Декоратор: регистрирует функцию задачи под именем, по которому воркер найдёт её в таблице tasks.
+
+    Аргументы задачи должны быть JSON-сериализуемыми; аргумент типа Session
+    заменяется в воркере на новую сессию БД.
+    """
+    def decorator(fn: Callable) -> Callable:
+        TASK_HANDLERS[name] = fn
+        fn.task_name = name
+        return fn
+    return decorator
+
+
+def _encode_payload(args: tuple, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    def encode(value):
+        return {_DB_SESSION_MARKER: True} if isinstance(value, Session) else value
+
+    return _to_json({
+        "args": [encode(arg) for arg in args],
+        "kwargs": {key: encode(value) for key, value in kwargs.items()},
+    })
+
+
+def decode_payload(payload: Optional[Dict[str, Any]], db: Session) -> tuple:
+    """Восстановить (args, kwargs) задачи из payload, подставив сессию БД воркера."""
+    def decode(value):
+        return db if isinstance(value, dict) and value.get(_DB_SESSION_MARKER) else value
+
+    payload = payload or {}
+    args = [decode(arg) for arg in payload.get("args", [])]
+    kwargs = {key: decode(value) for key, value in payload.get("kwargs", {}).items()}
+    return args, kwargs
+
+
+def get_worker_id() -> str:
+    """Идентификатор текущего процесса (hostname:pid) для поля tasks.worker_id."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_task_id(task_id: str) -> Optional[uuid.UUID]:
+    try:
+        return uuid.UUID(str(task_id))
+    except (ValueError, TypeError):
+        return None
+
+
+def _to_json(value: Any) -> Any:
+    """Приводит значение к JSON-совместимому виду (UUID, datetime → str) для JSONB."""
+    if value is None:
+        return None
+    return json.loads(json.dumps(value, default=str))
+
+
+def _timeout_error_message() -> str:
+    return f"Задача превысила максимальное время выполнения ({MAX_TASK_DURATION.total_seconds() / 60:.0f} минут)"
+
+
+def _task_to_dict(task: Task) -> Dict[str, Any]:
+    """Формат ответа совместим с прежним in-memory словарём TASKS[task_id]."""
+    return {
+        "status": task.status,
+        "created_at": task.created_at.isoformat() if task.created_at else None,
+        "started_at": task.started_at.isoformat() if task.started_at else None,
+        "completed_at": task.completed_at.isoformat() if task.completed_at else None,
+        "heartbeat_at": task.heartbeat_at.isoformat() if task.heartbeat_at else None,
+        "result": task.result,
+        "error": task.error,
+        "meta": task.meta or {},
+        "progress": task.progress or {},
+        "worker_id": task.worker_id,
+        "attempts": task.attempts or 0,
+    }
+
+
+def _is_lease_expired(task: Task, now: datetime) -> bool:
+    return task.status == "running" and task.lease_expires_at is not None and task.lease_expires_at < now
+
+
+def _is_duration_exceeded(task: Task, now: datetime) -> bool:
+    return task.status == "running" and task.started_at is not None and now - task.started_at > MAX_TASK_DURATION
+
+
+def _interrupt(task: Task, now: datetime) -> None:
+    """Пометить брошенную задачу (воркер перестал продлевать lease)."""
+    logger.warning(f"⚠️ Задача {task.id} брошена воркером {task.worker_id} (lease истёк), помечаем как interrupted")
+    task.status = "interrupted"
+    task.error = "Задача была прервана: процесс-исполнитель перестал отвечать"
+    task.completed_at = now
+    task.lease_expires_at = None
+
 
 def update_task_progress(task_id: str, progress: Dict[str, Any]):
     """
     Обновить прогресс задачи
-    
+
     Args:
         task_id: ID задачи
         progress: Словарь с информацией о прогрессе:
@@ -26,28 +163,313 @@ def update_task_progress(task_id: str, progress: Dict[str, Any]):
             - total_images: общее количество изображений
             - message: сообщение для пользователя
             - book_id: ID книги (если известен)
+
+    При вызове из event loop запись в БД выполняется в фоновом потоке и не блокирует
+    генерацию остальных сцен; порядок обновлений сохраняется.
     """
-    if task_id in TASKS:
-        if "progress" not in TASKS[task_id]:
-            TASKS[task_id]["progress"] = {}
-        TASKS[task_id]["progress"].update(progress)
-        TASKS[task_id]["progress"]["updated_at"] = datetime.now().isoformat()
+    global _progress_executor
+    task_uuid = _parse_task_id(task_id)
+    if task_uuid is None:
+        return
+
+    patch = _to_json(dict(progress))
+    patch["updated_at"] = datetime.now().isoformat()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        _write_task_progress(task_id, task_uuid, patch, progress)
+        return
+    if _progress_executor is None:
+        _progress_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-progress")
+    _progress_executor.submit(_write_task_progress, task_id, task_uuid, patch, progress)
+
+
+def _write_task_progress(task_id: str, task_uuid: uuid.UUID, patch: Dict[str, Any], progress: Dict[str, Any]):
+    # Слияние JSONB на стороне БД (progress || patch): атомарно при параллельных обновлениях
+    db = SessionLocal()
+    try:
+        db.execute(
+            text(
+                "UPDATE tasks SET progress = COALESCE(progress, '{}'::jsonb) || CAST(:patch AS jsonb), "
+                "updated_at = NOW() WHERE id = :task_id"
+            ),
+            {"patch": json.dumps(patch, ensure_ascii=False), "task_id": str(task_uuid)}
+        )
+        db.commit()
         logger.info(f"📊 Прогресс задачи {task_id} обновлен: {progress}")
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"⚠️ Не удалось обновить прогресс задачи {task_id}: {e}")
+    finally:
+        db.close()
+
+
+def _insert_task(
+    task_id: str,
+    meta: Optional[Dict[str, Any]],
+    task_name: Optional[str] = None,
+    payload: Optional[Dict[str, Any]] = None
+) -> None:
+    meta = _to_json(meta or {})
+    db = SessionLocal()
+    try:
+        db.add(Task(
+            id=uuid.UUID(task_id),
+            user_id=str(meta.get("user_id") or "system"),
+            status="pending",
+            meta=meta,
+            progress={
+                "stage": "starting",
+                "current_step": 0,
+                "total_steps": 7,
+                "message": "Инициализация генерации книги..."
+            },
+            attempts=0,
+            task_name=task_name,
+            payload=payload,
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _take_lease(task: Task, now: datetime) -> None:
+    task.status = "running"
+    task.started_at = now
+    task.completed_at = None
+    task.error = None
+    task.worker_id = get_worker_id()
+    task.attempts = (task.attempts or 0) + 1
+    task.heartbeat_at = now
+    task.lease_expires_at = now + timedelta(seconds=TASK_LEASE_SECONDS)
+
+
+def claim_task(task_id: str) -> bool:
+    """
+    Перевести задачу в running и взять lease текущим процессом.
+
+    Returns:
+        True, если задача захвачена; False, если её уже выполняет другой процесс или она завершена
+    """
+    task_uuid = _parse_task_id(task_id)
+    if task_uuid is None:
+        return False
+
+    now = _utcnow()
+    db = SessionLocal()
+    try:
+        task = db.query(Task).filter(Task.id == task_uuid).with_for_update().first()
+        if not task:
+            return False
+        if task.status == "running" and not _is_lease_expired(task, now):
+            return False
+        if task.status not in ACTIVE_STATUSES and task.status != "interrupted":
+            return False
+
+        _take_lease(task, now)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def claim_next_task() -> Optional[Dict[str, Any]]:
+    """
+    Забрать из очереди самую старую pending-задачу и взять на неё lease.
+
+    SELECT ... FOR UPDATE SKIP LOCKED позволяет нескольким воркерам забирать задачи
+    параллельно, не получая одну и ту же задачу дважды.
+
+    Returns:
+        {"id", "task_name", "payload"} или None, если очередь пуста
+    """
+    now = _utcnow()
+    db = SessionLocal()
+    try:
+        task = db.query(Task).filter(
+            Task.status == "pending",
+            Task.task_name.isnot(None)
+        ).order_by(Task.created_at).with_for_update(skip_locked=True).first()
+        if not task:
+            db.rollback()
+            return None
+
+        _take_lease(task, now)
+        db.commit()
+        return {"id": str(task.id), "task_name": task.task_name, "payload": task.payload or {}}
+    finally:
+        db.close()
+
+
+def heartbeat(task_id: str) -> bool:
+    """
+    Продлить lease задачи текущим процессом.
+
+    Returns:
+        False, если задача больше не принадлежит этому процессу (переподхвачена или завершена)
+    """
+    task_uuid = _parse_task_id(task_id)
+    if task_uuid is None:
+        return False
+
+    now = _utcnow()
+    db = SessionLocal()
+    try:
+        updated = db.query(Task).filter(
+            Task.id == task_uuid,
+            Task.status == "running",
+            Task.worker_id == get_worker_id()
+        ).update({
+            Task.heartbeat_at: now,
+            Task.lease_expires_at: now + timedelta(seconds=TASK_LEASE_SECONDS),
+        }, synchronize_session=False)
+        db.commit()
+        return updated > 0
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"⚠️ Не удалось продлить lease задачи {task_id}: {e}")
+        return True
+    finally:
+        db.close()
+
+
+async def _heartbeat_loop(task_id: str, work: "asyncio.Future"):
+    """
+    Продлевать lease, пока выполняется work. Если lease потерян (задача помечена interrupted
+    или захвачена другим процессом), выполнение work отменяется: результат всё равно не был бы сохранён.
+    """
+    while True:
+        await asyncio.sleep(TASK_HEARTBEAT_SECONDS)
+        # Запрос к БД — в потоке, чтобы медленная БД не останавливала event loop
+        if not await asyncio.to_thread(heartbeat, task_id):
+            logger.warning(f"⚠️ Задача {task_id} больше не принадлежит процессу {get_worker_id()}, выполнение отменяется")
+            work.cancel()
+            return
+
+
+def _finish_task(task_id: str, status: str, result: Any = None, error: Optional[str] = None) -> bool:
+    """
+    Записать итог задачи, только если она всё ещё running и принадлежит этому процессу.
+
+    Returns:
+        False, если lease был потерян (задача interrupted или захвачена другим процессом) — итог не записан
+    """
+    task_uuid = _parse_task_id(task_id)
+    if task_uuid is None:
+        return False
+
+    db = SessionLocal()
+    try:
+        updated = db.query(Task).filter(
+            Task.id == task_uuid,
+            Task.status == "running",
+            Task.worker_id == get_worker_id()
+        ).update({
+            Task.status: status,
+            Task.result: _to_json(result),
+            Task.error: error,
+            Task.completed_at: _utcnow(),
+            Task.lease_expires_at: None,
+        }, synchronize_session=False)
+        db.commit()
+        if not updated:
+            logger.warning(
+                f"⚠️ Задача {task_id} больше не принадлежит процессу {get_worker_id()} "
+                f"(lease истёк или задача завершена), итог status={status} не сохранён"
+            )
+        return updated > 0
+    finally:
+        db.close()
+
+
+def mark_failed(task_id: str, error_msg: str):
+    """
+    Отметить задачу как завершившуюся с ошибкой
+
+    Args:
+        task_id: ID задачи
+        error_msg: Сообщение об ошибке
+    """
+    if _finish_task(task_id, "error", error=error_msg):
+        logger.info(f"✅ Задача {task_id} обновлена: status=error, error={error_msg[:100]}")
+
+
+async def run_task(task_id: str, fn: Callable, *args, **kwargs):
+    """
+    Выполнить функцию задачи в текущем процессе: захват lease, heartbeat, таймаут, сохранение результата.
+    """
+    if not claim_task(task_id):
+        logger.warning(f"⚠️ Задача {task_id} уже выполняется другим процессом или завершена, пропускаем")
+        return
+
+    await execute_task(task_id, fn, *args, **kwargs)
+
+
+async def execute_task(task_id: str, fn: Callable, *args, **kwargs):
+    """
+    Выполнить уже захваченную (running) задачу: heartbeat, таймаут, сохранение результата.
+
+    Если lease потерян во время выполнения, задача отменяется и её итог не записывается.
+    Итог записывается в БД в потоке, чтобы не блокировать event loop.
+    """
+    heartbeat_task = None
+    try:
+        logger.info(f"🔄 Запуск задачи {task_id} (worker={get_worker_id()})")
+
+        # Передаем task_id в функцию, если она принимает этот параметр
+        if 'task_id' in inspect.signature(fn).parameters:
+            kwargs = {**kwargs, "task_id": task_id}
+
+        if asyncio.iscoroutinefunction(fn):
+            work = asyncio.ensure_future(asyncio.wait_for(
+                fn(*args, **kwargs),
+                timeout=MAX_TASK_DURATION.total_seconds()
+            ))
+            heartbeat_task = asyncio.create_task(_heartbeat_loop(task_id, work))
+            try:
+                result = await work
+            except asyncio.CancelledError:
+                # heartbeat_task завершается сам только при потере lease
+                if not (heartbeat_task.done() and not heartbeat_task.cancelled()):
+                    raise
+                logger.warning(f"⚠️ Задача {task_id} отменена: lease потерян, итог не сохраняется")
+                return
+        else:
+            result = fn(*args, **kwargs)
+
+        logger.info(f"✅ Задача {task_id} успешно завершена")
+        await asyncio.to_thread(mark_completed, task_id, result)
+    except asyncio.TimeoutError:
+        error_msg = _timeout_error_message()
+        logger.error(f"⏱️ Таймаут задачи {task_id}: {error_msg}")
+        await asyncio.to_thread(mark_failed, task_id, error_msg)
+    except Exception as e:
+        # HTTPException имеет атрибут detail
+        error_msg = str(e.detail) if hasattr(e, 'detail') else str(e)
+        logger.error(f"❌ Ошибка в задаче {task_id}: {error_msg}", exc_info=True)
+        await asyncio.to_thread(mark_failed, task_id, error_msg)
+    finally:
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
 
 
 def create_task(fn: Callable, *args, meta: Optional[Dict[str, Any]] = None, task_id: Optional[str] = None, **kwargs) -> str:
     """
     Создать задачу и запустить её асинхронно
-    
-    ⚠️ ВАЖНО: Задачи хранятся в памяти и теряются при перезапуске контейнера!
-    Не перезапускайте контейнер во время генерации книги!
-    
+
+    Задача сохраняется в таблице tasks, поэтому её статус доступен из любого процесса.
+    При TASK_RUNNER=worker зарегистрированная (@register_task) задача только ставится
+    в очередь и выполняется процессом python -m app.worker.
+    Если процесс-исполнитель завершится во время генерации, задача будет помечена
+    как interrupted после истечения lease (TASK_LEASE_SECONDS).
+
     Args:
         fn: Функция для выполнения
         *args, **kwargs: Аргументы функции
         meta: Метаданные задачи для проверки дубликатов
         task_id: Опциональный ID задачи (если не указан, генерируется новый)
-    
+
     Returns:
         task_id: ID задачи (или существующей, если найдена дублирующая)
     """
@@ -57,140 +479,132 @@ def create_task(fn: Callable, *args, meta: Optional[Dict[str, Any]] = None, task
         if existing_task_id:
             logger.info(f"✓ Найдена уже запущенная задача {existing_task_id} для {meta}, возвращаем её ID.")
             return existing_task_id
-    
+
     if not task_id:
         task_id = str(uuid.uuid4())
-    
-    TASKS[task_id] = {
-        "status": "pending",
-        "created_at": datetime.now().isoformat(),
-        "result": None,
-        "error": None,
-        "meta": meta or {},
-        "progress": {
-            "stage": "starting",
-            "current_step": 0,
-            "total_steps": 7,
-            "message": "Инициализация генерации книги..."
-        }
-    }
-    
-    logger.warning(f"⚠️  ВАЖНО: Задача {task_id} создана. Не перезапускайте контейнер до завершения генерации!")
-    
-    async def run_task():
-        try:
-            logger.info(f"🔄 Запуск задачи {task_id}")
-            TASKS[task_id]["status"] = "running"
-            TASKS[task_id]["started_at"] = datetime.now().isoformat()
-            
-            # Создаем таймаут для задачи
-            try:
-                # Передаем task_id в функцию, если она принимает этот параметр
-                if asyncio.iscoroutinefunction(fn):
-                    # Проверяем, принимает ли функция task_id
-                    import inspect
-                    sig = inspect.signature(fn)
-                    if 'task_id' in sig.parameters:
-                        result = await asyncio.wait_for(
-                            fn(*args, task_id=task_id, **kwargs),
-                            timeout=MAX_TASK_DURATION.total_seconds()
-                        )
-                    else:
-                        result = await asyncio.wait_for(
-                            fn(*args, **kwargs),
-                            timeout=MAX_TASK_DURATION.total_seconds()
-                        )
-                else:
-                    import inspect
-                    sig = inspect.signature(fn)
-                    if 'task_id' in sig.parameters:
-                        result = fn(*args, task_id=task_id, **kwargs)
-                    else:
-                        result = fn(*args, **kwargs)
-                
-                logger.info(f"✅ Задача {task_id} успешно завершена")
-                mark_completed(task_id, result)
-            except asyncio.TimeoutError:
-                error_msg = f"Задача превысила максимальное время выполнения ({MAX_TASK_DURATION.total_seconds() / 60:.0f} минут)"
-                logger.error(f"⏱️ Таймаут задачи {task_id}: {error_msg}")
-                if task_id in TASKS:
-                    TASKS[task_id]["status"] = "error"
-                    TASKS[task_id]["error"] = error_msg
-                    TASKS[task_id]["completed_at"] = datetime.now().isoformat()
-        except Exception as e:
-            # Извлекаем сообщение об ошибке
-            if hasattr(e, 'detail'):
-                # HTTPException имеет атрибут detail
-                error_msg = str(e.detail)
-            else:
-                error_msg = str(e)
-            
-            logger.error(f"❌ Ошибка в задаче {task_id}: {error_msg}", exc_info=True)
-            
-            # Обновляем статус задачи на error
-            if task_id in TASKS:
-                TASKS[task_id]["status"] = "error"
-                TASKS[task_id]["error"] = error_msg
-                TASKS[task_id]["completed_at"] = datetime.now().isoformat()
-                logger.info(f"✅ Задача {task_id} обновлена: status=error, error={error_msg[:100]}")
-            else:
-                logger.warning(f"⚠️ Задача {task_id} не найдена в TASKS при обработке ошибки")
-    
-    asyncio.create_task(run_task())
-    
+
+    task_name = getattr(fn, "task_name", None)
+    if TASK_RUNNER == "worker":
+        if task_name:
+            _insert_task(task_id, meta, task_name=task_name, payload=_encode_payload(args, kwargs))
+            logger.info(f"📥 Задача {task_id} ({task_name}) поставлена в очередь воркера")
+            return task_id
+        logger.warning(f"⚠️ Функция {fn.__name__} не зарегистрирована через @register_task, выполняем в процессе API")
+
+    _insert_task(task_id, meta)
+    logger.info(f"📝 Задача {task_id} создана")
+
+    asyncio.create_task(run_task(task_id, fn, *args, **kwargs))
+
     return task_id
 
 
 def get_task_status(task_id: str) -> Optional[Dict[str, Any]]:
     """
     Получить статус задачи
-    
+
     Args:
         task_id: ID задачи
-    
+
     Returns:
         Словарь со статусом задачи или None, если задача не найдена
     """
-    return TASKS.get(task_id)
+    task_uuid = _parse_task_id(task_id)
+    if task_uuid is None:
+        return None
+
+    db = SessionLocal()
+    try:
+        task = db.query(Task).filter(Task.id == task_uuid).first()
+        if not task:
+            return None
+
+        # Брошенную задачу помечаем сразу, не дожидаясь планировщика
+        now = _utcnow()
+        if _is_lease_expired(task, now):
+            _interrupt(task, now)
+            db.commit()
+
+        return _task_to_dict(task)
+    finally:
+        db.close()
 
 
 def find_running_task(meta: Dict[str, Any]) -> Optional[str]:
     """
-    Найти задачу в статусе running с совпадающим meta
+    Найти незавершённую задачу (pending/running) с совпадающим meta
     (например, по user_id и child_id).
-    Также проверяет, не превысила ли задача максимальное время выполнения.
+    Также проверяет, не превысила ли задача максимальное время выполнения
+    и не брошена ли она воркером (истёкший lease).
     """
     if not meta:
         return None
-    for task_id, data in TASKS.items():
-        if data.get("status") == "running" and data.get("meta") == meta:
-            # Проверяем, не превысила ли задача максимальное время выполнения
-            started_at_str = data.get("started_at")
-            if started_at_str:
-                try:
-                    started_at = datetime.fromisoformat(started_at_str)
-                    if datetime.now() - started_at > MAX_TASK_DURATION:
-                        logger.warning(f"⚠️ Задача {task_id} превысила максимальное время выполнения, помечаем как error")
-                        data["status"] = "error"
-                        data["error"] = f"Задача превысила максимальное время выполнения ({MAX_TASK_DURATION.total_seconds() / 60:.0f} минут)"
-                        data["completed_at"] = datetime.now().isoformat()
-                        continue
-                except (ValueError, TypeError) as e:
-                    logger.warning(f"⚠️ Не удалось проверить время выполнения задачи {task_id}: {e}")
-            return task_id
-    return None
+
+    now = _utcnow()
+    db = SessionLocal()
+    try:
+        tasks = db.query(Task).filter(
+            Task.status.in_(ACTIVE_STATUSES),
+            Task.meta == _to_json(meta)
+        ).order_by(Task.created_at.desc()).all()
+
+        found = None
+        for task in tasks:
+            if _is_lease_expired(task, now):
+                _interrupt(task, now)
+                continue
+            if _is_duration_exceeded(task, now):
+                logger.warning(f"⚠️ Задача {task.id} превысила максимальное время выполнения, помечаем как error")
+                task.status = "error"
+                task.error = _timeout_error_message()
+                task.completed_at = now
+                task.lease_expires_at = None
+                continue
+            if found is None:
+                found = str(task.id)
+        db.commit()
+        return found
+    finally:
+        db.close()
+
+
+def reclaim_expired_tasks() -> int:
+    """
+    Пометить как interrupted все задачи в статусе running с истёкшим lease.
+    Вызывается при старте приложения и периодически планировщиком.
+
+    Returns:
+        Количество помеченных задач
+    """
+    now = _utcnow()
+    db = SessionLocal()
+    try:
+        tasks = db.query(Task).filter(
+            Task.status == "running",
+            Task.lease_expires_at < now
+        ).all()
+        for task in tasks:
+            _interrupt(task, now)
+        db.commit()
+        if tasks:
+            logger.warning(f"⚠️ Обнаружено брошенных задач: {len(tasks)}, помечены как interrupted")
+        return len(tasks)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка при поиске брошенных задач: {e}", exc_info=True)
+        return 0
+    finally:
+        db.close()
 
 
 def mark_completed(task_id: str, result: Any):
     """
     Отметить задачу как выполненную
-    
+
     Args:
         task_id: ID задачи
         result: Результат выполнения
     """
-    if task_id in TASKS:
-        TASKS[task_id]["status"] = "success"  # Изменено: completed -> success для соответствия контракту
-        TASKS[task_id]["result"] = result
-        TASKS[task_id]["completed_at"] = datetime.now().isoformat()
+    # success (не completed) для соответствия контракту
+    if _finish_task(task_id, "success", result=result):
         logger.info(f"✅ Задача {task_id} отмечена как успешно выполненная")
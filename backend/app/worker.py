@@ -0,0 +1,125 @@
+"""
+Воркер генерации книг.
+
+Забирает задачи из таблицы tasks (status='pending', поставлены API при TASK_RUNNER=worker)
+и выполняет их с ограниченной конкурентностью. Генерация изображений, InsightFace,
+CMYK-конвертация и рендеринг PDF не делят event loop с обработкой HTTP-запросов,
+а мощность генерации масштабируется количеством запущенных воркеров.
+
+Запуск:
+    python -m app.worker
+
+Переменные окружения:
+    WORKER_CONCURRENCY   — сколько задач выполняется одновременно (по умолчанию 2)
+    WORKER_POLL_SECONDS  — интервал опроса очереди, когда она пуста (по умолчанию 2)
+"""
+import asyncio
+import logging
+import os
+import signal
+import time
+
+# Импорт app.main загружает .env, настраивает логирование и регистрирует задачи роутеров (@register_task)
+from . import main as _app_main  # noqa: F401
+from .db import SessionLocal, import_all_models
+from .services.cpu_pool import get_cpu_executor, shutdown_cpu_executor
+from .services.face_models import FACE_MODELS_WARMUP, warmup_face_models
+from .services.http_clients import close_http_clients
+from .services.tasks import (
+    TASK_HANDLERS,
+    claim_next_task,
+    decode_payload,
+    execute_task,
+    get_worker_id,
+    mark_failed,
+    reclaim_expired_tasks,
+)
+
+logger = logging.getLogger("app.worker")
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+RECLAIM_INTERVAL_SECONDS = 60
+
+
+async def _run_claimed_task(claimed: dict, slots: asyncio.Semaphore):
+    task_id = claimed["id"]
+    task_name = claimed["task_name"]
+    db = SessionLocal()
+    try:
+        fn = TASK_HANDLERS.get(task_name)
+        if not fn:
+            logger.error(f"❌ Неизвестная задача {task_name} (task_id={task_id})")
+            await asyncio.to_thread(mark_failed, task_id, f"Неизвестный тип задачи: {task_name}")
+            return
+
+        args, kwargs = decode_payload(claimed["payload"], db)
+        logger.info(f"🔄 Воркер {get_worker_id()} выполняет задачу {task_id} ({task_name})")
+        await execute_task(task_id, fn, *args, **kwargs)
+    except Exception as e:
+        logger.error(f"❌ Ошибка воркера при выполнении задачи {task_id}: {e}", exc_info=True)
+        await asyncio.to_thread(mark_failed, task_id, str(e))
+    finally:
+        db.close()
+        slots.release()
+
+
+async def run_worker():
+    import_all_models()
+    reclaim_expired_tasks()
+    # Модели InsightFace загружаются в фоне, пока воркер забирает первые задачи
+    if FACE_MODELS_WARMUP:
+        asyncio.get_running_loop().run_in_executor(get_cpu_executor(), warmup_face_models)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    slots = asyncio.Semaphore(WORKER_CONCURRENCY)
+    running: set[asyncio.Task] = set()
+    last_reclaim = time.monotonic()
+
+    logger.info(f"✓ Воркер {get_worker_id()} запущен: concurrency={WORKER_CONCURRENCY}, задачи={sorted(TASK_HANDLERS)}")
+
+    while not stop.is_set():
+        await slots.acquire()
+        if stop.is_set():
+            slots.release()
+            break
+
+        if time.monotonic() - last_reclaim > RECLAIM_INTERVAL_SECONDS:
+            await asyncio.to_thread(reclaim_expired_tasks)
+            last_reclaim = time.monotonic()
+
+        try:
+            claimed = await asyncio.to_thread(claim_next_task)
+        except Exception as e:
+            logger.error(f"❌ Не удалось получить задачу из очереди: {e}", exc_info=True)
+            claimed = None
+
+        if not claimed:
+            slots.release()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=WORKER_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        task = asyncio.create_task(_run_claimed_task(claimed, slots))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    if running:
+        logger.info(f"⏳ Воркер останавливается, ожидаем завершения {len(running)} задач...")
+        await asyncio.gather(*running, return_exceptions=True)
+    await close_http_clients()
+    shutdown_cpu_executor()
+    logger.info("✓ Воркер остановлен")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
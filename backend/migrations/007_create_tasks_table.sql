@@ -0,0 +1,30 @@
+-- Миграция: персистентное хранилище задач генерации (вместо in-memory TASKS)
+-- Дата: 2026-10-17
+-- Описание: Таблица tasks хранит статус, прогресс, метаданные, результат и ошибку задач,
+-- а также heartbeat/lease воркера, чтобы статус был виден из любого процесса uvicorn,
+-- а брошенные задачи (процесс умер) обнаруживались по истёкшему lease.
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id VARCHAR NOT NULL,
+    book_id UUID REFERENCES books(id) ON DELETE SET NULL,
+    status VARCHAR NOT NULL DEFAULT 'pending',  -- 'pending', 'running', 'success', 'error', 'interrupted'
+    meta JSONB,
+    progress JSONB,
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    completed_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Поля аренды задачи воркером
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS worker_id VARCHAR;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+CREATE INDEX IF NOT EXISTS idx_tasks_lease_expires_at ON tasks(lease_expires_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_meta ON tasks USING GIN (meta);
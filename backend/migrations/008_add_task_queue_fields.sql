@@ -0,0 +1,10 @@
+-- Миграция: Очередь задач для отдельного процесса-воркера
+-- Дата: 2026-10-17
+-- Описание: API-процесс только ставит задачу в очередь (status='pending', task_name, payload),
+-- воркер (python -m app.worker) забирает её через SELECT ... FOR UPDATE SKIP LOCKED
+
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS task_name VARCHAR;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS payload JSONB;
+
+-- Частичный индекс для выборки следующей задачи из очереди
+CREATE INDEX IF NOT EXISTS idx_tasks_queue ON tasks(created_at) WHERE status = 'pending' AND task_name IS NOT NULL;
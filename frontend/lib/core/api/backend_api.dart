@@ -1848,6 +1848,32 @@ class BackendApi {
     }
   }
 
+  /// Получить лёгкий PDF книги для чтения в приложении и отправки (профиль screen)
+  /// GET /books/{book_id}/screen_pdf
+  /// Возвращает URL или null, если screen PDF получить не удалось (тогда используется final_pdf_url)
+  Future<String?> getScreenPdfUrl(String bookId) async {
+    try {
+      print('[BackendApi] [API REQUEST] GET /books/$bookId/screen_pdf');
+      
+      // Первый запрос после финализации собирает PDF на сервере — ждём дольше обычного
+      final response = await _dio.get(
+        '/books/$bookId/screen_pdf',
+        options: Options(
+          receiveTimeout: const Duration(seconds: 120),
+        ),
+      );
+      
+      if (response.statusCode == 200 && response.data != null) {
+        final data = response.data as Map<String, dynamic>;
+        return data['pdf_url'] as String?;
+      }
+      return null;
+    } on DioException catch (e) {
+      print('[BackendApi] Screen PDF error: ${e.message}');
+      return null;
+    }
+  }
+
   // ==================== PAYMENT ====================
 
   /// Создать платёж для книги
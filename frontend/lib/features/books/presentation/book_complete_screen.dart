@@ -267,8 +267,9 @@ class BookCompleteScreen extends HookConsumerWidget {
                               await Future.delayed(const Duration(milliseconds: 500));
                               final updatedBook = await ref.read(bookProvider(bookId).future);
                               if (updatedBook.finalPdfUrl != null) {
-                                // Теперь можно скачать
-                                final uri = Uri.parse(updatedBook.finalPdfUrl!);
+                                // Теперь можно скачать: лёгкий screen PDF, PRINT-READY final.pdf — запасной вариант
+                                final screenPdfUrl = await api.getScreenPdfUrl(bookId);
+                                final uri = Uri.parse(screenPdfUrl ?? updatedBook.finalPdfUrl!);
                                 if (await canLaunchUrl(uri)) {
                                   await launchUrl(uri, mode: LaunchMode.externalApplication);
                                   if (context.mounted) {
@@ -329,7 +330,10 @@ class BookCompleteScreen extends HookConsumerWidget {
                       isDownloading.value = true;
 
                       try {
-                        final uri = Uri.parse(currentPdfUrl);
+                        // Для чтения и отправки открываем лёгкий screen PDF;
+                        // PRINT-READY final.pdf — запасной вариант, если его не удалось получить
+                        final screenPdfUrl = await ref.read(backendApiProvider).getScreenPdfUrl(bookId);
+                        final uri = Uri.parse(screenPdfUrl ?? currentPdfUrl);
                         if (await canLaunchUrl(uri)) {
                           await launchUrl(uri, mode: LaunchMode.externalApplication);
                         } else {